@@ -1,10 +1,15 @@
-import logging, os, re
-from fastapi import FastAPI
+import logging, os, hmac, json, time, asyncio, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import *
-from sentence_transformers import SentenceTransformer, util
-from methods.baseline import baseline_search
-from methods.reranker import DocSearch
+from methods.baseline import baseline_search, baseline_search_batch
+from methods.answer import build_answer, build_answers, simplify
+from methods.runtime import Runtime
+from methods.encoders import encoder_spec
+from methods.fusion import fusion_strategy
+from methods.metrics import registry, trace, cache_collector, REQUESTS, REQUEST_SECONDS
 
 logging.basicConfig(level=logging.ERROR)
 
@@ -12,75 +17,418 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = ROOT_DIR + "\\sql_store\\chunks.db"
 CHROMA_PATH = ROOT_DIR + "\\chromadb_store"
 MODEL_PATH = ROOT_DIR + "\\model\\learned_reranker.pkl"
+VECTOR_PATH = os.environ.get("VECTOR_PATH", ROOT_DIR + "\\vector_store")
+# "chroma" queries the Chroma collection; "numpy" searches the exported vector_store in-process;
+# "f16" / "int8" / "pq" search its compressed copies in RAM and rescore the best candidates exactly
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+VECTOR_RESCORE = int(os.environ.get("VECTOR_RESCORE", 4))  # f16/int8/pq: exact rescoring of k * this candidates
+# SHARDS_PATH serves the sharded index `ingest.py --shards N` builds (e.g. ROOT_DIR + "\\shards") instead of
+# DB_PATH / CHROMA_PATH / VECTOR_PATH; VECTOR_BACKEND then applies to every shard
+SHARDS_PATH = os.environ.get("SHARDS_PATH")
+# SNAPSHOTS_PATH serves the versioned index snapshots `ingest.py --snapshot` publishes (e.g. ROOT_DIR + "\\snapshots")
+# instead of DB_PATH / CHROMA_PATH / VECTOR_PATH / MODEL_PATH, switching to each new one as it is published
+SNAPSHOTS_PATH = os.environ.get("SNAPSHOTS_PATH")
+# POST /ingest queues documents in INGEST_DIR (jobs.db and the uploaded PDFs) and a background thread builds them
+# into a new snapshot of SNAPSHOTS_PATH from INGEST_PDF_DIR / INGEST_SOURCES, the corpus ingest.py reads
+INGEST_DIR = os.environ.get("INGEST_DIR", ROOT_DIR + "\\ingest_jobs")
+INGEST_PDF_DIR = os.environ.get("INGEST_PDF_DIR", ROOT_DIR + "\\data\\industrial-safety-pdfs")
+INGEST_SOURCES = os.environ.get("INGEST_SOURCES", ROOT_DIR + "\\data\\sources.json")
+# POST /ingest only takes server paths that resolve to a PDF under INGEST_ALLOWED_DIR; unset, documents come by upload only
+INGEST_ALLOWED_DIR = os.environ.get("INGEST_ALLOWED_DIR")
+INGEST_MAX_BYTES = int(os.environ.get("INGEST_MAX_BYTES", 100 << 20))  # largest PDF /ingest/upload accepts
+# /ingest, /ingest/upload, /snapshots/reload and /shards/reload need "Authorization: Bearer <ADMIN_TOKEN>"; unset, they are off
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
 
+MODES = ["baseline", "hybrid", "learned", "cross"]
+
 class AskRequest(BaseModel):
     query: str
     top_k: int = 5
     mode: str = "learned"
+    timing: bool = False  # add a per-stage timing breakdown to the response
+    diversity: float = 0.0  # 0..1: MMR weight against near-identical contexts (not in mode "baseline")
+
+class AskStreamRequest(AskRequest):
+    format: Optional[str] = None  # "ndjson" or "sse"; by default SSE when the Accept header asks for text/event-stream
+
+class IngestDoc(BaseModel):
+    path: str  # a PDF under INGEST_ALLOWED_DIR on the server; it is copied when the job is queued
+    name: Optional[str] = None  # file name in the corpus, by default the path's
+    title: Optional[str] = None
+    url: Optional[str] = None
+
+class IngestRequest(BaseModel):
+    documents: List[IngestDoc] = []  # added, or replacing the document of the same name
+    remove: List[str] = []  # file names to drop from the corpus
+
+class AskBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    mode: str = "learned"
+    timing: bool = False
+    diversity: float = 0.0
 
 app = FastAPI(title="Document Search API")
 
-emb_mod = SentenceTransformer("all-MiniLM-L6-v2")
+# nothing heavy happens at import: the encoder, Chroma and the reranker load on warmup or first use
+rt = Runtime({
+    # ENCODER_BACKEND / ENCODER_THREADS pick a quantised or ONNX encoder; non-torch ones are checked against the index
+    "encoder": encoder_spec(), "encoder_check": os.environ.get("ENCODER_CHECK", "1") != "0", "db_path": DB_PATH, "chroma_path": CHROMA_PATH, "model_file": MODEL_PATH,
+    "backend": VECTOR_BACKEND, "vec_path": VECTOR_PATH, "rescore": VECTOR_RESCORE,
+    # FUSION: how vector and keyword scores are merged ("minmax" or "rrf"); ingest trains the reranker with the same one
+    "fusion": fusion_strategy(),
+    # QUERY_CACHE_DB points the cache's on-disk tier at a SQLite file so it survives restarts; it keeps at most QUERY_CACHE_DB_ROWS entries
+    "cache_ttl": float(os.environ.get("QUERY_CACHE_TTL", 3600)), "cache_db": os.environ.get("QUERY_CACHE_DB"),
+    "cache_disk_rows": int(os.environ.get("QUERY_CACHE_DB_ROWS", 100000)),
+    # CROSS_ENCODER names a cross-encoder model and enables mode "cross": CROSS_POOL fused candidates, reranked within CROSS_BUDGET_MS
+    "cross": {"model": os.environ["CROSS_ENCODER"], "budget_ms": float(os.environ.get("CROSS_BUDGET_MS", 200)),
+              "batch_size": int(os.environ.get("CROSS_BATCH", 16))} if os.environ.get("CROSS_ENCODER") else None,
+    "cross_pool": int(os.environ.get("CROSS_POOL", 100)),
+    # SHARD_WORKERS threads search the shards in parallel (default: one per shard)
+    "shards": {"path": SHARDS_PATH, "workers": int(os.environ.get("SHARD_WORKERS", 0)) or None} if SHARDS_PATH else None,
+    # SNAPSHOT_CHECK_S: how often the published snapshot is checked for a newer one
+    "snapshots": {"path": SNAPSHOTS_PATH, "check_s": float(os.environ.get("SNAPSHOT_CHECK_S", 2))} if SNAPSHOTS_PATH else None,
+    # FTS_MAX_DF drops query terms found in more than that share of chunks (lower is faster on large corpora);
+    # FTS_PREFIX_MIN > 0 turns query terms at least that long into prefix queries on the 6-character prefix index
+    "fts": {"max_df": float(os.environ.get("FTS_MAX_DF", 0.2)), "prefix_min": int(os.environ.get("FTS_PREFIX_MIN", 0))},
+    "encode_max_batch": int(os.environ.get("ENCODE_MAX_BATCH", 32)), "encode_window_ms": float(os.environ.get("ENCODE_WINDOW_MS", 5)),
+})
+rt.on_load(lambda r: registry.collector(cache_collector(r.cache)))
+
+ingest_svc = None
+
+def _start_ingest(r):
+    # every worker process runs one; the job queue lets only one of them build at a time
+    global ingest_svc
+    from ingest.jobs import JobQueue, IngestService, Throttle
+    # ingest stages wait while queries run or ran within INGEST_IDLE_MS, for at most INGEST_MAX_PAUSE_MS per batch
+    idle = float(os.environ.get("INGEST_IDLE_MS", 50)) / 1000
+    thr = Throttle(lambda: r.inflight or time.monotonic() - r.last_query < idle, max_pause_s=float(os.environ.get("INGEST_MAX_PAUSE_MS", 1000)) / 1000)
+    ingest_svc = IngestService(JobQueue(INGEST_DIR), r.model, SNAPSHOTS_PATH, INGEST_PDF_DIR, INGEST_SOURCES, throttle=thr,
+                               on_publish=lambda name: r.snaps.refresh(force=True),
+                               # INGEST_WORKERS extraction processes (1: inline); INGEST_BATCH chunks per encoder call
+                               workers=int(os.environ.get("INGEST_WORKERS", 1)), batch_size=int(os.environ.get("INGEST_BATCH", 16)),
+                               keep=int(os.environ.get("INGEST_KEEP", 2))).start()
+
+if SNAPSHOTS_PATH: rt.on_load(_start_ingest)
+
+# STARTUP_MODE: "background" warms up in a thread while the server already answers probes,
+# "eager" warms up before accepting traffic, "lazy" loads on the first request
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "background")
+
+# retrieval runs off the event loop in a bounded pool
+pool = ThreadPoolExecutor(max_workers=int(os.environ.get("SEARCH_WORKERS", 8)), thread_name_prefix="search")
 
-srch = DocSearch(
-    model=emb_mod, db_path=DB_PATH, chroma_path=CHROMA_PATH, model_file=MODEL_PATH
-)
+@app.on_event("startup")
+def startup():
+    if STARTUP_MODE == "eager": rt.warmup()
+    elif STARTUP_MODE == "background": threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+
+def _warmup():
+    try: rt.warmup()
+    except Exception: logging.exception("warmup failed")  # /ready reports the error; requests retry the load
+
+@app.on_event("shutdown")
+def shutdown():
+    if ingest_svc is not None: ingest_svc.stop()
+    rt.close()
+    pool.shutdown(wait=False)
+
+async def _ready() -> Runtime:
+    if rt.state != "ready": await asyncio.get_running_loop().run_in_executor(pool, rt.load)
+    return rt
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/ready")
+def ready():
+    st = rt.status()
+    # with a warmup scheduled, stay out of rotation until it has finished
+    ok = st["state"] == "ready" and (st["warm"] or STARTUP_MODE == "lazy")
+    return JSONResponse(st, status_code=200 if ok else 503)
 
 @app.post("/ask")
-def ask(req: AskRequest):
+async def ask(req: AskRequest):
     m = req.mode.lower()
     q = req.query
     k = req.top_k
 
-    if m == "baseline":
-        res = baseline_search(model=emb_mod, q=q, top_k=k, chroma_path=CHROMA_PATH)
-    elif m in ["hybrid", "learned"]:
-        ul = m == "learned"
-        res = srch.query_docs(q, top_k=k, ul=ul)
-    else:
-        return {"error": "Invalid mode. Choose 'baseline', 'hybrid', or 'learned'."}
-
-    simp = []
-    for r in res:
-        simp.append({
-            "doc_name": r.get("doc_name"),
-            "doc_title": r.get("doc_title"),
-            "doc_url": r.get("doc_url"),
-            "page_num": r.get("page_num"),
-            "chunk_index": r.get("chunk_index"),
-            "score": r.get("score"),
-            "content": r.get("content")[:1000]
-        })
-
-    if not simp or simp[0]['score'] < 0.5: 
-        return {"answer": None, "reranker_used": m, "contexts": simp, "details": "Could not find a sufficiently relevant document chunk to form an answer."}
-    
-    tct = simp[0]["content"]
-    
-    nt = re.sub(r'\s*\n\s*', ' ', tct).strip()
-    sents = re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s', nt)
-    sents = [s.strip() for s in sents if s.strip()]
-
-    ans = None
-    if sents:
-        qe = emb_mod.encode(q)
-        se = emb_mod.encode(sents)
-        sims = util.cos_sim(qe, se)
-        bsi = sims.argmax()
-        
-        ap = [sents[bsi]]
-
-        if bsi > 0:
-            ap.insert(0, sents[bsi - 1])
-
-        if bsi < len(sents) - 1:
-            ap.append(sents[bsi + 1])
-
-        ans = " ".join(ap)
-    else:
-        ans = tct 
-
-    return {"answer": ans, "reranker_used": m, "contexts": simp}
\ No newline at end of file
+    err = _mode_error(m, req.diversity)
+    if err: return err
+
+    r = await _ready()
+    with trace(req.timing) as tr, r.serving():
+        qe = r.cache.get_embedding(q)
+        if qe is None:
+            t = time.perf_counter()
+            qe = await r.enc.encode(q)
+            tr.add("encode", (time.perf_counter() - t) * 1000)  # includes time queued for a batch
+            r.cache.put_embedding(q, qe)
+        # copy the context so stage spans in the worker thread land in this request's trace
+        out = await asyncio.get_running_loop().run_in_executor(pool, contextvars.copy_context().run, answer, q, qe, k, m, req.diversity)
+    _observe("ask", m, tr)
+    if req.timing: out = {**out, "timing": tr.breakdown()}
+    return out
+
+def _mode_error(m, diversity=0.0):
+    if m not in MODES: return {"error": "Invalid mode. Choose 'baseline', 'hybrid', 'learned' or 'cross'."}
+    if m == "cross" and not rt.cfg["cross"]: return {"error": "Mode 'cross' needs CROSS_ENCODER set to a cross-encoder model."}
+    if not 0 <= diversity <= 1: return {"error": "diversity must be between 0 and 1."}
+    if diversity and m == "baseline": return {"error": "Mode 'baseline' does not support diversity."}
+    return None
+
+def _observe(ep, m, tr):
+    if not registry.enabled: return
+    REQUESTS.inc(endpoint=ep, mode=m)
+    REQUEST_SECONDS.observe(tr.total_ms / 1000, endpoint=ep, mode=m)
+
+def answer(q, qe, k, m, d=0.0):
+    # one index version from retrieval to answer; a snapshot swapped out meanwhile closes after this returns
+    with rt.pin() as s:
+        if m == "baseline":
+            res = baseline_search(model=rt.model, q=q, top_k=k, chroma_path=CHROMA_PATH, q_emb=qe, cache=s.srch.cache, index=s.srch.vindex, store=s.srch.hydrate)
+        else:
+            res = s.srch.query_docs(q, top_k=k, ul=m == "learned", qe=qe, ce=m == "cross", diversity=d)
+        return build_answer(rt.model, qe, res, m, sidx=s.sidx)
+
+# the stage whose ranking a mode returns
+FINAL_STAGE = {"baseline": "vector", "hybrid": "fusion", "learned": "learned", "cross": "cross"}
+
+@app.post("/ask_stream")
+async def ask_stream(req: AskStreamRequest, request: Request):
+    """/ask as a stream of events: each stage's ranked contexts as soon as that stage finishes, then the
+    answer, then the timing summary."""
+    m = req.mode.lower()
+    err = _mode_error(m, req.diversity)
+    if err: return err
+    fmt = req.format or ("sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson")
+    if fmt not in ("ndjson", "sse"): return {"error": "Invalid format. Choose 'ndjson' or 'sse'."}
+    await _ready()
+    return StreamingResponse(_stream(req.query, req.top_k, m, req.diversity, fmt == "sse"),
+                             media_type="text/event-stream" if fmt == "sse" else "application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _frame(ev, sse):
+    d = json.dumps(ev)
+    return f"event: {ev['event']}\ndata: {d}\n\n" if sse else d + "\n"
+
+async def _stream(q, k, m, d, sse):
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    emit = lambda ev: loop.call_soon_threadsafe(events.put_nowait, ev)
+    t0 = time.perf_counter()
+    with rt.serving():
+        try:
+            qe, enc_ms = rt.cache.get_embedding(q), 0.0
+            if qe is None:
+                qe = await rt.enc.encode(q)
+                enc_ms = (time.perf_counter() - t0) * 1000
+                rt.cache.put_embedding(q, qe)
+            fut = loop.run_in_executor(pool, contextvars.copy_context().run, answer_stream, q, qe, k, m, d, emit, t0, enc_ms)
+            # runs after every event the worker emitted: both go through the loop's FIFO callback queue
+            fut.add_done_callback(lambda f: events.put_nowait(None))
+            while True:
+                ev = await events.get()
+                if ev is None: break
+                yield _frame(ev, sse)
+            fut.result()
+        except Exception as e:
+            logging.exception("ask_stream failed")
+            yield _frame({"event": "error", "error": repr(e)}, sse)
+    yield _frame({"event": "done"}, sse)
+
+def answer_stream(q, qe, k, m, d, emit, t0, enc_ms):
+    sent = set()
+    def contexts(stage, res):
+        # a chunk's text goes out once per stream; later stages re-rank it by chunk_id
+        for i, (c, doc) in enumerate(zip(res, simplify(res))):
+            cid = c.get("chunk_id")
+            ev = {"event": "context", "stage": stage, "rank": i, "chunk_id": cid, **doc}
+            if cid in sent: ev = {x: ev[x] for x in ("event", "stage", "rank", "chunk_id", "score")}
+            sent.add(cid)
+            emit(ev)
+    with trace() as tr, rt.pin() as s:
+        tr.add("encode", enc_ms)
+        if m == "baseline":
+            res = baseline_search(model=rt.model, q=q, top_k=k, chroma_path=CHROMA_PATH, q_emb=qe, cache=s.srch.cache, index=s.srch.vindex, store=s.srch.hydrate)
+        else:
+            res = s.srch.query_docs(q, top_k=k, ul=m == "learned", qe=qe, ce=m == "cross", on_stage=contexts, diversity=d)
+        contexts(FINAL_STAGE[m], res)
+        a = build_answer(rt.model, qe, res, m, sidx=s.sidx)
+    tr.total_ms = (time.perf_counter() - t0) * 1000
+    emit({"event": "answer", **{x: v for x, v in a.items() if x != "contexts"}})
+    emit({"event": "timing", **tr.breakdown()})
+    _observe("ask_stream", m, tr)
+
+@app.post("/ask_batch")
+async def ask_batch(req: AskBatchRequest):
+    m = req.mode.lower()
+    err = _mode_error(m, req.diversity)
+    if err: return err
+    await _ready()
+    with trace(req.timing) as tr, rt.serving():
+        res = await asyncio.get_running_loop().run_in_executor(pool, contextvars.copy_context().run, answer_batch, req.queries, req.top_k, m, req.diversity)
+    _observe("ask_batch", m, tr)
+    return {"results": res, "timing": tr.breakdown()} if req.timing else {"results": res}
+
+def answer_batch(qs, k, m, d=0.0):
+    if not qs: return []
+    qes = rt.cache.embed(rt.model, list(qs))
+    with rt.pin() as s:
+        if m == "baseline":
+            res = baseline_search_batch(model=rt.model, qs=qs, top_k=k, chroma_path=CHROMA_PATH, q_embs=qes, cache=s.srch.cache, index=s.srch.vindex, store=s.srch.hydrate)
+        else:
+            res = s.srch.query_docs_batch(qs, top_k=k, ul=m == "learned", qes=qes, ce=m == "cross", diversity=d)
+        return build_answers(rt.model, qes, res, m, sidx=s.sidx)
+
+def _denied(request: Request) -> Optional[JSONResponse]:
+    """None if the request carries the admin token, else the response refusing it."""
+    if not ADMIN_TOKEN: return JSONResponse({"error": "This endpoint is disabled (set ADMIN_TOKEN)."}, status_code=403)
+    got = request.headers.get("authorization", "").encode()
+    if not hmac.compare_digest(got, b"Bearer " + ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "Missing or wrong admin token."}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return None
+
+@app.get("/shards")
+async def shards():
+    r = await _ready()
+    if r.srch.shards is None: return {"error": "Not serving a sharded index (set SHARDS_PATH)."}
+    return r.srch.shards.status()
+
+@app.post("/shards/reload")
+async def shards_reload(request: Request):
+    """Swap in rebuilt shards now instead of at the next manifest check."""
+    err = _denied(request)
+    if err: return err
+    r = await _ready()
+    if r.srch.shards is None: return {"error": "Not serving a sharded index (set SHARDS_PATH)."}
+    try: changed = await asyncio.get_running_loop().run_in_executor(pool, r.srch.shards.refresh, True)
+    except Exception as e: return {"error": f"Reload failed, still serving the previous shards: {e!r}"}
+    return {"swapped": changed, **r.srch.shards.status()}
+
+@app.get("/snapshots")
+async def snapshots():
+    r = await _ready()
+    if r.snaps is None: return {"error": "Not serving index snapshots (set SNAPSHOTS_PATH)."}
+    return r.snaps.status()
+
+@app.post("/snapshots/reload")
+async def snapshots_reload(request: Request):
+    """Switch to the published snapshot now instead of at the next check."""
+    err = _denied(request)
+    if err: return err
+    r = await _ready()
+    if r.snaps is None: return {"error": "Not serving index snapshots (set SNAPSHOTS_PATH)."}
+    try: changed = await asyncio.get_running_loop().run_in_executor(pool, r.snaps.refresh, True)
+    except Exception as e: return {"error": f"Reload failed, still serving the previous snapshot: {e!r}"}
+    return {"swapped": changed, **r.snaps.status()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return (await _ready()).cache.stats()
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def _ingest_name(n):
+    n = os.path.basename(n or "")
+    return n if n.lower().endswith(".pdf") else None
+
+def _ingest_path(p):
+    """p resolved, symlinks included, if that is a PDF file under INGEST_ALLOWED_DIR; else None."""
+    if not INGEST_ALLOWED_DIR: return None
+    root, rp = os.path.realpath(INGEST_ALLOWED_DIR), os.path.realpath(p)
+    try: inside = os.path.commonpath([root, rp]) == root
+    except ValueError: inside = False  # another drive
+    return rp if inside and _ingest_name(rp) and os.path.isfile(rp) else None
+
+async def _ingest_svc():
+    await _ready()
+    return ingest_svc
+
+@app.post("/ingest")
+async def ingest(req: IngestRequest, request: Request):
+    """Queue PDFs under INGEST_ALLOWED_DIR to add or replace and file names to remove; a background build
+    publishes them as a new snapshot. Returns the queued job."""
+    err = _denied(request)
+    if err: return err
+    svc = await _ingest_svc()
+    if svc is None: return {"error": "Ingest needs index snapshots (set SNAPSHOTS_PATH)."}
+    if not req.documents and not req.remove: return {"error": "Nothing to ingest: give documents and/or remove."}
+    add = []
+    for d in req.documents:
+        n = _ingest_name(d.name or d.path)
+        if n is None: return {"error": f"Not a PDF file name: {d.name or d.path}"}
+        if not INGEST_ALLOWED_DIR: return {"error": "Server paths are off (set INGEST_ALLOWED_DIR); send the PDF to /ingest/upload."}
+        src = _ingest_path(d.path)
+        if src is None: return {"error": f"Not a PDF file under INGEST_ALLOWED_DIR: {d.path}"}
+        add.append({"name": n, "title": d.title, "url": d.url, "path": src})
+    rm = [_ingest_name(n) for n in req.remove]
+    if None in rm: return {"error": "remove takes PDF file names."}
+    loop = asyncio.get_running_loop()
+    for d in add: d["file"] = await loop.run_in_executor(pool, svc.jobs.stage, d["name"], d.pop("path"))
+    job = svc.jobs.submit(add, rm)
+    svc.kick()
+    return job
+
+@app.post("/ingest/upload")
+async def ingest_upload(request: Request, name: str, title: Optional[str] = None, url: Optional[str] = None):
+    """Queue one PDF sent as the raw request body (Content-Type: application/pdf), e.g.
+    curl --data-binary @guide.pdf "http://host/ingest/upload?name=guide.pdf&title=..."."""
+    err = _denied(request)
+    if err: return err
+    svc = await _ingest_svc()
+    if svc is None: return {"error": "Ingest needs index snapshots (set SNAPSHOTS_PATH)."}
+    n = _ingest_name(name)
+    if n is None: return {"error": f"Not a PDF file name: {name}"}
+    too_big = JSONResponse({"error": f"The PDF is larger than INGEST_MAX_BYTES ({INGEST_MAX_BYTES} bytes)."}, status_code=413)
+    cl = request.headers.get("content-length", "")
+    if cl.isdigit() and int(cl) > INGEST_MAX_BYTES: return too_big
+    # the body goes to the inbox as it arrives instead of into memory, written off the event loop under a
+    # temporary name, so a client that disconnects or sends too much leaves nothing behind
+    loop = asyncio.get_running_loop()
+    dst = svc.jobs.inbox_path(n)
+    tmp, size, ok = dst + ".part", 0, False
+    f = await loop.run_in_executor(pool, open, tmp, "wb")
+    try:
+        async for b in request.stream():
+            size += len(b)
+            if size > INGEST_MAX_BYTES: break
+            await loop.run_in_executor(pool, f.write, b)
+        else: ok = True
+    finally:
+        await loop.run_in_executor(pool, f.close)
+        if not ok or not size: await loop.run_in_executor(pool, os.remove, tmp)
+    if not ok: return too_big
+    if not size: return {"error": "Empty request body; send the PDF's bytes."}
+    await loop.run_in_executor(pool, os.replace, tmp, dst)
+    job = svc.jobs.submit([{"name": n, "title": title, "url": url, "file": dst}], [])
+    svc.kick()
+    return job
+
+@app.get("/ingest")
+async def ingest_status():
+    svc = await _ingest_svc()
+    if svc is None: return {"error": "Ingest needs index snapshots (set SNAPSHOTS_PATH)."}
+    return svc.status()
+
+@app.get("/ingest/jobs")
+async def ingest_jobs(status: Optional[str] = None, limit: int = 50):
+    svc = await _ingest_svc()
+    if svc is None: return {"error": "Ingest needs index snapshots (set SNAPSHOTS_PATH)."}
+    return {"jobs": svc.jobs.list(status, limit)}
+
+@app.get("/ingest/jobs/{job_id}")
+async def ingest_job(job_id: int):
+    svc = await _ingest_svc()
+    if svc is None: return {"error": "Ingest needs index snapshots (set SNAPSHOTS_PATH)."}
+    j = svc.jobs.get(job_id)
+    if j is None: return JSONResponse({"error": f"No ingest job {job_id}."}, status_code=404)
+    if j["status"] == "running" and svc.current and job_id in svc.current["jobs"]: j["progress"] = dict(svc.current)
+    return j
@@ -0,0 +1,68 @@
+"""
+Speed and retrieval drift of the encoder backends against plain torch. For each backend it reports
+load time, single-query p50 latency, batch throughput on stored chunks, the cosine similarity of its
+embeddings to the indexed vectors, and how much the top-k for the training_data questions changes
+(overlap with torch's top-k and keyword hit rate).
+
+    python -m benchmarks.encoders [--backends torch,torch-int8,onnx,onnx-int8] [--threads 4] [--k 5]
+"""
+import os, time, argparse, statistics, numpy as np
+from methods.encoders import load_encoder, BACKENDS
+from methods.vector_index import get_vector_index
+from train_model.questions import training_data
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(ROOT_DIR, "sql_store", "chunks.db")
+CHROMA_PATH = os.path.join(ROOT_DIR, "chromadb_store")
+VECTOR_PATH = os.path.join(ROOT_DIR, "vector_store")
+
+def _hit(doc, kws):
+    d = doc.lower()
+    return any(k.lower() in d for k in kws)
+
+def bench(name, args, index, docs, X):
+    t = time.perf_counter()
+    try: enc = load_encoder(model=args.model, backend=name, threads=args.threads)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"{name:<11} unavailable: {e}")
+        return None
+    load = time.perf_counter() - t
+    qs = [d["query"] for d in training_data]
+    enc.encode(qs[:1])
+    lat = []
+    for i in range(args.n):
+        t = time.perf_counter(); enc.encode([qs[i % len(qs)]]); lat.append((time.perf_counter() - t) * 1000)
+    t = time.perf_counter(); E = np.asarray(enc.encode(docs, batch_size=32), dtype=np.float32); tput = len(docs) / (time.perf_counter() - t)
+    cos = (E * X).sum(1) / (np.linalg.norm(E, axis=1) * np.linalg.norm(X, axis=1) + 1e-12)
+    hits = index.query(enc.encode(qs).tolist(), args.k)
+    return {"name": name, "load_s": load, "p50_ms": statistics.median(lat), "docs_per_s": tput,
+            "min_cos": float(cos.min()), "mean_cos": float(cos.mean()), "top": [[h[0] for h in r] for r in hits],
+            "kw_hit": statistics.fmean(any(_hit(h[1], d["keywords"]) for h in r) for r, d in zip(hits, training_data))}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default=",".join(BACKENDS))
+    ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--threads", type=int, default=0)
+    ap.add_argument("--n", type=int, default=50, help="single-query encodes timed per backend")
+    ap.add_argument("--docs", type=int, default=256, help="stored chunks re-encoded for throughput and drift")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--vector-backend", choices=["chroma", "numpy"], default="chroma")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--chroma", default=CHROMA_PATH)
+    ap.add_argument("--vectors", default=VECTOR_PATH)
+    a = ap.parse_args()
+
+    index = get_vector_index(a.vector_backend, chroma_path=a.chroma, db_path=a.db, vec_path=a.vectors)
+    docs, X = index.sample(a.docs)
+    X = np.asarray(X, dtype=np.float32)
+    res = [r for r in (bench(b.strip(), a, index, docs, X) for b in a.backends.split(",")) if r]
+    ref = next((r for r in res if r["name"] == "torch"), res[0] if res else None)
+    for r in res:
+        ov = statistics.fmean(len(set(x) & set(y)) / max(len(y), 1) for x, y in zip(r["top"], ref["top"]))
+        print(f"{r['name']:<11} load={r['load_s']:.1f}s p50={r['p50_ms']:.2f}ms (x{ref['p50_ms'] / r['p50_ms']:.2f}) "
+              f"{r['docs_per_s']:.0f} docs/s (x{r['docs_per_s'] / ref['docs_per_s']:.2f}) | cos vs index min={r['min_cos']:.4f} "
+              f"mean={r['mean_cos']:.4f} | top{a.k} overlap vs {ref['name']}={ov:.3f} kw_hit@{a.k}={r['kw_hit']:.3f}")
+
+if __name__ == "__main__":
+    main()
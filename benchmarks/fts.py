@@ -0,0 +1,69 @@
+"""
+Keyword candidate generation: the original whole-question phrase query against methods.fts.KeywordSearch
+(OR of content terms, NEAR pairs, document-frequency pruning, optional prefix terms). Reports candidates
+returned per question, keyword precision@5 (a top-5 chunk containing one of the question's training
+keywords) and latency per question. Pass --init to migrate an older chunks.db (prefix index, chunks_vocab).
+
+    python -m benchmarks.fts [--db sql_store/chunks.db] [--k 30] [--repeat 20] [--init]
+"""
+import os, re, time, argparse, statistics
+from methods.fts import KeywordSearch
+from methods.resources import get_pool
+from train_model.questions import training_data
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(ROOT_DIR, "sql_store", "chunks.db")
+
+PHRASE_SQL = "SELECT c.id, chunk_content(c.content) FROM chunks c JOIN chunks_fts fts ON c.id = fts.rowid WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?"
+
+VARIANTS = {
+    "or": {"near": 0},
+    "or+near": {},
+    "or+near/df<0.5": {"max_df": 0.5},
+    "or+near/no-df": {"max_df": 1.0},
+    "or+near/prefix": {"prefix_min": 7},
+}
+
+def phrase(db_path):
+    pool = get_pool(db_path)
+    def run(qs, k):
+        with pool.conn() as con:
+            return [con.execute(PHRASE_SQL, ('"' + re.sub(r"[^\w\s]", "", q) + '"', k)).fetchall() for q in qs]
+    return run
+
+def keyword(db_path, opts):
+    kw = KeywordSearch(db_path, **opts)
+    return lambda qs, k: [[(c[0], c[1]) for c in r] for r in kw.search(qs, k)]
+
+def bench(name, run, k, repeat):
+    qs = [d["query"] for d in training_data]
+    res = run(qs, k)
+    p5 = []
+    for d, r in zip(training_data, res):
+        kws = [w.lower() for w in d["keywords"]]
+        p5.append(sum(any(w in (c[1] or "").lower() for w in kws) for c in r[:5]) / 5)
+    ts = []
+    for _ in range(repeat):
+        for q in qs:
+            t = time.perf_counter(); run([q], k); ts.append((time.perf_counter() - t) * 1000)
+    ts.sort()
+    print(f"{name:<16} hits/q={statistics.fmean(map(len, res)):5.1f} kw-P@5={statistics.fmean(p5):.3f} "
+          f"p50={statistics.median(ts):.2f}ms p95={ts[int(0.95 * (len(ts) - 1))]:.2f}ms")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--k", type=int, default=30)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--init", action="store_true", help="run ingest's init_db migration on --db first")
+    a = ap.parse_args()
+    if a.init:
+        from ingest.pdf_chunker import init_db
+        t = time.perf_counter(); init_db(a.db)
+        print(f"Migrated {a.db} in {time.perf_counter() - t:.2f}s")
+    bench("phrase", phrase(a.db), a.k, a.repeat)
+    for name, opts in VARIANTS.items():
+        bench(name, keyword(a.db, opts), a.k, a.repeat)
+
+if __name__ == "__main__":
+    main()
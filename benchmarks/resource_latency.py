@@ -0,0 +1,73 @@
+"""
+Before/after latency of the query-path resources: a fresh Chroma client / SQLite connection per call
+(the old behaviour) vs. the shared handles from methods.resources.
+
+    python -m benchmarks.resource_latency [--n 200] [--skip-chroma]
+"""
+import os, re, time, sqlite3, argparse, statistics
+from methods.resources import get_collection, get_pool
+from train_model.questions import training_data
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(ROOT_DIR, "sql_store", "chunks.db")
+CHROMA_PATH = os.path.join(ROOT_DIR, "chromadb_store")
+
+# the original phrase query; this benchmark is about connection handling, not query shape
+FTS_SQL = """SELECT c.id, c.doc_name, c.doc_title, c.doc_url, c.chunk_index, c.page_num, c.content, bm25(chunks_fts) AS score FROM chunks c JOIN chunks_fts fts ON c.id = fts.rowid WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?"""
+
+def _fts_q(q):
+    return '"' + re.sub(r"[^\w\s]", "", q) + '"'
+
+def _time(fn, n):
+    ts = []
+    for i in range(n):
+        t = time.perf_counter(); fn(i); ts.append((time.perf_counter() - t) * 1000)
+    ts.sort()
+    return {"p50": statistics.median(ts), "p95": ts[int(0.95 * (len(ts) - 1))], "mean": statistics.fmean(ts)}
+
+def _report(name, before, after):
+    print(f"{name:<8} before p50={before['p50']:.3f}ms p95={before['p95']:.3f}ms | "
+          f"after p50={after['p50']:.3f}ms p95={after['p95']:.3f}ms | speedup x{before['p50'] / max(after['p50'], 1e-9):.1f}")
+
+def bench_fts(db_path, n):
+    qs = [_fts_q(d["query"]) for d in training_data]
+
+    def fresh(i):
+        con = sqlite3.connect(db_path); con.row_factory = sqlite3.Row
+        con.execute(FTS_SQL, (qs[i % len(qs)], 30)).fetchall(); con.close()
+
+    pool = get_pool(db_path)
+    def pooled(i):
+        with pool.conn() as con: con.execute(FTS_SQL, (qs[i % len(qs)], 30)).fetchall()
+
+    pooled(0)
+    _report("fts", _time(fresh, n), _time(pooled, n))
+
+def bench_chroma(chroma_path, n):
+    import chromadb
+    from chromadb.config import Settings
+    dim = get_collection(chroma_path).get(limit=1, include=["embeddings"])["embeddings"][0]
+    qe = [float(x) for x in dim]
+
+    def fresh(i):
+        cli = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
+        cli.get_collection("safety_docs").query(query_embeddings=[qe], n_results=5)
+
+    coll = get_collection(chroma_path)
+    def shared(i):
+        coll.query(query_embeddings=[qe], n_results=5)
+
+    _report("chroma", _time(fresh, n), _time(shared, n))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--chroma", default=CHROMA_PATH)
+    ap.add_argument("--skip-chroma", action="store_true")
+    a = ap.parse_args()
+    bench_fts(a.db, a.n)
+    if not a.skip_chroma: bench_chroma(a.chroma, a.n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Sharded retrieval: recall of the heap-merged vector top k against a brute-force search over every shard's
+vectors, and per-query latency of the vector, keyword and hybrid stages with the shards searched one after
+another (--workers 1) or all at once. --single adds the same stages on an unsharded corpus for comparison.
+A synthetic sharded corpus is built first if --root has no shards.json.
+
+    python -m benchmarks.shards --root bench_data/20k_x4 [--n 20000 --shards 4] [--backend numpy] [--single bench_data/20k]
+"""
+import os, time, argparse, statistics, numpy as np
+from methods.shards import ShardSet, shard_paths, load_manifest
+from methods.reranker import DocSearch
+from benchmarks.synthetic import build_sharded, corpus_paths
+from train_model.questions import training_data
+
+def _queries(vec_dirs, n, noise, seed=0):
+    X = np.concatenate([np.load(os.path.join(d, "vectors.npy")) for d in vec_dirs])
+    ids = np.concatenate([np.load(os.path.join(d, "ids.npy")) for d in vec_dirs])
+    rng = np.random.default_rng(seed)
+    Q = X[rng.integers(0, len(X), n)] + rng.normal(0, noise, (n, X.shape[1])).astype(np.float32)
+    return Q, X, ids
+
+def _recall(index, Q, X, ids, k):
+    d = (Q * Q).sum(1)[:, None] + (X * X).sum(1)[None, :] - 2 * Q @ X.T
+    truth = [set(ids[np.argsort(r, kind="stable")[:k]].tolist()) for r in d]
+    res = index.query(Q.tolist(), k)
+    return statistics.fmean(len({int(h[0]) for h in r} & t) / k for r, t in zip(res, truth))
+
+def _time(fn, items):
+    ts = []
+    for x in items:
+        t = time.perf_counter(); fn(x); ts.append((time.perf_counter() - t) * 1000)
+    ts.sort()
+    return f"p50={statistics.median(ts):.2f}ms p95={ts[int(0.95 * (len(ts) - 1))]:.2f}ms"
+
+def bench(name, srch, Q, qs, k):
+    qes = Q.tolist()
+    print(f"{name:<16} vector {_time(lambda qe: srch.get_vector_candidates_batch([qe], k), qes)} | "
+          f"fts {_time(lambda q: srch.get_fts_candidates_batch([q], srch.fts_k), qs)} | "
+          f"hybrid {_time(lambda i: srch._search_batch([qs[i % len(qs)]], k, False, [qes[i]]), range(len(qes)))}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--root", required=True)
+    ap.add_argument("--n", type=int, default=20000, help="chunks, when building the corpus")
+    ap.add_argument("--shards", type=int, default=4, help="shards, when building the corpus")
+    ap.add_argument("--single", help="an unsharded corpus root (benchmarks.synthetic layout) to compare with")
+    ap.add_argument("--backend", default="numpy")
+    ap.add_argument("--q", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--noise", type=float, default=0.02)
+    a = ap.parse_args()
+    if load_manifest(a.root) is None: build_sharded(a.root, a.n, a.shards, sentences=False)
+    m = load_manifest(a.root)
+    dirs = [shard_paths(os.path.join(a.root, e["path"]))["vectors"] for e in m["shards"] if e.get("chunks")]
+    Q, X, ids = _queries(dirs, a.q, a.noise)
+    qs = [d["query"] for d in training_data]
+    print(f"{len(ids)} chunks in {len(dirs)} shards, {a.backend} backend")
+    for w in sorted({1, len(dirs)}):
+        ss = ShardSet(a.root, backend=a.backend, workers=w)
+        if w == 1: print(f"recall@{a.k} of the merged top k vs. brute force over all shards: {_recall(ss, Q, X, ids, a.k):.4f}")
+        bench(f"sharded/w{w}", DocSearch(None, None, None, os.path.join(a.root, "none.pkl"), shards=ss), Q, qs, a.k)
+    if a.single:
+        p = corpus_paths(a.single)
+        Qs, _, _ = _queries([p["vectors"]], a.q, a.noise)
+        bench("single", DocSearch(None, p["db"], p["chroma"], p["model"], backend=a.backend, vec_path=p["vectors"]), Qs, qs, a.k)
+
+if __name__ == "__main__":
+    main()
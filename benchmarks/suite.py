@@ -0,0 +1,268 @@
+"""
+Latency/throughput suite for the three retrieval modes. Drives baseline_search_batch and
+DocSearch.query_docs_batch directly ("lib") or the FastAPI app in-process ("app"), at several
+concurrency levels, and reports p50/p95/p99 latency, QPS, per-stage self time (encode, vector,
+fts, fusion, learned, answer) and process memory. Results are written as JSON.
+
+    python -m benchmarks.suite --modes baseline,hybrid,learned --concurrency 1,8 --n 200
+    python -m benchmarks.suite --scale 1000,10000,100000 --backend numpy   # synthetic corpora
+    python -m benchmarks.suite --target app --concurrency 1,16
+
+On synthetic corpora the query set is phrases cut from random chunks, and their vectors are
+noisy copies of those chunks' vectors (the encoder still runs, so its cost is measured).
+"""
+import os, sys, json, time, shutil, asyncio, argparse, platform, threading, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+from train_model.questions import training_data
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ["baseline", "hybrid", "learned", "cross"]
+
+class StageTimer:
+    """Records per-call self time of wrapped callables; nested stages are subtracted from their parent."""
+
+    def __init__(self):
+        self._tl = threading.local()
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+
+    def wrap(self, obj, attr, stage):
+        fn = getattr(obj, attr)
+        if getattr(fn, "_stage", None): return  # already timed (targets can share the encoder)
+        def timed(*a, **kw):
+            st = self._tl.__dict__.setdefault("stack", [])
+            st.append(0.0)
+            t = time.perf_counter()
+            try: return fn(*a, **kw)
+            finally:
+                el = time.perf_counter() - t
+                child = st.pop()
+                if st: st[-1] += el
+                with self._lock: self.samples.setdefault(stage, []).append((el - child) * 1000)
+        timed._stage = stage
+        setattr(obj, attr, timed)
+
+    def reset(self):
+        with self._lock: self.samples = {}
+
+    def report(self, wall_ms):
+        out = {}
+        with self._lock:
+            for k, v in self.samples.items():
+                a = np.asarray(v)
+                out[k] = {"calls": len(a), "total_ms": float(a.sum()), "p50_ms": float(np.percentile(a, 50)),
+                          "p95_ms": float(np.percentile(a, 95)), "share": float(a.sum() / max(wall_ms, 1e-9))}
+        return out
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError: pass
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError): return None
+
+def peak_rss_mb():
+    try:
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r / 2**20 if sys.platform == "darwin" else r / 2**10
+    except ImportError: return None
+
+def _pct(a):
+    a = np.asarray(a)
+    return {"p50": float(np.percentile(a, 50)), "p95": float(np.percentile(a, 95)), "p99": float(np.percentile(a, 99)),
+            "mean": float(a.mean()), "max": float(a.max())}
+
+def load_queries(path):
+    if path is None: return [d["query"] for d in training_data]
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [q["query"] if isinstance(q, dict) else q for q in json.load(f)]
+        return [l.strip() for l in f if l.strip()]
+
+def synthetic_queries(db_path, vec_path, n, noise=0.01, seed=1):
+    from methods.chunk_store import connect
+    rng = np.random.default_rng(seed)
+    X = np.load(os.path.join(vec_path, "vectors.npy"), mmap_mode="r")
+    ids = np.load(os.path.join(vec_path, "ids.npy"))
+    pick = rng.integers(0, len(ids), n)
+    con = connect(db_path)
+    qs = []
+    for i in pick:
+        ws = con.execute("SELECT chunk_content(content) FROM chunks WHERE id = ?", (int(ids[i]),)).fetchone()[0].replace(".", "").split()
+        s = int(rng.integers(0, max(len(ws) - 6, 1)))
+        qs.append(" ".join(ws[s:s + int(rng.integers(3, 7))]))
+    con.close()
+    Q = np.asarray(X[pick], dtype=np.float32) + rng.normal(0, noise, (n, X.shape[1])).astype(np.float32)
+    return qs, (Q / np.linalg.norm(Q, axis=1, keepdims=True)).tolist()
+
+class LibTarget:
+    def __init__(self, model, paths, backend, cache, timer, cross=None, pool_k=100):
+        from methods.reranker import DocSearch
+        from methods.sentence_index import SentenceIndex
+        from methods.cache import QueryCache
+        from methods.answer import SNIPPET_CHARS
+        from methods.fusion import fusion_strategy
+        self.model, self.paths = model, paths
+        self.cache = QueryCache(paths["db"]) if cache else None
+        self.srch = DocSearch(model=model, db_path=paths["db"], chroma_path=paths["chroma"], model_file=paths["model"],
+                              cache=self.cache, backend=backend, vec_path=paths["vectors"], cross=cross, pool_k=pool_k,
+                              snippet=SNIPPET_CHARS, fusion=fusion_strategy())
+        self.sidx = SentenceIndex(paths["db"])
+        timer.wrap(model, "encode", "encode")
+        timer.wrap(self.srch.vindex, "nearest", "vector")
+        timer.wrap(self.srch.kw, "ranked", "fts")
+        timer.wrap(self.srch, "hybrid_rerank", "fusion")
+        timer.wrap(self.srch, "learned_rerank_batch", "learned")
+        if cross is not None: timer.wrap(cross, "rerank_batch", "cross")
+        import methods.answer as answer
+        self.build_answers = answer.build_answers
+        timer.wrap(self, "build_answers", "answer")
+
+    def run(self, mode, qs, qvs=None):
+        from methods.baseline import baseline_search_batch
+        qes = self.cache.embed(self.model, qs) if self.cache else self.model.encode(qs).tolist()
+        if qvs is not None: qes = qvs
+        if mode == "baseline":
+            res = baseline_search_batch(self.model, qs, self.paths["chroma"], 5, q_embs=qes, cache=self.cache, index=self.srch.vindex, store=self.srch.hydrate)
+        else:
+            res = self.srch.query_docs_batch(qs, 5, ul=mode == "learned", qes=qes, ce=mode == "cross")
+        return self.build_answers(self.model, qes, res, mode, sidx=self.sidx)
+
+    def drive(self, mode, batches, conc):
+        lat = []
+        def one(b):
+            t = time.perf_counter(); self.run(mode, *b); lat.append((time.perf_counter() - t) * 1000)
+        with ThreadPoolExecutor(conc) as ex: list(ex.map(one, batches))
+        return lat
+
+class AppTarget:
+    """The real app module (its own paths and backend), called through an in-process ASGI transport."""
+
+    def __init__(self, cache, timer):
+        import app
+        self.app = app
+        rt = app.rt.warmup()
+        if not cache:
+            for t in (rt.cache.emb, rt.cache.res): t.maxsize, t.disk = 0, None
+        timer.wrap(rt.model, "encode", "encode")
+        timer.wrap(rt.srch.vindex, "nearest", "vector")
+        timer.wrap(rt.srch.kw, "ranked", "fts")
+        timer.wrap(rt.srch, "hybrid_rerank", "fusion")
+        timer.wrap(rt.srch, "learned_rerank_batch", "learned")
+        if rt.srch.cross is not None: timer.wrap(rt.srch.cross, "rerank_batch", "cross")
+        timer.wrap(app, "build_answer", "answer")
+        timer.wrap(app, "build_answers", "answer")
+
+    def drive(self, mode, batches, conc):
+        import httpx
+        lat = []
+        async def go():
+            sem = asyncio.Semaphore(conc)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app.app), base_url="http://bench", timeout=None) as cli:
+                async def one(b):
+                    qs = b[0]
+                    async with sem:
+                        t = time.perf_counter()
+                        if len(qs) == 1: r = await cli.post("/ask", json={"query": qs[0], "top_k": 5, "mode": mode})
+                        else: r = await cli.post("/ask_batch", json={"queries": qs, "top_k": 5, "mode": mode})
+                        r.raise_for_status()
+                        lat.append((time.perf_counter() - t) * 1000)
+                await asyncio.gather(*(one(b) for b in batches))
+        asyncio.run(go())
+        return lat
+
+def _batches(qs, qvs, n, batch):
+    out = []
+    for s in range(0, n, batch):
+        ix = [(s + j) % len(qs) for j in range(min(batch, n - s))]
+        out.append(([qs[i] for i in ix], None if qvs is None else [qvs[i] for i in ix]))
+    return out
+
+def bench(target, timer, modes, concs, qs, qvs, n, batch, warmup, corpus, n_chunks):
+    runs = []
+    for mode in modes:
+        target.drive(mode, _batches(qs, qvs, warmup * batch, batch), 1)
+        for conc in concs:
+            timer.reset()
+            rss0 = rss_mb()
+            t = time.perf_counter()
+            lat = target.drive(mode, _batches(qs, qvs, n, batch), conc)
+            wall = (time.perf_counter() - t) * 1000
+            r = {"corpus": corpus, "n_chunks": n_chunks, "target": type(target).__name__[:-6].lower(), "mode": mode,
+                 "concurrency": conc, "batch": batch, "requests": len(lat), "queries": n, "wall_s": wall / 1000,
+                 "qps": n / (wall / 1000), "latency_ms": _pct(lat), "stages": timer.report(wall * conc),
+                 "memory": {"rss_mb_before": rss0, "rss_mb_after": rss_mb(), "peak_rss_mb": peak_rss_mb()}}
+            runs.append(r); _print(r)
+    return runs
+
+def _print(r):
+    l = r["latency_ms"]
+    st = " ".join(f"{k}={v['total_ms'] / r['queries']:.2f}" for k, v in sorted(r["stages"].items()))
+    print(f"{r['corpus']:<10} {r['mode']:<8} c={r['concurrency']:<3} b={r['batch']:<3} qps={r['qps']:8.1f} "
+          f"p50={l['p50']:7.2f} p95={l['p95']:7.2f} p99={l['p99']:7.2f} ms | per-query ms: {st} | rss={r['memory']['rss_mb_after'] or 0:.0f}MB")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target", choices=["lib", "app"], default="lib")
+    ap.add_argument("--modes", default=",".join(MODES[:3]), help="cross needs --cross-encoder (or CROSS_ENCODER for --target app)")
+    ap.add_argument("--concurrency", default="1,4")
+    ap.add_argument("--batch", type=int, default=1, help="queries per request (>1 uses the batch APIs)")
+    ap.add_argument("--n", type=int, default=200, help="measured queries per run")
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--queries", help=".json list / training_data-style dicts, or one query per line")
+    ap.add_argument("--root", default=ROOT_DIR, help="corpus root for --target lib (sql_store/, chromadb_store/, vector_store/)")
+    ap.add_argument("--scale", help="comma-separated synthetic corpus sizes, e.g. 1000,10000,1000000")
+    ap.add_argument("--work-dir", default=os.path.join(ROOT_DIR, "bench_data"))
+    ap.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    ap.add_argument("--cache", action="store_true", help="keep the query cache on (measures warm hits)")
+    ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--encoder", help="encoder backend for --target lib (torch, torch-int8, onnx, onnx-int8; default ENCODER_BACKEND)")
+    ap.add_argument("--cross-encoder", help="cross-encoder model for mode cross with --target lib")
+    ap.add_argument("--cross-budget", type=float, default=200.0, help="cross-encoder latency budget per call, ms")
+    ap.add_argument("--cross-pool", type=int, default=100, help="fused candidates handed to the cross-encoder")
+    ap.add_argument("--out", default=os.path.join(ROOT_DIR, "bench_results.json"))
+    a = ap.parse_args()
+
+    modes = [m.strip() for m in a.modes.split(",") if m.strip() in MODES]
+    concs = [int(c) for c in a.concurrency.split(",")]
+    timer = StageTimer()
+    runs = []
+    if a.target == "app":
+        if a.scale: ap.error("--scale only applies to --target lib")
+        tgt = AppTarget(a.cache, timer)
+        runs += bench(tgt, timer, modes, concs, load_queries(a.queries), None, a.n, a.batch, a.warmup, "app", None)
+    else:
+        from methods.encoders import load_encoder
+        from benchmarks.synthetic import build_corpus, corpus_paths
+        model = load_encoder(model=a.model, backend=a.encoder)
+        cross = None
+        if a.cross_encoder:
+            from methods.cross_encoder import CrossReranker
+            cross = CrossReranker(a.cross_encoder, budget_ms=a.cross_budget)
+        if "cross" in modes and cross is None: ap.error("mode cross needs --cross-encoder")
+        if a.scale:
+            for n in [int(s) for s in a.scale.split(",")]:
+                root = os.path.join(a.work_dir, f"n{n}")
+                p = corpus_paths(root)
+                if not os.path.exists(os.path.join(p["vectors"], "ids.npy")) or (a.backend == "chroma" and not os.path.exists(p["chroma"])):
+                    build_corpus(root, n, dim=model.get_sentence_embedding_dimension(), chroma=a.backend == "chroma")
+                real = corpus_paths(ROOT_DIR)["model"]
+                if not os.path.exists(p["model"]) and os.path.exists(real): shutil.copy(real, p["model"])
+                qs, qvs = (load_queries(a.queries), None) if a.queries else synthetic_queries(p["db"], p["vectors"], max(a.n, 64))
+                runs += bench(LibTarget(model, p, a.backend, a.cache, timer, cross, a.cross_pool), timer, modes, concs, qs, qvs, a.n, a.batch, a.warmup, f"n{n}", n)
+        else:
+            from benchmarks.synthetic import corpus_paths
+            p = corpus_paths(a.root)
+            runs += bench(LibTarget(model, p, a.backend, a.cache, timer, cross, a.cross_pool), timer, modes, concs, load_queries(a.queries), None, a.n, a.batch, a.warmup, os.path.basename(a.root) or "root", None)
+
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "args": vars(a)}
+    with open(a.out, "w") as f: json.dump({"meta": meta, "runs": runs}, f, indent=2)
+    print(f"\nWrote {len(runs)} runs to {a.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Synthetic corpora for scaling benchmarks. Builds a root directory laid out like the repo's
+(sql_store/chunks.db with FTS, vector_store/, optionally chromadb_store/ and the sentence index)
+without PDFs or an encoder: chunk text is drawn from a Zipfian vocabulary seeded with the
+training questions' words, and vectors are noisy copies of per-topic centroids, so FTS and
+vector search both have realistic hit distributions.
+
+    python -m benchmarks.synthetic --n 100000 --out bench_data/100k [--chroma] [--no-sentences] [--shards 4]
+
+With --shards, out becomes a sharded index (methods.shards) whose shards split the n chunks.
+"""
+import os, re, json, time, argparse, numpy as np
+from ingest.pdf_chunker import init_db
+from ingest.index_meta import bump_index_version
+from ingest.sentences import _setup as setup_sentences
+from methods.chunk_store import connect, pack_chunks
+from methods.answer import split_sentences, SNIPPET_CHARS
+from methods.shards import save_manifest
+from train_model.questions import training_data
+
+CHUNKS_PER_DOC = 50
+
+def corpus_paths(root):
+    return {"db": os.path.join(root, "sql_store", "chunks.db"), "chroma": os.path.join(root, "chromadb_store"),
+            "vectors": os.path.join(root, "vector_store"), "model": os.path.join(root, "model", "learned_reranker.pkl")}
+
+def _vocab(size, rng):
+    seed = []
+    for d in training_data:
+        for w in re.findall(r"[a-z][a-z0-9\-]+", d["query"].lower()):
+            if w not in seed: seed.append(w)
+    alpha = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    extra = {"".join(rng.choice(alpha, rng.integers(3, 11))) for _ in range(size * 2)} - set(seed)
+    return np.array(seed + sorted(extra)[:max(size - len(seed), 0)])
+
+def _texts(rng, vocab, topics, words, zipf):
+    """One chunk of text per topic id: mostly global Zipfian words plus a topic-specific slice."""
+    n, V = len(topics), len(vocab)
+    idx = np.minimum(rng.zipf(zipf, (n, words)) - 1, V - 1)
+    local = rng.random((n, words)) < 0.3
+    idx = np.where(local, (topics[:, None] * 97 + rng.integers(0, 64, (n, words))) % V, idx)
+    ends = rng.random((n, words)) < 1 / 12
+    out = []
+    for r in range(n):
+        ws = vocab[idx[r]].astype(object)
+        ws[ends[r]] = ws[ends[r]] + "."
+        out.append(" ".join(ws) + ".")
+    return out
+
+def _vectors(rng, centers, topics, noise):
+    X = centers[topics] + rng.normal(0, noise, (len(topics), centers.shape[1])).astype(np.float32)
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+def build_corpus(root, n, dim=384, words=150, vocab_size=50000, zipf=1.3, noise=0.6, block=50000,
+                 sentences=True, chroma=False, seed=0, shard=0, n_shards=1, topics=None):
+    """Write an n-chunk corpus under root and return its corpus_paths(). As shard i of n_shards it
+    shares the vocabulary and topics of the other shards and uses ids (and document numbers) = i mod n_shards."""
+    p = corpus_paths(root)
+    for d in (os.path.dirname(p["db"]), p["vectors"], os.path.dirname(p["model"])): os.makedirs(d, exist_ok=True)
+    if os.path.exists(p["db"]): os.remove(p["db"])
+    for f in os.listdir(os.path.dirname(p["db"])):
+        if f.startswith("sent_emb."): os.remove(os.path.join(os.path.dirname(p["db"]), f))
+    rng = np.random.default_rng(seed)
+    vocab = _vocab(vocab_size, rng)
+    centers = rng.normal(0, 1, (topics or int(min(1024, max(16, n // 2000))), dim)).astype(np.float32)
+    if n_shards > 1: rng = np.random.default_rng([seed, shard])
+
+    init_db(p["db"])
+    con = connect(p["db"])
+    con.execute("DROP TRIGGER IF EXISTS chunks_ai")  # FTS is rebuilt in one pass at the end
+    con.execute("DROP TRIGGER IF EXISTS chunks_au")
+    setup_sentences(con)
+    X = np.lib.format.open_memmap(os.path.join(p["vectors"], "vectors.npy"), mode="w+", dtype=np.float32, shape=(n, dim))
+    sq = np.zeros(n, np.float32)
+    sf = None
+    if sentences:
+        fname = f"sent_emb.{int(time.time() * 1000)}.f16"
+        sf = open(os.path.join(os.path.dirname(p["db"]), fname), "wb")
+    coll = None
+    if chroma:
+        from methods.resources import get_client
+        cli = get_client(p["chroma"])
+        try: cli.delete_collection("safety_docs")
+        except Exception: pass  # no previous collection
+        coll = cli.get_or_create_collection("safety_docs")
+
+    t0, pos = time.perf_counter(), 0
+    for s in range(0, n, block):
+        e = min(s + block, n)
+        ids = np.arange(s + 1, e + 1) * n_shards + shard
+        topics = rng.integers(0, len(centers), e - s)
+        txt = _texts(rng, vocab, topics, words, zipf)
+        V = _vectors(rng, centers, topics, noise)
+        X[s:e] = V; sq[s:e] = (V * V).sum(1)
+        rows = []
+        for i, cid in enumerate(ids):
+            doc, ci = divmod(s + i, CHUNKS_PER_DOC)
+            doc = doc * n_shards + shard
+            rows.append((int(cid), f"synthetic-{doc:06d}.pdf", f"Synthetic document {doc}", "", ci, txt[i], int(ci == 0), ci // 3 + 1, len(txt[i].split())))
+        con.executemany("INSERT INTO chunks (id, doc_name, doc_title, doc_url, chunk_index, content, is_title, page_num, n_tokens) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if sf is not None:
+            out = []
+            for i, cid in enumerate(ids):
+                ss = split_sentences(txt[i][:SNIPPET_CHARS])
+                E = _vectors(rng, centers, np.full(len(ss), topics[i]), noise)
+                sf.write(E.astype(np.float16).tobytes())
+                out.append((int(cid), pos, len(ss), json.dumps(ss))); pos += len(ss)
+            con.executemany("INSERT INTO chunk_sentences (chunk_id, start, n, sents) VALUES (?, ?, ?, ?)", out)
+        if coll is not None:
+            for c in range(0, e - s, 5000):
+                r = rows[c:c+5000]
+                coll.upsert(ids=[str(x[0]) for x in r], embeddings=V[c:c+5000].tolist(), documents=[x[5] for x in r],
+                            metadatas=[{"doc_name": x[1], "doc_title": x[2], "doc_url": x[3], "chunk_index": x[4], "is_title": x[6], "page_num": x[7]} for x in r])
+        con.commit()
+        print(f"  {e}/{n} chunks ({time.perf_counter() - t0:.1f}s)")
+
+    con.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+    con.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize')")
+    pack_chunks(con, p["db"])  # stored like an ingested corpus, once 'rebuild' has read the plain text
+    if sf is not None:
+        sf.close()
+        con.executemany("INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)", [("sent_file", fname), ("sent_dim", str(dim))])
+    con.commit(); con.execute("VACUUM"); con.close()
+    init_db(p["db"])  # restore the insert and update triggers
+    X.flush(); del X
+    np.save(os.path.join(p["vectors"], "ids.npy"), np.arange(1, n + 1, dtype=np.int64) * n_shards + shard)
+    np.save(os.path.join(p["vectors"], "norms.npy"), sq)
+    bump_index_version(p["db"])
+    print(f"Synthetic corpus of {n} chunks at {root} in {time.perf_counter() - t0:.1f}s")
+    return p
+
+def build_sharded(root, n, n_shards, **kw):
+    """n chunks split over n_shards shard directories under root, plus the shards.json that serves them."""
+    os.makedirs(root, exist_ok=True)
+    shards = []
+    for i in range(n_shards):
+        name, m = f"shard_{i:02d}", n // n_shards + (i < n % n_shards)
+        build_corpus(os.path.join(root, name + ".g1"), m, shard=i, n_shards=n_shards, topics=int(min(1024, max(16, n // 2000))), **kw)
+        shards.append({"name": name, "path": name + ".g1", "gen": 1, "chunks": m, "prev": None})
+    save_manifest(root, {"n": n_shards, "partition": "hash", "gen": n_shards, "shards": shards})
+    return root
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=10000)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--words", type=int, default=150)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--chroma", action="store_true", help="also load the vectors into a Chroma collection (slow for large n)")
+    ap.add_argument("--no-sentences", action="store_true", help="skip the sentence index; answers then encode sentences per query")
+    ap.add_argument("--shards", type=int, default=0, help="split the corpus over this many shards")
+    a = ap.parse_args()
+    kw = dict(dim=a.dim, words=a.words, sentences=not a.no_sentences, chroma=a.chroma, seed=a.seed)
+    if a.shards: build_sharded(a.out, a.n, a.shards, **kw)
+    else: build_corpus(a.out, a.n, **kw)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Recall, latency and resident vector memory of the vector backends: Chroma, the exact numpy search and
+its compressed f16 / int8 / pq variants (with --rescore 0 for their raw approximate recall). Queries are
+stored chunk vectors plus Gaussian noise, so no encoder is needed; recall@k is measured against an exact
+brute-force top-k.
+
+    python -m benchmarks.vector_backends [--n 200] [--k 10] [--batch 1] [--rescore 4] [--export] [--compress]
+"""
+import os, time, argparse, statistics, numpy as np
+from methods.resources import get_collection
+from methods.vector_index import get_vector_index, export_vector_index, compress_vector_index, COMPRESSED
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(ROOT_DIR, "sql_store", "chunks.db")
+CHROMA_PATH = os.path.join(ROOT_DIR, "chromadb_store")
+VECTOR_PATH = os.path.join(ROOT_DIR, "vector_store")
+
+def _queries(vec_path, n, noise, seed=0):
+    X = np.load(os.path.join(vec_path, "vectors.npy"), mmap_mode="r")
+    rng = np.random.default_rng(seed)
+    Q = np.asarray(X[rng.integers(0, len(X), n)], dtype=np.float32)
+    return Q + rng.normal(0, noise, Q.shape).astype(np.float32)
+
+def _exact(vec_path, Q, k):
+    X = np.asarray(np.load(os.path.join(vec_path, "vectors.npy")), dtype=np.float32)
+    ids = np.load(os.path.join(vec_path, "ids.npy"))
+    d = (Q * Q).sum(1)[:, None] + (X * X).sum(1)[None, :] - 2 * Q @ X.T
+    return [set(ids[np.argsort(r, kind="stable")[:k]].astype(str)) for r in d]
+
+def bench(name, index, Q, k, batch, truth, n_vec):
+    ts, rec = [], []
+    for s in range(0, len(Q), batch):
+        qb = Q[s:s+batch].tolist()
+        t = time.perf_counter(); res = index.query(qb, k); ts.append((time.perf_counter() - t) * 1000)
+        for r, tr in zip(res, truth[s:s+batch]): rec.append(len({h[0] for h in r} & tr) / len(tr))
+    ts.sort()
+    mem = f"{sum(index.memory().values()) / n_vec:.0f} B/vector in RAM" if hasattr(index, "memory") else "n/a"
+    print(f"{name:<12} recall@{k}={statistics.fmean(rec):.4f} p50={statistics.median(ts):.3f}ms "
+          f"p95={ts[int(0.95 * (len(ts) - 1))]:.3f}ms per {batch}-query call | {mem}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--noise", type=float, default=0.02)
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--chroma", default=CHROMA_PATH)
+    ap.add_argument("--vectors", default=VECTOR_PATH)
+    ap.add_argument("--backends", default="chroma,numpy," + ",".join(COMPRESSED))
+    ap.add_argument("--rescore", type=int, nargs="+", default=[4, 0], help="rescore factors to try for the compressed backends")
+    ap.add_argument("--pq-m", type=int, default=48)
+    ap.add_argument("--export", action="store_true", help="(re)export the vector store from Chroma first")
+    ap.add_argument("--compress", action="store_true", help="(re)build the f16 / int8 / pq copies first")
+    a = ap.parse_args()
+    if a.export or not os.path.exists(os.path.join(a.vectors, "vectors.npy")):
+        print(f"Exported {export_vector_index(get_collection(a.chroma), a.vectors)} vectors to {a.vectors}")
+    if a.compress or not os.path.exists(os.path.join(a.vectors, "pq_codes.npy")):
+        t = time.perf_counter(); compress_vector_index(a.vectors, pq_m=a.pq_m)
+        print(f"Compressed {a.vectors} in {time.perf_counter() - t:.1f}s")
+    Q = _queries(a.vectors, a.n, a.noise)
+    truth = _exact(a.vectors, Q, a.k)
+    n_vec = len(np.load(os.path.join(a.vectors, "ids.npy"), mmap_mode="r"))
+    for name in a.backends.split(","):
+        for r in (a.rescore if name in COMPRESSED else [None]):
+            idx = get_vector_index(name, chroma_path=a.chroma, db_path=a.db, vec_path=a.vectors, **({"rescore": r} if r is not None else {}))
+            idx.query(Q[:1].tolist(), a.k)
+            bench(name if r is None else f"{name}/r{r}", idx, Q, a.k, a.batch, truth, n_vec)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
-import re
 import logging
-from sentence_transformers import SentenceTransformer, util
-from methods.baseline import baseline_search
+from methods.encoders import load_encoder
+from methods.baseline import baseline_search_batch
 from methods.reranker import DocSearch
+from methods.answer import build_answers
+from methods.sentence_index import SentenceIndex
 from train_model.questions import training_data
 from typing import Dict, Any, List
 import pandas as pd
@@ -14,76 +15,46 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(ROOT_DIR, "sql_store", "chunks.db")
 CHROMA_PATH = os.path.join(ROOT_DIR, "chromadb_store")
 MODEL_PATH = os.path.join(ROOT_DIR, "model", "learned_reranker.pkl")
+VECTOR_PATH = os.environ.get("VECTOR_PATH", os.path.join(ROOT_DIR, "vector_store"))
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
 
-# Initialize SentenceTransformer model for embeddings
-emb_mod = SentenceTransformer("all-MiniLM-L6-v2")
+# Query encoder; ENCODER_BACKEND selects torch, int8 or ONNX
+emb_mod = load_encoder()
 
 # Initialize DocSearch for hybrid and learned reranking
 srch = DocSearch(
-    model=emb_mod, db_path=DB_PATH, chroma_path=CHROMA_PATH, model_file=MODEL_PATH
+    model=emb_mod, db_path=DB_PATH, chroma_path=CHROMA_PATH, model_file=MODEL_PATH,
+    backend=VECTOR_BACKEND, vec_path=VECTOR_PATH
 )
 
+# Precomputed sentence embeddings for extractive answers
+sidx = SentenceIndex(DB_PATH)
+
 def get_answer_and_contexts(query: str, top_k: int, mode: str) -> Dict[str, Any]:
     """
     Replicates the core logic of the /ask endpoint to get answers and contexts.
     """
+    return get_answers_and_contexts([query], top_k, mode)[0]
+
+def get_answers_and_contexts(queries: List[str], top_k: int, mode: str) -> List[Dict[str, Any]]:
+    """
+    Replicates the /ask_batch endpoint: one encode call and one Chroma round trip for all queries.
+    """
     m = mode.lower()
-    q = query
-    k = top_k
+    if m not in ["baseline", "hybrid", "learned"]:
+        return [{"error": "Invalid mode. Choose 'baseline', 'hybrid', or 'learned'."} for _ in queries]
+
+    qes = emb_mod.encode(list(queries)).tolist()
 
-    res = []
     if m == "baseline":
-        res = baseline_search(model=emb_mod, q=q, top_k=k, chroma_path=CHROMA_PATH)
+        res = baseline_search_batch(model=emb_mod, qs=queries, top_k=top_k, chroma_path=CHROMA_PATH, q_embs=qes, index=srch.vindex)
     elif m == "hybrid":
-        res = srch.query_docs(q, top_k=k, ul=False)
-    elif m == "learned":
-        res = srch.query_docs(q, top_k=k, ul=True)
+        res = srch.query_docs_batch(queries, top_k=top_k, ul=False, qes=qes)
     else:
-        return {"error": "Invalid mode. Choose 'baseline', 'hybrid', or 'learned'."}
-
-    simp = []
-    for r in res:
-        simp.append({
-            "doc_name": r.get("doc_name"),
-            "doc_title": r.get("doc_title"),
-            "doc_url": r.get("doc_url"),
-            "page_num": r.get("page_num"),
-            "chunk_index": r.get("chunk_index"),
-            "score": r.get("score"),
-            "content": r.get("content")[:1000] # Truncate content for display
-        })
-
-    # Abstention logic
-    if not simp or simp[0]['score'] < 0.5:
-        return {"answer": None, "reranker_used": m, "contexts": simp, "details": "Could not find a sufficiently relevant document chunk to form an answer."}
-    
-    tct = simp[0]["content"]
-    
-    # Extractive answer generation
-    nt = re.sub(r'\s*\n\s*', ' ', tct).strip()
-    sents = re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s', nt)
-    sents = [s.strip() for s in sents if s.strip()]
-
-    ans = None
-    if sents:
-        qe = emb_mod.encode(q)
-        se = emb_mod.encode(sents)
-        sims = util.cos_sim(qe, se)
-        bsi = sims.argmax()
-        
-        ap = [sents[bsi]]
-
-        if bsi > 0:
-            ap.insert(0, sents[bsi - 1])
-
-        if bsi < len(sents) - 1:
-            ap.append(sents[bsi + 1])
+        res = srch.query_docs_batch(queries, top_k=top_k, ul=True, qes=qes)
 
-        ans = " ".join(ap)
-    else:
-        ans = tct 
-
-    return {"answer": ans, "reranker_used": m, "contexts": simp}
+    # Extractive answers (with abstention) for every query
+    return build_answers(emb_mod, qes, res, m, sidx=sidx)
 
 def export_to_csv(results: List[Dict[str, Any]], filename: str = "reranker_comparison.csv"):
     df = pd.DataFrame(results)
@@ -97,13 +68,15 @@ def main():
 
     print("Generating comparison table for 8 questions across different reranking modes...\n")
 
-    for i, item in enumerate(training_data):
-        query = item["query"]
+    queries = [item["query"] for item in training_data]
+    by_mode = {mode: get_answers_and_contexts(queries, top_k, mode) for mode in modes}
+
+    for i, query in enumerate(queries):
         print(f"Processing Question {i+1}: {query}")
         
         row = {"Question": f"Q{i+1}: {query}"}
         for mode in modes:
-            result = get_answer_and_contexts(query, top_k, mode)
+            result = by_mode[mode][i]
             
             answer = result.get("answer", "Abstained")
             top_context = result["contexts"][0] if result["contexts"] else {"doc_name": "N/A", "score": "N/A"}
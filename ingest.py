@@ -1,33 +1,89 @@
-import os
-from ingest.embedding import build_chroma
+import os, sqlite3, argparse
+from ingest.embedding import build_chroma, CKPT_FILE
 from ingest.pdf_chunker import run_pdf_chunking
+from ingest.dedup import dedup_chunks
+from ingest.sentences import build_sentence_index
+from ingest.shards import build_shards, PARTITIONS
 from train_model.train_learned_reranker import train_model
-from sentence_transformers import SentenceTransformer
+from methods.encoders import load_encoder, encoder_spec
 
-def main():
+def main(incremental=False, shards=0, only=None, partition="hash", snapshot=False, keep=2, dedup=True):
     r_dir = os.path.dirname(os.path.abspath(__file__))
     db_p = r_dir + "\\sql_store\\chunks.db"
     c_path = r_dir + "\\chromadb_store"
     p_dir = r_dir + "\\data\\industrial-safety-pdfs"
     s_file = r_dir + "\\data\\sources.json"
     m_path = r_dir + "\\model\\learned_reranker.pkl"
-    mod = SentenceTransformer("all-MiniLM-L6-v2")
-    if not os.path.exists(db_p) :
-        print("Step 1: Chunking PDFs...\n")
+    v_path = r_dir + "\\vector_store"
+    mod = load_encoder()  # ENCODER_BACKEND etc.; the index keeps whatever space this encoder produces
+    if shards:
+        return main_sharded(mod, r_dir + "\\shards", shards, p_dir, s_file, m_path, incremental, only, partition, dedup)
+    if snapshot:
+        return main_snapshot(mod, r_dir + "\\snapshots", p_dir, s_file, incremental, keep, dedup)
+    build_index(mod, db_p, c_path, v_path, m_path, p_dir, s_file, incremental, dedup)
+    print("\nPipeline completed successfully!\n")
+
+def build_index(mod, db_p, c_path, v_path, m_path, p_dir, s_file, incremental, dedup=True):
+    if incremental or not os.path.exists(db_p) :
+        print("Step 1: Chunking PDFs" + (" (incremental)" if incremental else "") + "...\n")
         os.makedirs(os.path.dirname(db_p), exist_ok=True)
-        run_pdf_chunking(pdf_dir=p_dir, source_files=s_file, db_path=db_p)
+        run_pdf_chunking(pdf_dir=p_dir, source_files=s_file, db_path=db_p, incremental=incremental)
     print("Database and chunks are ready.\n")
-    if not os.path.exists(c_path) :
+    # only chunks not checked before are compared, so this is cheap when nothing changed
+    dd = {}
+    if dedup:
+        print("\nStep 1b: Collapsing near-duplicate chunks...\n")
+        dd = dedup_chunks(db_p)
+    # collapsed or restored chunks on an existing index need their vectors synced
+    sync = bool(dd.get("collapsed") or dd.get("restored")) and os.path.exists(c_path)
+    # a checkpoint only outlives an interrupted build, which is resumed (or synced if chunks.db changed since)
+    if incremental or sync or not os.path.exists(c_path) or os.path.exists(os.path.join(c_path, CKPT_FILE)) or not os.path.exists(v_path):
         print("\nStep 2: Building ChromaDB embeddings...\n")
-        build_chroma(db_path=db_p, chromadb_path=c_path, model=mod)
+        build_chroma(db_path=db_p, chromadb_path=c_path, model=mod, incremental=incremental or sync, vec_path=v_path)
     print("ChromaDB is ready.\n")
+    print("\nStep 2b: Indexing answer sentences...\n")
+    build_sentence_index(db_path=db_p, model=mod)
     if not os.path.exists(m_path) :
         print("\nStep 3: Training the model.\n")
         os.makedirs(os.path.dirname(m_path), exist_ok=True)
         train_model(model=mod, chroma_path=c_path, db_path=db_p, model_save_path=m_path)
     print("Model is ready.\n")
 
-    print("\nPipeline completed successfully!\n")
+def main_snapshot(mod, root, p_dir, s_file, incremental, keep, dedup=True):
+    from methods.snapshots import current_snapshot, new_snapshot, snapshot_paths, publish, prune
+    # the served snapshot is only ever read: an incremental build starts from a copy of it
+    base = current_snapshot(root) if incremental else None
+    os.makedirs(root, exist_ok=True)
+    name = new_snapshot(root, base)
+    p = snapshot_paths(os.path.join(root, name))
+    print(f"Building snapshot {name} under {root}" + (f" from {base}" if base else "") + "...\n")
+    build_index(mod, p["db"], p["chroma"], p["vectors"], p["model"], p_dir, s_file, base is not None, dedup)
+    con = sqlite3.connect(p["db"])
+    n = con.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    con.close()
+    publish(root, name, base=base, chunks=n, encoder=encoder_spec())
+    print(f"\nSnapshot {name} is published ({n} chunks); servers with SNAPSHOTS_PATH=" + root + " switch to it.\n")
+    old = prune(root, keep)
+    if old: print("Removed old snapshots: " + ", ".join(old) + "\n")
+
+def main_sharded(mod, root, n, p_dir, s_file, m_path, incremental, only, partition, dedup=True):
+    from methods.shards import ShardSet
+    print(f"Building {n} shards under {root} (partitioned by {partition})...\n")
+    build_shards(root, n, p_dir, s_file, mod, partition=partition, only=only, incremental=incremental, dedup=dedup)
+    if not os.path.exists(m_path):
+        print("\nTraining the model on all shards.\n")
+        os.makedirs(os.path.dirname(m_path), exist_ok=True)
+        train_model(model=mod, chroma_path=None, db_path=None, model_save_path=m_path, shards=ShardSet(root))
+    print("\nPipeline completed successfully! Serve it with SHARDS_PATH=" + root + "\n")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--incremental", action="store_true", help="only re-process PDFs and chunks whose content changed")
+    ap.add_argument("--shards", type=int, default=0, help="build a sharded index with this many shards under shards/")
+    ap.add_argument("--shard", type=int, action="append", help="with --shards: only (re)build this shard number; repeatable")
+    ap.add_argument("--partition", choices=PARTITIONS, default="hash", help="place documents by name hash or by page count")
+    ap.add_argument("--snapshot", action="store_true", help="build a new index version under snapshots/ and publish it when it is complete")
+    ap.add_argument("--keep", type=int, default=2, help="with --snapshot: published snapshots to keep, the current one included")
+    ap.add_argument("--no-dedup", action="store_true", help="index near-duplicate chunks instead of collapsing them")
+    a = ap.parse_args()
+    main(incremental=a.incremental, shards=a.shards, only=a.shard, partition=a.partition, snapshot=a.snapshot, keep=a.keep, dedup=not a.no_dedup)
@@ -0,0 +1,89 @@
+import re, zlib, numpy as np
+from typing import *
+from ingest.pdf_chunker import init_db
+from ingest.index_meta import bump_index_version
+from methods.chunk_store import connect
+
+# Collapses near-duplicate chunks (boilerplate pages repeated across a document or across documents: headers,
+# legal notices, revision tables) to one canonical chunk. MinHash signatures of word shingles find candidate
+# pairs through LSH banding, and the exact Jaccard similarity of the two shingle sets confirms them. The
+# collapsed chunk moves to chunk_dups with a back-reference to the canonical chunk, so the vector, keyword and
+# sentence indexes only ever hold canonical chunks. Title chunks are left alone: they carry the
+# first_chunk reranker feature of their document.
+
+SHINGLE = 5  # words per shingle
+BANDS, ROWS = 16, 4  # 64 hash functions; a pair with Jaccard 0.8 shares a band with probability ~0.999
+_P = (1 << 61) - 1
+_rng = np.random.default_rng(0)
+_A = _rng.integers(1, 1 << 31, BANDS * ROWS, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, BANDS * ROWS, dtype=np.uint64)
+
+ORPHANS_SQL = "SELECT id FROM chunk_dups d WHERE NOT EXISTS (SELECT 1 FROM chunks c WHERE c.id = d.canonical_id)"
+COLS = "doc_name, doc_title, doc_url, chunk_index, content, is_title, page_num, hash, n_tokens"
+
+def shingles(txt: str) -> Set[int]:
+    w = re.findall(r"\w+", (txt or "").lower())
+    return {zlib.crc32(" ".join(w[i:i + SHINGLE]).encode()) for i in range(max(len(w) - SHINGLE + 1, 0))}
+
+def minhash(sh: Set[int]) -> np.ndarray:
+    h = np.fromiter(sh, np.uint64, len(sh))
+    return ((_A[:, None] * h[None, :] + _B[:, None]) % _P).min(1)
+
+def _bands(sig):
+    return [(b, sig[b * ROWS:(b + 1) * ROWS].tobytes()) for b in range(BANDS)]
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def dedup_chunks(db_path: str, threshold: float = 0.85, min_shingles: int = 20) -> Dict[str, int]:
+    """Collapse chunks that are near-duplicates (shingle Jaccard >= threshold) of an earlier chunk. Only chunks
+    without a stored signature are checked, so incremental runs compare just the new chunks against the
+    index. Collapsed chunks whose canonical chunk has since been deleted are moved back first."""
+    init_db(db_path)
+    con = connect(db_path)
+    cur = con.cursor()
+    cur.execute("BEGIN")
+    orphans = [r[0] for r in cur.execute(ORPHANS_SQL)]
+    for i in orphans:
+        cur.execute(f"INSERT INTO chunks (id, {COLS}) SELECT id, {COLS} FROM chunk_dups WHERE id = ?", (i,))
+        cur.execute("DELETE FROM chunk_dups WHERE id = ?", (i,))
+    cur.execute("DELETE FROM chunk_minhash WHERE id NOT IN (SELECT id FROM chunks)")
+
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    for cid, sig in cur.execute("SELECT id, sig FROM chunk_minhash WHERE sig IS NOT NULL"):
+        for b in _bands(np.frombuffer(sig, np.uint64)): buckets.setdefault(b, []).append(cid)
+    known: Dict[int, Set[int]] = {}
+    def sh_of(cid):
+        if cid not in known: known[cid] = shingles(cur.execute("SELECT chunk_content(content) FROM chunks WHERE id = ?", (cid,)).fetchone()[0])
+        return known[cid]
+
+    new = cur.execute("SELECT id, chunk_content(content) FROM chunks WHERE is_title = 0 AND id NOT IN (SELECT id FROM chunk_minhash) ORDER BY id").fetchall()
+    sigs, dups = [], []
+    for cid, content in new:
+        sh = shingles(content)
+        if len(sh) < min_shingles:
+            sigs.append((cid, None)); continue
+        sig = minhash(sh)
+        bs = _bands(sig)
+        cands = {c for b in bs for c in buckets.get(b, ())}
+        best, sim = None, 0.0
+        for c in sorted(cands):
+            j = jaccard(sh, sh_of(c))
+            if j > sim: best, sim = c, j
+        if best is not None and sim >= threshold:
+            dups.append((best, sim, cid)); continue
+        known[cid] = sh
+        for b in bs: buckets.setdefault(b, []).append(cid)
+        sigs.append((cid, sig.tobytes()))
+
+    cur.executemany("INSERT OR REPLACE INTO chunk_minhash (id, sig) VALUES (?, ?)", sigs)
+    cur.executemany(f"INSERT INTO chunk_dups (id, canonical_id, similarity, {COLS}) SELECT id, ?, ?, {COLS} FROM chunks WHERE id = ?", dups)
+    cur.executemany("DELETE FROM chunks WHERE id = ?", [(d[2],) for d in dups])
+    con.commit()
+    n = cur.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    con.close()
+    if dups or orphans: bump_index_version(db_path)
+    st = {"checked": len(new), "collapsed": len(dups), "restored": len(orphans), "chunks": n}
+    print(f"Dedup: {st['collapsed']} of {st['checked']} new chunks collapsed into near-duplicates, "
+          f"{st['restored']} restored, {n} chunks indexed.\n")
+    return st
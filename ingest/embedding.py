@@ -1,36 +1,194 @@
-import sqlite3, chromadb
+import os, json, time, queue, sqlite3, threading, chromadb
 from tqdm import tqdm
+from typing import *
 from sentence_transformers import SentenceTransformer
 from chromadb.config import Settings
+from ingest.index_meta import bump_index_version
+from methods.vector_index import export_vector_index, compress_vector_index, compress_kinds
+from methods.chunk_store import connect
 
-def fetch_chunks(db_path):
-    con = sqlite3.connect(db_path)
+CKPT_FILE = "ingest_progress.json"
+
+def fetch_chunks(db_path, after_id=0):
+    con = connect(db_path)
     con.row_factory = sqlite3.Row
     cur = con.cursor()
-    sql = "SELECT id, doc_name, doc_title, doc_url, chunk_index, content, is_title, page_num FROM chunks ORDER BY id"
-    cur.execute(sql)
+    sql = "SELECT id, doc_name, doc_title, doc_url, chunk_index, chunk_content(content) AS content, is_title, page_num, hash FROM chunks WHERE id > ? ORDER BY id"
+    cur.execute(sql, (after_id,))
     rows = cur.fetchall()
     con.close()
     return [dict(r) for r in rows]
 
-def build_chroma(db_path: str, chromadb_path: str, model: SentenceTransformer):
+def _fingerprint(db_path, last_id):
+    # row count and top id of chunks, plus the hash of the last chunk written: a re-chunked db restarts ids
+    # at 1, so a bare last_id could point past (or into different) rows
+    con = connect(db_path)
+    try:
+        n, top = con.execute("SELECT COUNT(*), MAX(id) FROM chunks").fetchone()
+        h = con.execute("SELECT hash FROM chunks WHERE id = ?", (last_id,)).fetchone()
+    finally: con.close()
+    return [n, top, h[0] if h else None]
+
+def _load_ckpt(path, db_path):
+    """last_id of an interrupted full build; None if the checkpoint was written against another chunks.db."""
+    try:
+        with open(path, "r") as f: d = json.load(f)
+    except (FileNotFoundError, ValueError): return 0
+    last_id = d.get("last_id", 0)
+    return last_id if d.get("db") == _fingerprint(db_path, last_id) else None
+
+def _save_ckpt(path, db_path, last_id):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump({"last_id": last_id, "db": _fingerprint(db_path, last_id)}, f)
+    os.replace(tmp, path)
+
+def _drop_ckpt(path):
+    try: os.remove(path)
+    except FileNotFoundError: pass
+
+def _meta(c):
+    m = {"doc_name": c["doc_name"], "doc_title": c["doc_title"], "doc_url": c["doc_url"], "page_num": c["page_num"], "chunk_index": c["chunk_index"], "is_title": c["is_title"]}
+    if c.get("hash"): m["hash"] = c["hash"]
+    return m
+
+def _coll_metas(coll, page=5000):
+    out, off = {}, 0
+    while True:
+        res = coll.get(include=["metadatas"], limit=page, offset=off)
+        out.update(zip(res["ids"], res["metadatas"]))
+        if len(res["ids"]) < page: return out
+        off += page
+
+def sync_chroma(coll, chunks):
+    """Diff the collection against the chunks table: returns chunks that need (re-)embedding."""
+    have = _coll_metas(coll)
+    db = {str(c["id"]): c for c in chunks}
+
+    stale = [cid for cid in have if cid not in db]
+    for s in range(0, len(stale), 5000):
+        coll.delete(ids=stale[s:s+5000])
+
+    todo, upd = [], []
+    for cid, c in db.items():
+        m = have.get(cid)
+        if m is None or m.get("hash") != c.get("hash"): todo.append(c)
+        elif m != _meta(c): upd.append(c)
+    for s in range(0, len(upd), 5000):
+        w = upd[s:s+5000]
+        coll.update(ids=[str(c["id"]) for c in w], metadatas=[_meta(c) for c in w])
+
+    print(f"Sync: {len(stale)} stale vectors deleted, {len(upd)} metadata updates, {len(todo)} chunks to embed.\n")
+    return todo, bool(stale or upd)
+
+def _export(coll, vec_path):
+    n = export_vector_index(coll, vec_path)
+    kinds = compress_kinds()
+    compress_vector_index(vec_path, kinds)
+    names = ("numpy",) + kinds
+    print(f"Exported {n} vectors to {vec_path} for the " + (", ".join(names[:-1]) + " and " if kinds else "") + names[-1] + " backend" + ("s" if kinds else "") + ".\n")
+
+def _encode_sorted(model, texts, batch_size, pause=None):
+    # sort by length so each batch pads to a similar size, then restore input order
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    srt = [texts[i] for i in order]
+    if pause is None: embs = model.encode(srt, batch_size=batch_size, show_progress_bar=False)
+    else:
+        embs = []
+        for s in range(0, len(srt), batch_size):
+            pause()
+            embs.extend(model.encode(srt[s:s+batch_size], batch_size=batch_size, show_progress_bar=False))
+    out = [None] * len(texts)
+    for pos, i in enumerate(order): out[i] = embs[pos].tolist()
+    return out
+
+def embed_windows(model, coll, windows: Iterable[List[Dict[str, Any]]], batch_size: int = 64, depth: int = 2,
+                  pause: Optional[Callable[[], None]] = None, on_write: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> Dict[str, float]:
+    """Encode each window of chunk rows on this thread while a writer thread upserts the previous ones into
+    coll. At most depth encoded windows wait for the writer, so a slow write stalls encoding (and whatever
+    feeds windows) instead of piling up vectors. on_write(window) runs on the writer after each upsert."""
+    q: "queue.Queue" = queue.Queue(maxsize=max(depth, 1))
+    st = {"chunks": 0, "encode_s": 0.0, "write_s": 0.0}
+    err: List[BaseException] = []
+
+    def write():
+        while True:
+            item = q.get()
+            if item is None: return
+            if err: continue  # drain, so the encoder never blocks on a dead writer
+            win, embs = item
+            try:
+                t = time.perf_counter()
+                # upsert keeps a replayed window idempotent if we died after the write but before the checkpoint
+                coll.upsert(ids=[str(c["id"]) for c in win], embeddings=embs,
+                            documents=[c["content"] for c in win], metadatas=[_meta(c) for c in win])
+                st["write_s"] += time.perf_counter() - t
+                st["chunks"] += len(win)
+                if on_write is not None: on_write(win)
+            except BaseException as e: err.append(e)
+
+    w = threading.Thread(target=write, name="chroma-writer", daemon=True)
+    w.start()
+    try:
+        for win in windows:
+            if err: break
+            if not win: continue
+            t = time.perf_counter()
+            embs = _encode_sorted(model, [c["content"] for c in win], batch_size, pause)
+            st["encode_s"] += time.perf_counter() - t
+            q.put((win, embs))
+    finally:
+        q.put(None)
+        w.join()
+    if err: raise err[0]
+    return st
+
+def build_chroma(db_path: str, chromadb_path: str, model: SentenceTransformer, batch_size: int = 64, write_size: int = 1024, resume: bool = True, incremental: bool = False, vec_path: str = None):
+    os.makedirs(chromadb_path, exist_ok=True)
+    ckpt = os.path.join(chromadb_path, CKPT_FILE)
+    # incremental mode diffs the whole table against the collection, so it never needs the checkpoint
+    last_id = _load_ckpt(ckpt, db_path) if resume and not incremental else 0
+    if last_id is None:
+        # chunks.db changed under a half-built collection: diff it instead of trusting the old position
+        print("Checkpoint does not match the chunks table, syncing the whole collection.\n")
+        last_id, incremental = 0, True
+
     print("Loading chunks from DB...\n")
-    chunks = fetch_chunks(db_path)
-    if not chunks:
+    chunks = fetch_chunks(db_path, after_id=last_id)
+    if not chunks and not last_id and not incremental:
         raise SystemExit("No chunks found in DB. Run the chunker first.")
 
-    print(f"Loaded {len(chunks)} chunks.\n")
+    print(f"Loaded {len(chunks)} chunks" + (f" (resuming after id {last_id})" if last_id else "") + ".\n")
 
     cli = chromadb.PersistentClient(path=chromadb_path, settings=Settings(anonymized_telemetry=False))
     coll = cli.get_or_create_collection("safety_docs")
 
+    changed = False
+    if incremental:
+        chunks, changed = sync_chroma(coll, chunks)
+        if changed and not chunks: bump_index_version(db_path)
+    if not chunks:
+        if vec_path and (changed or not os.path.exists(os.path.join(vec_path, "vectors.npy"))): _export(coll, vec_path)
+        _drop_ckpt(ckpt)
+        print(f"ChromaDB already up to date at {chromadb_path}.\n")
+        return {"chunks": 0, "total_s": 0.0, "encode_s": 0.0, "write_s": 0.0}
+
     print("Embedding and adding to ChromaDB...\n")
-    for c in tqdm(chunks, desc="Processing chunks"):
-        emb = model.encode(c["content"]).tolist()
-        coll.add(
-            ids=[str(c["id"])],
-            embeddings=[emb],
-            documents=[c["content"]],
-            metadatas=[{"doc_name": c["doc_name"], "doc_title": c["doc_title"], "doc_url": c["doc_url"], "page_num": c["page_num"], "chunk_index": c["chunk_index"], "is_title": c["is_title"]}]
-        )
+    t0 = time.perf_counter()
+    with tqdm(total=len(chunks), desc="Processing chunks") as bar:
+        def wrote(win):
+            if not incremental: _save_ckpt(ckpt, db_path, win[-1]["id"])
+            bar.update(len(win))
+        # the next window is encoded while this one is written
+        st = embed_windows(model, coll, (chunks[s:s+write_size] for s in range(0, len(chunks), write_size)), batch_size, on_write=wrote)
+    done, t_enc, t_wr = st["chunks"], st["encode_s"], st["write_s"]
+
+    # the collection now matches the table: nothing left to resume
+    _drop_ckpt(ckpt)
+
+    tot = time.perf_counter() - t0
+    if vec_path: _export(coll, vec_path)
+    bump_index_version(db_path)
     print(f"ChromaDB built at {chromadb_path}\n")
+    print(f"Throughput: {done} chunks in {tot:.1f}s ({done / max(tot, 1e-9):.1f} chunks/sec)")
+    print(f"  encode: {t_enc:.1f}s ({t_enc / max(tot, 1e-9):.0%})  write: {t_wr:.1f}s ({t_wr / max(tot, 1e-9):.0%})\n")
+    return {"chunks": done, "total_s": tot, "encode_s": t_enc, "write_s": t_wr}
@@ -0,0 +1,12 @@
+import sqlite3
+
+def bump_index_version(db_path):
+    """Record that the searchable index changed; query-time caches key on this value."""
+    con = sqlite3.connect(db_path)
+    con.execute("CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT)")
+    con.execute("INSERT INTO index_meta (key, value) VALUES ('version', '1') "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+    con.commit()
+    v = con.execute("SELECT value FROM index_meta WHERE key = 'version'").fetchone()[0]
+    con.close()
+    return v
@@ -0,0 +1,299 @@
+import os, json, time, queue, shutil, logging, sqlite3, threading, uuid, chromadb
+from chromadb.config import Settings
+from typing import *
+from ingest.pdf_chunker import run_pdf_chunking
+from ingest.dedup import dedup_chunks
+from ingest.embedding import embed_windows, build_chroma
+from ingest.sentences import build_sentence_index
+from methods.encoders import encoder_spec
+from methods.resources import release
+from methods.snapshots import current_snapshot, new_snapshot, snapshot_paths, publish, prune
+from methods.vector_index import export_vector_index, compress_vector_index, compress_kinds
+
+# Background ingestion for a server on index snapshots. POST /ingest queues a job (PDFs to add or replace,
+# names to remove) in a SQLite table next to copies of its files, so queued work survives a restart. One
+# IngestService thread per process claims every queued job at once, applies them to the PDF directory and
+# builds one new snapshot from the current one, which the server then swaps in. The claim only succeeds while
+# no job runs, so several worker processes never build at the same time. Within a build, extraction, chunk
+# writes, embedding and vector writes run as concurrent stages joined by bounded queues, and each stage calls
+# a Throttle that holds it back while queries are being served.
+
+JOBS_SQL = """CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,  -- queued, running, done or failed
+    docs TEXT NOT NULL,  -- {"add": [{name, title, url, file}], "remove": [name]}
+    created REAL, started REAL, heartbeat REAL, finished REAL,
+    pid INTEGER, progress TEXT, error TEXT, snapshot TEXT)"""
+
+class JobQueue:
+    """Ingest jobs in dir/jobs.db; files of queued jobs wait in dir/inbox until their build has run."""
+
+    def __init__(self, d: str):
+        self.dir, self.inbox = d, os.path.join(d, "inbox")
+        os.makedirs(self.inbox, exist_ok=True)
+        self.path = os.path.join(d, "jobs.db")
+        con = self._con()
+        con.execute(JOBS_SQL)
+        con.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+        con.commit()
+        con.close()
+
+    def _con(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        con.row_factory = sqlite3.Row
+        return con
+
+    @staticmethod
+    def _job(r) -> Dict[str, Any]:
+        j = dict(r)
+        j["docs"], j["progress"] = json.loads(j["docs"]), json.loads(j["progress"] or "{}")
+        for d in j["docs"]["add"]: d.pop("file", None)
+        return j
+
+    def inbox_path(self, name: str) -> str:
+        return os.path.join(self.inbox, f"{uuid.uuid4().hex}_{name}")
+
+    def stage(self, name: str, src: str) -> str:
+        """Copy the PDF at src into the inbox; returns its inbox path."""
+        dst = self.inbox_path(name)
+        shutil.copyfile(src, dst)
+        return dst
+
+    def submit(self, add: List[Dict[str, Any]], remove: List[str]) -> Dict[str, Any]:
+        con = self._con()
+        cur = con.execute("INSERT INTO jobs (status, docs, created) VALUES ('queued', ?, ?)",
+                          (json.dumps({"add": add, "remove": remove}), time.time()))
+        con.commit()
+        j = self.get(cur.lastrowid, con)
+        con.close()
+        return j
+
+    def get(self, i: int, con=None) -> Optional[Dict[str, Any]]:
+        c = con or self._con()
+        r = c.execute("SELECT * FROM jobs WHERE id = ?", (i,)).fetchone()
+        if con is None: c.close()
+        return self._job(r) if r else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        con = self._con()
+        rs = con.execute("SELECT * FROM jobs" + (" WHERE status = ?" if status else "") + " ORDER BY id DESC LIMIT ?",
+                         ((status, limit) if status else (limit,))).fetchall()
+        con.close()
+        return [self._job(r) for r in rs]
+
+    def counts(self) -> Dict[str, int]:
+        con = self._con()
+        out = dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        con.close()
+        return out
+
+    def claim(self, stale_s: float = 60.0) -> List[Dict[str, Any]]:
+        """Mark every queued job running and return them with their inbox files, oldest first; nothing while
+        another process runs a build. Running jobs without a heartbeat for stale_s (their process died) are
+        queued again first."""
+        con = self._con()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            con.execute("UPDATE jobs SET status = 'queued', error = 'requeued: its worker stopped' WHERE status = 'running' AND heartbeat < ?", (now - stale_s,))
+            rs = []
+            if not con.execute("SELECT 1 FROM jobs WHERE status = 'running'").fetchone():
+                rs = con.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id").fetchall()
+                con.executemany("UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, pid = ? WHERE id = ?",
+                                [(now, now, os.getpid(), r["id"]) for r in rs])
+            con.commit()
+            return [{**dict(r), "docs": json.loads(r["docs"])} for r in rs]
+        finally:
+            con.close()
+
+    def beat(self, ids: List[int], progress: Dict[str, Any]):
+        con = self._con()
+        con.executemany("UPDATE jobs SET heartbeat = ?, progress = ? WHERE id = ? AND status = 'running'",
+                        [(time.time(), json.dumps(dict(progress)), i) for i in ids])
+        con.commit()
+        con.close()
+
+    def finish(self, ids: List[int], status: str, progress: Dict[str, Any], snapshot: Optional[str] = None, error: Optional[str] = None):
+        con = self._con()
+        con.executemany("UPDATE jobs SET status = ?, finished = ?, progress = ?, snapshot = ?, error = ? WHERE id = ?",
+                        [(status, time.time(), json.dumps(progress), snapshot, error, i) for i in ids])
+        con.commit()
+        con.close()
+
+class Throttle:
+    """Holds background stages back while queries run: calling it blocks while busy() is true, for at most
+    max_pause_s per call, so ingest still advances (by one batch per call) under sustained query load."""
+
+    def __init__(self, busy: Callable[[], Any], max_pause_s: float = 1.0, poll_s: float = 0.005):
+        self.busy, self.max_pause_s, self.poll_s = busy, max_pause_s, poll_s
+        self.calls, self.paused, self.paused_s = 0, 0, 0.0
+
+    def __call__(self):
+        self.calls += 1
+        if self.max_pause_s <= 0 or not self.busy(): return
+        t0 = time.perf_counter()
+        while self.busy() and time.perf_counter() - t0 < self.max_pause_s: time.sleep(self.poll_s)
+        self.paused += 1
+        self.paused_s += time.perf_counter() - t0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "paused": self.paused, "paused_s": round(self.paused_s, 3), "max_pause_s": self.max_pause_s}
+
+def _put(q, item, stop):
+    # a bounded put that gives up once the consumer has failed
+    while not stop.is_set():
+        try: return q.put(item, timeout=0.2)
+        except queue.Full: pass
+
+def apply_jobs(jobs: List[Dict[str, Any]], pdf_dir: str, source_files: str):
+    """Apply the jobs' removals and additions, in order, to the PDF directory and sources.json."""
+    with open(source_files) as f: src = json.load(f)
+    name = lambda s: s.get("filename") or os.path.basename(s.get("url", ""))
+    for j in jobs:
+        for n in j["docs"]["remove"]:
+            try: os.remove(os.path.join(pdf_dir, n))
+            except FileNotFoundError: pass
+            src = [s for s in src if name(s) != n]
+        for d in j["docs"]["add"]:
+            dst = os.path.join(pdf_dir, d["name"])
+            shutil.copyfile(d["file"], dst + ".tmp")
+            os.replace(dst + ".tmp", dst)
+            src = [s for s in src if name(s) != d["name"]]
+            src.append({"filename": d["name"], "title": d.get("title") or d["name"], "url": d.get("url") or ""})
+    tmp = source_files + ".tmp"
+    with open(tmp, "w") as f: json.dump(src, f, indent=2)
+    os.replace(tmp, source_files)
+
+def build_snapshot(model, root: str, pdf_dir: str, source_files: str, keep: int = 2, dedup: bool = True, workers: int = 1,
+                   batch_size: int = 16, pause: Optional[Callable[[], None]] = None, prog: Optional[Dict[str, Any]] = None,
+                   **info) -> str:
+    """ingest.py --snapshot --incremental with the stages pipelined: the chunker's inserted rows go through a
+    bounded queue to the encoder, whose vectors go to a Chroma writer thread (ingest.embedding.embed_windows),
+    while the next PDFs are extracted. Dedup, the vector sync and export, the sentence index and (for a first
+    snapshot) training run once the stream is done. Returns the published snapshot's name."""
+    prog = prog if prog is not None else {}
+    base = current_snapshot(root)
+    os.makedirs(root, exist_ok=True)
+    name = new_snapshot(root, base)
+    d = os.path.join(root, name)
+    p = snapshot_paths(d)
+    prog.update(snapshot=name, base=base, stage="chunk+embed", chunked=0, embedded=0)
+    try:
+        os.makedirs(os.path.dirname(p["db"]), exist_ok=True)
+        coll = chromadb.PersistentClient(path=p["chroma"], settings=Settings(anonymized_telemetry=False)).get_or_create_collection("safety_docs")
+        rows: "queue.Queue" = queue.Queue(maxsize=4)  # chunk batches waiting for the encoder
+        stop, res = threading.Event(), {}
+        def on_chunks(b):
+            prog["chunked"] += len(b)
+            _put(rows, b, stop)
+        def chunk():
+            try: res["chunks"] = run_pdf_chunking(pdf_dir, source_files, p["db"], incremental=base is not None, workers=workers, on_chunks=on_chunks, pause=pause)
+            except BaseException as e: res["error"] = e
+            finally: _put(rows, None, stop)
+        t = threading.Thread(target=chunk, name="ingest-chunker", daemon=True)
+        t.start()
+        try:
+            def wrote(w): prog["embedded"] += len(w)
+            embed_windows(model, coll, iter(rows.get, None), batch_size, pause=pause, on_write=wrote)
+        finally:
+            stop.set()
+            t.join()
+        if "error" in res: raise res["error"]
+        prog["chunks"] = res["chunks"]
+
+        if dedup:
+            prog["stage"] = "dedup"
+            prog["dedup"] = dedup_chunks(p["db"])
+        # drops vectors of collapsed and deleted chunks and embeds anything the stream missed
+        prog["stage"] = "vector sync"
+        build_chroma(db_path=p["db"], chromadb_path=p["chroma"], model=model, batch_size=batch_size, incremental=True)
+        export_vector_index(coll, p["vectors"])
+        compress_vector_index(p["vectors"], compress_kinds())
+        prog["stage"] = "sentences"
+        build_sentence_index(p["db"], model, batch_size=batch_size, pause=pause)
+        if not os.path.exists(p["model"]):
+            from train_model.train_learned_reranker import train_model
+            prog["stage"] = "train"
+            os.makedirs(os.path.dirname(p["model"]), exist_ok=True)
+            train_model(model=model, chroma_path=p["chroma"], db_path=p["db"], model_save_path=p["model"])
+
+        prog["stage"] = "publish"
+        con = sqlite3.connect(p["db"])
+        n = con.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        con.close()
+        publish(root, name, base=base, chunks=n, encoder=encoder_spec(), **info)
+    except BaseException:
+        release(d)
+        shutil.rmtree(d, ignore_errors=True)
+        raise
+    release(d)  # the server opens its own handles when it swaps the snapshot in
+    prog["removed"] = prune(root, keep)
+    return name
+
+class IngestService:
+    """Runs queued ingest jobs on a background thread, one batch (every job queued at claim time) per
+    snapshot build. kick() wakes it up early; otherwise it looks for jobs every poll_s seconds."""
+
+    def __init__(self, jobs: JobQueue, model, root: str, pdf_dir: str, source_files: str, throttle: Optional[Throttle] = None,
+                 on_publish: Optional[Callable[[str], Any]] = None, poll_s: float = 2.0, stale_s: float = 60.0, **build_opts):
+        self.jobs, self.model, self.root, self.pdf_dir, self.source_files = jobs, model, root, pdf_dir, source_files
+        self.throttle, self.on_publish, self.poll_s, self.stale_s = throttle, on_publish, poll_s, stale_s
+        self.build_opts = build_opts  # keep, dedup, workers, batch_size for build_snapshot
+        self.current: Optional[Dict[str, Any]] = None  # progress of the batch being built
+        self._wake, self._stop = threading.Event(), threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="ingest", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    def kick(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try: batch = self.jobs.claim(self.stale_s)
+            except Exception:
+                logging.exception("claiming ingest jobs failed")
+                batch = []
+            if batch: self.run(batch)
+            else:
+                self._wake.wait(self.poll_s)
+                self._wake.clear()
+
+    def run(self, batch: List[Dict[str, Any]]):
+        ids = [j["id"] for j in batch]
+        prog = self.current = {"jobs": ids, "stage": "apply", "started": time.time()}
+        done, applied = threading.Event(), False
+        def beat():
+            # the heartbeat also tells other processes this build is alive
+            while not done.wait(1.0):
+                try: self.jobs.beat(ids, prog)
+                except Exception: logging.exception("ingest heartbeat failed")
+        threading.Thread(target=beat, name="ingest-heartbeat", daemon=True).start()
+        try:
+            apply_jobs(batch, self.pdf_dir, self.source_files)
+            applied = True  # from here on the PDF directory holds the jobs' files; a later build picks them up
+            name = build_snapshot(self.model, self.root, self.pdf_dir, self.source_files, pause=self.throttle, prog=prog, jobs=ids, **self.build_opts)
+            prog.update(stage="done", seconds=round(time.time() - prog["started"], 1))
+            done.set()
+            self.jobs.finish(ids, "done", prog, snapshot=name)
+            if self.on_publish is not None: self.on_publish(name)
+        except Exception as e:
+            logging.exception("ingest jobs %s failed", ids)
+            done.set()
+            self.jobs.finish(ids, "failed", prog, error=repr(e))
+        finally:
+            done.set()
+            self.current = None
+            for d in (d for j in batch for d in j["docs"]["add"]) if applied else ():
+                try: os.remove(d["file"])
+                except OSError: pass
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": dict(self.current) if self.current else None, "jobs": self.jobs.counts(), "root": self.root,
+                "throttle": self.throttle.stats() if self.throttle is not None else None}
@@ -1,13 +1,184 @@
-import os, json, re, sqlite3, PyPDF2
+import os, json, re, sqlite3, hashlib, PyPDF2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from ingest.index_meta import bump_index_version
+from methods.chunk_store import connect, get_codec, latest_dict, pack_chunks, DICT_SQL
+
+# columns of an inserted chunk row, as handed to process_pdfs(on_chunks=...)
+ROW = ("id", "doc_name", "doc_title", "doc_url", "chunk_index", "content", "is_title", "page_num", "hash", "n_tokens")
+
+# part of every file hash: bump it when chunking changes, so incremental runs re-chunk every document
+CHUNKER_VERSION = 2
+
+def _open_pdf(f):
+    r = PyPDF2.PdfReader(f)
+    if r.is_encrypted:
+        try:
+            r.decrypt('')
+        except Exception:
+            pass  # skip if cannot decrypt
+    return r
+
+def count_pages(pp):
+    try:
+        with open(pp, 'rb') as f:
+            return len(_open_pdf(f).pages)
+    except Exception as e:
+        print(f"Error reading {pp}: {e}")
+        return 0
+
+def chunk_text(txt, pn, cs, co):
+    txt = re.sub(r'\s+', ' ', txt).strip()
+    wds = txt.split()
+    cks = []
+    if len(wds) <= cs:
+        return [(pn, ' '.join(wds))]
+    for i in range(0, len(wds), cs - co):
+        ck = ' '.join(wds[i:i+cs])
+        if ck:
+            cks.append((pn, ck))
+        if i + cs >= len(wds):
+            break  # the next window would lie entirely inside this one
+    return cks
+
+def page_chunks(p_n, txt, cs, co):
+    out = []
+    if p_n == 1:
+        fp = txt.split('\n\n')[0] if '\n\n' in txt else txt[:200]
+        out.append((0, fp, 1, p_n))
+    for i, (p, ck) in enumerate(chunk_text(txt, p_n, cs, co)):
+        out.append((i+1, ck, 0, p))
+    return out
+
+def extract_range(args):
+    """Worker: extract pages [start, stop) of one PDF and return their (chunk_index, content, is_title, page_num) records."""
+    pp, start, stop, cs, co = args
+    out = []
+    try:
+        with open(pp, 'rb') as f:
+            r = _open_pdf(f)
+            for i in range(start, min(stop, len(r.pages))):
+                try:
+                    t = r.pages[i].extract_text()
+                except Exception:
+                    t = ""
+                if t and t.strip():
+                    out.extend(page_chunks(i + 1, t, cs, co))
+    except Exception as e:
+        print(f"Error extracting text from {pp} (pages {start+1}-{stop}): {e}")
+    return out
+
+def init_db(dp):
+    """Create (or migrate) the chunks table, its FTS index and the triggers that keep them in sync."""
+    con = connect(dp)
+    cur = con.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    doc_name TEXT,
+                    doc_title TEXT,
+                    doc_url TEXT,
+                    chunk_index INTEGER,
+                    content TEXT,
+                    is_title INTEGER DEFAULT 0,
+                    page_num INTEGER,
+                    hash TEXT,
+                    n_tokens INTEGER)''')
+
+    cols = [r[1] for r in cur.execute("PRAGMA table_info(chunks)")]
+    if "hash" not in cols:
+        cur.execute("ALTER TABLE chunks ADD COLUMN hash TEXT")
+    if "n_tokens" not in cols:
+        cur.execute("ALTER TABLE chunks ADD COLUMN n_tokens INTEGER")
+    # whitespace token count, a chunk-static reranker feature (methods.features)
+    todo = cur.execute("SELECT id, chunk_content(content) FROM chunks WHERE n_tokens IS NULL").fetchall()
+    cur.executemany("UPDATE chunks SET n_tokens = ? WHERE id = ?", [(len((c or "").split()), i) for i, c in todo])
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_name)")
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS files (
+                    doc_name TEXT PRIMARY KEY,
+                    hash TEXT)''')
+
+    # near-duplicates collapsed by ingest.dedup: the chunk row moves here with a back-reference to the
+    # canonical chunk that stays in chunks (and in the vector and keyword indexes)
+    cur.execute('''CREATE TABLE IF NOT EXISTS chunk_dups (
+                    id INTEGER PRIMARY KEY,
+                    canonical_id INTEGER,
+                    similarity REAL,
+                    doc_name TEXT,
+                    doc_title TEXT,
+                    doc_url TEXT,
+                    chunk_index INTEGER,
+                    content TEXT,
+                    is_title INTEGER,
+                    page_num INTEGER,
+                    hash TEXT,
+                    n_tokens INTEGER)''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dups_canonical ON chunk_dups(canonical_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dups_doc ON chunk_dups(doc_name)")
+    # MinHash signature per chunk already checked by ingest.dedup (NULL: too short to compare)
+    cur.execute("CREATE TABLE IF NOT EXISTS chunk_minhash (id INTEGER PRIMARY KEY, sig BLOB)")
+    # shared dictionaries of the packed (compressed) content values (methods.chunk_store)
+    cur.execute(DICT_SQL)
+
+    # prefix='6' serves the 6-character prefix queries methods.fts can issue; tables from before it existed are rebuilt
+    fts = cur.execute("SELECT sql FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+    if fts and "prefix" not in fts[0]:
+        cur.execute("DROP TABLE chunks_fts")
+    cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+                   USING fts5(content, doc_name, doc_title, prefix='6',
+                              content='chunks', content_rowid='id')''')
+    if fts and "prefix" not in fts[0]:
+        # not 'rebuild': that would index packed content as stored
+        cur.execute("INSERT INTO chunks_fts(rowid, content, doc_name, doc_title) SELECT id, chunk_content(content), doc_name, doc_title FROM chunks")
+    # per-term document frequencies, read at query time to drop very common terms
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks_fts, 'row')")
+
+    # the FTS index holds the text of packed content; triggers from before packing are replaced
+    for t, sql in cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ('chunks_ai', 'chunks_ad', 'chunks_au')").fetchall():
+        if "chunk_content" not in sql: cur.execute(f"DROP TRIGGER {t}")
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS chunks_ai
+                   AFTER INSERT ON chunks
+                   BEGIN
+                     INSERT INTO chunks_fts(rowid, content, doc_name, doc_title)
+                     VALUES (new.id, chunk_content(new.content), new.doc_name, new.doc_title);
+                   END''')
+
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS chunks_ad
+                   AFTER DELETE ON chunks
+                   BEGIN
+                     INSERT INTO chunks_fts(chunks_fts, rowid, content, doc_name, doc_title)
+                     VALUES ('delete', old.id, chunk_content(old.content), old.doc_name, old.doc_title);
+                   END''')
+
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS chunks_au
+                   AFTER UPDATE OF content, doc_name, doc_title ON chunks
+                   WHEN chunk_content(old.content) IS NOT chunk_content(new.content) OR old.doc_name IS NOT new.doc_name OR old.doc_title IS NOT new.doc_title
+                   BEGIN
+                     INSERT INTO chunks_fts(chunks_fts, rowid, content, doc_name, doc_title)
+                     VALUES ('delete', old.id, chunk_content(old.content), old.doc_name, old.doc_title);
+                     INSERT INTO chunks_fts(rowid, content, doc_name, doc_title)
+                     VALUES (new.id, chunk_content(new.content), new.doc_name, new.doc_title);
+                   END''')
+
+    con.commit()
+    con.close()
 
 class PDFChunker:
-    def __init__(self, pd, sf, dp, cs=300, co=50):
+    def __init__(self, pd, sf, dp, cs=300, co=50, workers=None, ppt=32, wb=500, docs=None, shard=0, n_shards=1, pause=None):
         self.pd = pd
         self.sf = sf
         self.dp = dp
         self.cs = cs
         self.co = co
+        self.workers = workers or os.cpu_count() or 1
+        self.ppt = ppt  # pages per extraction task
+        self.wb = wb  # rows per executemany batch
+        self.docs = docs  # PDF file names to keep (a shard's documents); None keeps every PDF in pd
+        # shard i of n only assigns ids with id % n == i, keeping chunk ids unique across shards
+        self.shard, self.n_shards = shard, n_shards
+        self.pause = pause  # called before each page range is extracted, e.g. to yield to queries
+        self.codec, self.zd = get_codec(dp), None  # zd: dictionary new chunks are packed with as they are written
         self.src = self._load_sources()
         self._setup_db()
 
@@ -24,97 +195,152 @@ class PDFChunker:
         return src_dict
 
     def _setup_db(self):
-        con = sqlite3.connect(self.dp)
-        cur = con.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS chunks (
-                        id INTEGER PRIMARY KEY,
-                        doc_name TEXT,
-                        doc_title TEXT,
-                        doc_url TEXT,
-                        chunk_index INTEGER,
-                        content TEXT,
-                        is_title INTEGER DEFAULT 0,
-                        page_num INTEGER)''')
-
-        cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts 
-                       USING fts5(content, doc_name, doc_title, 
-                                  content='chunks', content_rowid='id')''')
-
-        cur.execute('''CREATE TRIGGER IF NOT EXISTS chunks_ai 
-                       AFTER INSERT ON chunks 
-                       BEGIN 
-                         INSERT INTO chunks_fts(rowid, content, doc_name, doc_title) 
-                         VALUES (new.id, new.content, new.doc_name, new.doc_title); 
-                       END''')
+        init_db(self.dp)
 
-        con.commit()
-        con.close()
+    def _file_hash(self, pp, d_i):
+        h = hashlib.sha256()
+        with open(pp, 'rb') as f:
+            for b in iter(lambda: f.read(1 << 20), b''):
+                h.update(b)
+        # title/url come from sources.json, so a metadata edit also counts as a change
+        h.update(f"\0{d_i['title']}\0{d_i['url']}\0{self.cs}\0{self.co}\0{CHUNKER_VERSION}".encode())
+        return h.hexdigest()
 
-    def _extract_text_from_pdf(self, pp):
-        pgs = []
-        try:
-            with open(pp, 'rb') as f:
-                r = PyPDF2.PdfReader(f)
-                if r.is_encrypted:
-                    try:
-                        r.decrypt('')
-                    except Exception:
-                        pass  # skip if cannot decrypt
-                for i, p in enumerate(r.pages):
-                    try:
-                        t = p.extract_text()
-                    except Exception:
-                        t = ""
-                    if t and t.strip():
-                        pgs.append((i + 1, t))
-        except Exception as e:
-            print(f"Error extracting text from {pp}: {e}")
-        return pgs
-
-    def _chunk_text(self, txt, pn):
-        txt = re.sub(r'\s+', ' ', txt).strip()
-        wds = txt.split()
-        cks = []
-        if len(wds) <= self.cs:
-            return [(pn, ' '.join(wds))]
-        for i in range(0, len(wds), self.cs - self.co):
-            ck = ' '.join(wds[i:i+self.cs])
-            if ck:
-                cks.append((pn, ck))
-        return cks
-
-    def process_pdfs(self):
-        con = sqlite3.connect(self.dp)
+    @staticmethod
+    def _chunk_hash(ck, it):
+        return hashlib.sha1(f"{it}\0{ck}".encode()).hexdigest()
+
+    def _tasks(self, todo):
+        for p_f, p_p, _, _ in todo:
+            for s in range(0, count_pages(p_p), self.ppt):
+                if self.pause is not None: self.pause()
+                yield p_f, (p_p, s, s + self.ppt, self.cs, self.co)
+            yield p_f, None  # end-of-document marker
+
+    def _stream(self, todo):
+        """Yield (doc_name, records) in submission order, or (doc_name, None) when a document is done.
+        At most 2 * workers page ranges are in flight, so memory stays bounded on huge PDFs."""
+        if self.workers <= 1:
+            for p_f, a in self._tasks(todo):
+                yield p_f, (extract_range(a) if a else None)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as ex:
+            q = deque()
+            for p_f, a in self._tasks(todo):
+                q.append((p_f, ex.submit(extract_range, a) if a else None))
+                while len(q) > 2 * self.workers:
+                    d, fu = q.popleft()
+                    yield d, (fu.result() if fu else None)
+            while q:
+                d, fu = q.popleft()
+                yield d, (fu.result() if fu else None)
+
+    def _flush(self, cur, ins, upd, on_chunks=None):
+        if ins and on_chunks is not None: on_chunks([dict(zip(ROW, r)) for r in ins])
+        if ins:
+            rows = ins if self.zd is None else [r[:5] + (self.codec.pack(r[5], self.zd),) + r[6:] for r in ins]
+            cur.executemany(
+                "INSERT INTO chunks (id, doc_name, doc_title, doc_url, chunk_index, content, is_title, page_num, hash, n_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if upd:
+            cur.executemany("UPDATE chunks SET doc_title = ?, doc_url = ?, chunk_index = ?, page_num = ? WHERE id = ?", upd)
+        ins.clear(); upd.clear()
+
+    def process_pdfs(self, incremental=False, on_chunks=None):
+        """on_chunks(rows) receives each batch of inserted chunks (dicts of ROW) as soon as it is written,
+        before the run commits, so a later stage can embed them while extraction goes on. Chunk text is
+        stored packed (methods.chunk_store): incremental runs pack new chunks with the database's
+        dictionary as they are written; full runs write plain text, train a new dictionary on it, pack
+        it and VACUUM."""
+        con = connect(self.dp)
         cur = con.cursor()
-        pf = [f for f in os.listdir(self.pd) if f.lower().endswith('.pdf')]
-        cur.execute("DELETE FROM chunks")
-        con.commit()
+        pf = sorted(f for f in os.listdir(self.pd) if f.lower().endswith('.pdf') and (self.docs is None or f in self.docs))
 
-        for p_f in tqdm(pf, desc="Processing PDFs"):
+        # one transaction for the whole run; FTS rows for new chunks are added in bulk at the end
+        cur.execute("BEGIN")
+        cur.execute("DROP TRIGGER IF EXISTS chunks_ai")
+        if not incremental:
+            cur.execute("DROP TRIGGER IF EXISTS chunks_ad")
+            cur.execute("DELETE FROM chunks")
+            cur.execute("INSERT INTO chunks_fts(chunks_fts) VALUES('delete-all')")
+            cur.execute("DELETE FROM files")
+            cur.execute("DELETE FROM chunk_dups")
+            cur.execute("DELETE FROM chunk_minhash")
+        self.zd = latest_dict(cur) if incremental else None
+
+        known = dict(cur.execute("SELECT doc_name, hash FROM files").fetchall())
+        st = {"added": 0, "kept": 0, "deleted": 0, "skipped_docs": 0, "removed_docs": 0}
+
+        for p_f in sorted(set(known) - set(pf)):
+            cur.execute("DELETE FROM chunks WHERE doc_name = ?", (p_f,))
+            st["deleted"] += cur.rowcount
+            cur.execute("DELETE FROM chunk_dups WHERE doc_name = ?", (p_f,))
+            cur.execute("DELETE FROM files WHERE doc_name = ?", (p_f,))
+            st["removed_docs"] += 1
+
+        todo = []
+        for p_f in pf:
             p_p = os.path.join(self.pd, p_f)
             d_i = self.src.get(p_f, {"title": p_f, "url": ""})
-            pgs = self._extract_text_from_pdf(p_p)
-
-            for p_n, txt in pgs:
-                if p_n == 1:
-                    fp = txt.split('\n\n')[0] if '\n\n' in txt else txt[:200]
-                    cur.execute(
-                        "INSERT INTO chunks (doc_name, doc_title, doc_url, chunk_index, content, is_title, page_num) "
-                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                        (p_f, d_i["title"], d_i["url"], 0, fp, 1, p_n)
-                    )
-
-                cks = self._chunk_text(txt, p_n)
-                for i, (p, ck) in enumerate(cks):
-                    cur.execute(
-                        "INSERT INTO chunks (doc_name, doc_title, doc_url, chunk_index, content, page_num) "
-                        "VALUES (?, ?, ?, ?, ?, ?)",
-                        (p_f, d_i["title"], d_i["url"], i+1, ck, p)
-                    )
+            fh = self._file_hash(p_p, d_i)
+            if known.get(p_f) == fh:
+                st["skipped_docs"] += 1
+            else:
+                todo.append((p_f, p_p, d_i, fh))
+        info = {p_f: (d_i, fh) for p_f, _, d_i, fh in todo}
+
+        # explicit ids above the current max: deleted ids are never reused within a run,
+        # so every row at or above first_id is new and needs an FTS entry
+        # (collapsed duplicates keep their ids too: ingest.dedup moves them back if their canonical chunk goes)
+        nid = (cur.execute("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM chunks UNION ALL SELECT MAX(id) FROM chunk_dups)").fetchone()[0] or 0) + 1
+        first_id = nid = nid + (self.shard - nid) % self.n_shards
+        ins, upd, old = [], [], None
+        with tqdm(total=len(todo), desc="Processing PDFs") as bar:
+            for p_f, recs in self._stream(todo):
+                d_i, fh = info[p_f]
+                if old is None:
+                    # reuse rows whose content hash is unchanged so their ids (and vectors) survive
+                    old = {}
+                    for cid, h in cur.execute("SELECT id, hash FROM chunks WHERE doc_name = ?", (p_f,)):
+                        old.setdefault(h, []).append(cid)
+                    # the document's collapsed chunks are re-inserted below and checked again
+                    cur.execute("DELETE FROM chunk_dups WHERE doc_name = ?", (p_f,))
+                if recs is None:
+                    self._flush(cur, ins, upd, on_chunks)
+                    stale = [cid for ids in old.values() for cid in ids]
+                    cur.executemany("DELETE FROM chunks WHERE id = ?", [(cid,) for cid in stale])
+                    st["deleted"] += len(stale)
+                    cur.execute("INSERT OR REPLACE INTO files (doc_name, hash) VALUES (?, ?)", (p_f, fh))
+                    old = None
+                    bar.update(1)
+                    continue
+                for ci, ck, it, p in recs:
+                    h = self._chunk_hash(ck, it)
+                    if old.get(h):
+                        upd.append((d_i["title"], d_i["url"], ci, p, old[h].pop()))
+                        st["kept"] += 1
+                    else:
+                        ins.append((nid, p_f, d_i["title"], d_i["url"], ci, ck, it, p, h, len(ck.split())))
+                        nid += self.n_shards
+                        st["added"] += 1
+                if len(ins) + len(upd) >= self.wb:
+                    self._flush(cur, ins, upd, on_chunks)
 
+        cur.execute("INSERT INTO chunks_fts(rowid, content, doc_name, doc_title) "
+                    "SELECT id, chunk_content(content), doc_name, doc_title FROM chunks WHERE id >= ?", (first_id,))
+        cur.execute("DROP TRIGGER IF EXISTS chunks_au")  # packing leaves the text, and so the FTS rows, as they are
+        pk = pack_chunks(cur, self.dp, retrain=not incremental)
+        # merge the FTS b-tree segments into one so queries read a single doclist per term
+        cur.execute("INSERT INTO chunks_fts(chunks_fts) VALUES('optimize')")
         con.commit()
+        if pk["trained"]: con.execute("VACUUM")
         con.close()
-        print(f"PDF processing completed. Total chunks: {self.get_chunk_count()}\n")
+        self._setup_db()  # restore the per-row triggers for ad-hoc writes
+        if st["added"] or st["kept"] or st["deleted"]: bump_index_version(self.dp)
+        print(f"PDF processing completed. Total chunks: {self.get_chunk_count()} "
+              f"(added {st['added']}, kept {st['kept']}, deleted {st['deleted']}, unchanged docs {st['skipped_docs']}, removed docs {st['removed_docs']})"
+              + (f"; {pk['rows']} chunks packed, {pk['bytes']} -> {pk['packed']} bytes" if pk["rows"] else "") + "\n")
+        return st
 
     def get_chunk_count(self):
         con = sqlite3.connect(self.dp)
@@ -125,6 +351,6 @@ class PDFChunker:
         return cnt
 
 
-def run_pdf_chunking(pdf_dir, source_files, db_path):
-    ckr = PDFChunker(pdf_dir, source_files, db_path)
-    ckr.process_pdfs()
+def run_pdf_chunking(pdf_dir, source_files, db_path, incremental=False, workers=None, docs=None, shard=0, n_shards=1, on_chunks=None, pause=None):
+    ckr = PDFChunker(pdf_dir, source_files, db_path, workers=workers, docs=docs, shard=shard, n_shards=n_shards, pause=pause)
+    return ckr.process_pdfs(incremental=incremental, on_chunks=on_chunks)
@@ -0,0 +1,92 @@
+import os, json, time, numpy as np
+from tqdm import tqdm
+from sentence_transformers import SentenceTransformer
+from methods.answer import split_sentences, SNIPPET_CHARS
+from methods.chunk_store import connect, get_codec, latest_dict
+
+SENTS_SQL = "CREATE TABLE IF NOT EXISTS {} (chunk_id INTEGER PRIMARY KEY, start INTEGER, n INTEGER, sents TEXT, hash TEXT)"
+
+def _setup(con):
+    con.execute(SENTS_SQL.format("chunk_sentences"))
+    # older indexes have no hash column: their rows match no chunk and are re-encoded once
+    if "hash" not in [r[1] for r in con.execute("PRAGMA table_info(chunk_sentences)")]:
+        con.execute("ALTER TABLE chunk_sentences ADD COLUMN hash TEXT")
+    con.execute('''CREATE TABLE IF NOT EXISTS index_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT)''')
+
+def _normed(e):
+    e = np.asarray(e, dtype=np.float32)
+    n = np.linalg.norm(e, axis=1, keepdims=True)
+    return (e / np.where(n == 0, 1, n)).astype(np.float16)
+
+def _encode(model, texts, batch_size, pause):
+    if pause is None: return model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    out = []
+    for s in range(0, len(texts), batch_size):
+        pause()
+        out.append(model.encode(texts[s:s+batch_size], batch_size=batch_size, show_progress_bar=False))
+    return np.concatenate(out)
+
+def build_sentence_index(db_path: str, model: SentenceTransformer, batch_size: int = 64, window: int = 1024, pause=None):
+    """Segment every chunk's answer snippet into sentences and store their embeddings next to chunks.db.
+    Chunks that were already indexed with the same content hash reuse their rows, so only new or changed
+    chunks are encoded (ids alone are reused by incremental runs and full re-chunks). pause() runs
+    before each encoded batch."""
+    out_dir = os.path.dirname(os.path.abspath(db_path))
+    con = connect(db_path)
+    _setup(con)
+    codec, did = get_codec(db_path), latest_dict(con)  # sents are packed like chunk content
+
+    cur = con.execute("SELECT id, hash FROM chunks ORDER BY id").fetchall()
+    ids = [cid for cid, _ in cur]
+    meta = dict(con.execute("SELECT key, value FROM index_meta WHERE key IN ('sent_file', 'sent_dim')").fetchall())
+    old = {(cid, h): (st, n, ss) for cid, st, n, ss, h in con.execute("SELECT chunk_id, start, n, chunk_content(sents), hash FROM chunk_sentences")}
+    old_path = os.path.join(out_dir, meta["sent_file"]) if "sent_file" in meta else None
+    if old_path and os.path.exists(old_path) and set(old) == set(cur):
+        print("Sentence index is up to date.\n")
+        con.close()
+        return
+
+    old_mat = np.memmap(old_path, dtype=np.float16, mode="r").reshape(-1, int(meta["sent_dim"])) if old_path and os.path.exists(old_path) else None
+    fname = f"sent_emb.{int(time.time() * 1000)}.f16"
+    dim, pos, enc = None, 0, 0
+
+    con.execute("DROP TABLE IF EXISTS chunk_sentences_new")
+    con.execute(SENTS_SQL.format("chunk_sentences_new"))
+    with open(os.path.join(out_dir, fname), "wb") as f, tqdm(total=len(ids), desc="Indexing sentences") as bar:
+        for s in range(0, len(ids), window):
+            win = ids[s:s+window]
+            rows = con.execute(f"SELECT id, hash, chunk_content(content, ?) FROM chunks WHERE id IN ({','.join('?' * len(win))}) ORDER BY id", [SNIPPET_CHARS, *win]).fetchall()
+            parts, todo = [], []
+            for cid, h, content in rows:
+                if h is not None and (cid, h) in old and old_mat is not None:
+                    st, n, ss = old[cid, h]
+                    parts.append((cid, h, json.loads(ss), np.asarray(old_mat[st:st+n])))
+                else:
+                    ss = split_sentences(content)
+                    parts.append((cid, h, ss, None)); todo.extend(ss)
+
+            embs = _normed(_encode(model, todo, batch_size, pause)) if todo else None
+            enc += len(todo)
+            off, out = 0, []
+            for cid, h, ss, e in parts:
+                if e is None:
+                    e = embs[off:off+len(ss)] if ss else np.zeros((0, dim or 0), np.float16); off += len(ss)
+                if len(e): dim = e.shape[1]
+                f.write(np.ascontiguousarray(e, dtype=np.float16).tobytes())
+                out.append((cid, pos, len(ss), codec.pack(json.dumps(ss), did), h))
+                pos += len(ss)
+            con.executemany("INSERT INTO chunk_sentences_new (chunk_id, start, n, sents, hash) VALUES (?, ?, ?, ?, ?)", out)
+            bar.update(len(win))
+
+    con.execute("DROP TABLE chunk_sentences")
+    con.execute("ALTER TABLE chunk_sentences_new RENAME TO chunk_sentences")
+    con.executemany("INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)", [("sent_file", fname), ("sent_dim", str(dim or 0))])
+    con.commit()
+    con.close()
+
+    if old_path and os.path.exists(old_path):
+        try: os.remove(old_path)
+        except OSError: pass  # still mapped by a running process on Windows; harmless leftover
+    print(f"Sentence index built: {pos} sentences for {len(ids)} chunks ({enc} newly encoded) in {fname}\n")
@@ -0,0 +1,83 @@
+import os, shutil, sqlite3, hashlib
+from typing import *
+from ingest.pdf_chunker import run_pdf_chunking, count_pages
+from ingest.dedup import dedup_chunks
+from ingest.embedding import build_chroma
+from ingest.sentences import build_sentence_index
+from methods.shards import shard_paths, load_manifest, save_manifest
+
+# Builds the sharded layout methods.shards.ShardSet serves. Whole documents are placed on shards, so a
+# document's chunks (and its incremental updates) stay on one shard. Every build writes a new generation
+# directory and then points shards.json at it, so a running server swaps shards without a restart.
+
+PARTITIONS = ("hash", "doc")
+
+def shard_of(doc_name: str, n: int) -> int:
+    """Stable placement by file name."""
+    return int(hashlib.sha1(doc_name.encode()).hexdigest()[:8], 16) % n
+
+def place(m: Dict[str, Any], pdf_dir: str) -> Dict[str, int]:
+    """PDF name -> shard. "hash" places by name; "doc" keeps earlier placements (recorded in the
+    manifest) and puts new documents, largest first, on the shard with the fewest pages so far."""
+    pdfs = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf"))
+    n = m["n"]
+    if m["partition"] == "hash": return {f: shard_of(f, n) for f in pdfs}
+    docs = {f: v for f, v in m.get("docs", {}).items() if f in pdfs}  # [shard, pages]
+    load = [0] * n
+    for s, p in docs.values(): load[s] += p
+    new = {f: count_pages(os.path.join(pdf_dir, f)) for f in pdfs if f not in docs}
+    for f in sorted(new, key=lambda f: -new[f]):
+        s = min(range(n), key=load.__getitem__)
+        docs[f] = [s, new[f]]; load[s] += new[f]
+    m["docs"] = docs
+    return {f: v[0] for f, v in docs.items()}
+
+def _count(db_path):
+    con = sqlite3.connect(db_path)
+    n = con.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    con.close()
+    return n
+
+def build_shard(root: str, m: Dict[str, Any], i: int, docs: Set[str], pdf_dir: str, source_files: str, model, incremental=False, workers=None, dedup=True):
+    """Build shard i into a new generation directory and return its manifest entry. Incremental
+    builds start from a copy of the current generation; the directory being served is never written."""
+    e = m["shards"][i]
+    gen = e.get("gen", 0) + 1
+    rel = f"{e['name']}.g{gen}"
+    d = os.path.join(root, rel)
+    if os.path.exists(d): shutil.rmtree(d)  # left over from an interrupted build
+    prev = os.path.join(root, e["path"]) if e.get("path") else None
+    inc = incremental and prev is not None and os.path.exists(prev)
+    if inc: shutil.copytree(prev, d)
+    p = shard_paths(d)
+    os.makedirs(os.path.dirname(p["db"]), exist_ok=True)
+
+    print(f"Shard {e['name']} (generation {gen}): {len(docs)} documents\n")
+    run_pdf_chunking(pdf_dir, source_files, p["db"], incremental=inc, workers=workers, docs=docs, shard=i, n_shards=m["n"])
+    if dedup: dedup_chunks(p["db"])  # within the shard: a document's chunks all live on one shard
+    n = _count(p["db"])
+    if n:
+        build_chroma(db_path=p["db"], chromadb_path=p["chroma"], model=model, incremental=inc, vec_path=p["vectors"])
+        build_sentence_index(db_path=p["db"], model=model)
+    return {"name": e["name"], "path": rel, "gen": gen, "chunks": n, "prev": e.get("path")}
+
+def build_shards(root: str, n: int, pdf_dir: str, source_files: str, model, partition: str = "hash",
+                 only: Optional[List[int]] = None, incremental=False, workers=None, dedup=True) -> Dict[str, Any]:
+    """Build (or rebuild) shards of the index under root, each swapped in as soon as it is ready.
+    only limits the build to those shard numbers; the others keep serving as they are."""
+    if partition not in PARTITIONS: raise ValueError(f"partition must be one of {PARTITIONS}")
+    os.makedirs(root, exist_ok=True)
+    m = load_manifest(root) or {"n": n, "partition": partition, "gen": 0, "shards": [{"name": f"shard_{i:02d}"} for i in range(n)]}
+    if (m["n"], m["partition"]) != (n, partition):
+        raise SystemExit(f"{root} holds {m['n']} shards partitioned by {m['partition']}; use a new directory to change that.")
+    where = place(m, pdf_dir)
+    for i in (range(n) if only is None else only):
+        e = build_shard(root, m, i, {f for f, s in where.items() if s == i}, pdf_dir, source_files, model, incremental, workers, dedup)
+        old = m["shards"][i].get("prev")
+        m["shards"][i] = e
+        m["gen"] += 1
+        save_manifest(root, m)
+        # the generation just replaced stays for servers that have not re-read the manifest yet
+        if old and old not in (e["path"], e["prev"]): shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+        print(f"Shard {e['name']} is live: {e['chunks']} chunks in {e['path']}\n")
+    return m
@@ -0,0 +1,79 @@
+import re, numpy as np
+from typing import *
+from methods.metrics import span
+
+if TYPE_CHECKING: from sentence_transformers import SentenceTransformer
+
+SNIPPET_CHARS = 1000
+ABSTAIN_MSG = "Could not find a sufficiently relevant document chunk to form an answer."
+
+def split_sentences(txt: str) -> List[str]:
+    nt = re.sub(r'\s*\n\s*', ' ', txt).strip()
+    sents = re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s', nt)
+    return [s.strip() for s in sents if s.strip()]
+
+def simplify(res: List[Dict]) -> List[Dict]:
+    return [{
+        "doc_name": r.get("doc_name"),
+        "doc_title": r.get("doc_title"),
+        "doc_url": r.get("doc_url"),
+        "page_num": r.get("page_num"),
+        "chunk_index": r.get("chunk_index"),
+        "score": r.get("score"),
+        "content": r.get("content")[:SNIPPET_CHARS]
+    } for r in res]
+
+def _pick(ss, sims):
+    bsi = int(np.argmax(sims))
+
+    ap = [ss[bsi]]
+
+    if bsi > 0:
+        ap.insert(0, ss[bsi - 1])
+
+    if bsi < len(ss) - 1:
+        ap.append(ss[bsi + 1])
+
+    return " ".join(ap)
+
+def build_answers(model: "SentenceTransformer", qes, results: List[List[Dict]], m: str, sidx=None) -> List[Dict[str, Any]]:
+    """Extractive answers from each top context: the sentence closest to the query plus its neighbours.
+    Sentence embeddings come from the ingest-time SentenceIndex when available; any that are missing
+    are encoded here in a single call."""
+    with span("answer"): return _answers(model, qes, results, m, sidx)
+
+def _answers(model, qes, results, m, sidx):
+    simps = [simplify(res) for res in results]
+    ok = [bool(simp) and simp[0]['score'] >= 0.5 for simp in simps]
+
+    pre = [None] * len(results)
+    if sidx is not None:
+        want = [i for i, res in enumerate(results) if ok[i] and res[0].get("chunk_id") is not None]
+        for i, hit in zip(want, sidx.lookup([results[i][0]["chunk_id"] for i in want])): pre[i] = hit
+
+    sents = [split_sentences(simp[0]["content"]) if k and p is None else [] for simp, k, p in zip(simps, ok, pre)]
+    flat = [s for ss in sents for s in ss]
+    se = None
+    if flat:
+        with span("answer_encode"): se = model.encode(flat)
+
+    out, off = [], 0
+    for qe, simp, k, ss, p in zip(qes, simps, ok, sents, pre):
+        if not k:
+            out.append({"answer": None, "reranker_used": m, "contexts": simp, "details": ABSTAIN_MSG})
+            continue
+
+        ans = simp[0]["content"]
+        if p is not None and p[0]:
+            # stored embeddings are unit length, so a dot product ranks like cosine similarity
+            ans = _pick(p[0], p[1] @ np.asarray(qe, dtype=np.float32))
+        elif ss:
+            from sentence_transformers import util
+            ans = _pick(ss, util.cos_sim(qe, se[off:off + len(ss)])[0].numpy())
+            off += len(ss)
+
+        out.append({"answer": ans, "reranker_used": m, "contexts": simp})
+    return out
+
+def build_answer(model: "SentenceTransformer", qe, res: List[Dict], m: str, sidx=None) -> Dict[str, Any]:
+    return build_answers(model, [qe], [res], m, sidx=sidx)[0]
@@ -1,21 +1,37 @@
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
 from typing import *
+from methods.vector_index import get_vector_index
+from methods.cache import QueryCache
+from methods.metrics import span, count
 
-def baseline_search(model: SentenceTransformer, q: str, chroma_path: str, top_k: int ) -> List[Dict]:
-    
-    cli = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
-    coll = cli.get_collection("safety_docs")
+if TYPE_CHECKING: from sentence_transformers import SentenceTransformer
 
-    q_emb = model.encode([q]).tolist()[0]
+def baseline_search(model: "SentenceTransformer", q: str, chroma_path: str, top_k: int, q_emb: Optional[List[float]] = None, cache: Optional[QueryCache] = None, index=None, store=None) -> List[Dict]:
+    return baseline_search_batch(model, [q], chroma_path, top_k, q_embs=None if q_emb is None else [q_emb], cache=cache, index=index, store=store)[0]
 
-    res = coll.query(query_embeddings=[q_emb], n_results=top_k)
-    docs, metas, ids, dists = res["documents"][0], res["metadatas"][0], res["ids"][0], res["distances"][0]
+def baseline_search_batch(model: "SentenceTransformer", qs: List[str], chroma_path: str, top_k: int, q_embs: Optional[List[List[float]]] = None, cache: Optional[QueryCache] = None, index=None, store=None) -> List[List[Dict]]:
+    """store(ids) -> {id: (content, meta)}, e.g. DocSearch.hydrate: the index then returns ids and scores
+    only and the hits are read from chunks.db in one lookup; without it they come from index.query()."""
+    qs = list(qs)
+    if index is None: index = get_vector_index("chroma", chroma_path=chroma_path)
+    if cache is None: return _search(model, qs, index, top_k, q_embs, None, store)
 
-    v_scores = [1 - d for d in dists]
+    def compute(ix):
+        return _search(model, [qs[i] for i in ix], index, top_k, [q_embs[i] for i in ix] if q_embs is not None else None, cache, store)
+    return cache.results(qs, "baseline", top_k, compute)
 
-    return [
-        {"doc_id": did, "doc_name": m.get("doc_name", ""), "doc_title": m.get("doc_title", ""), "doc_url": m.get("doc_url", ""), "page_num": m.get("page_num"), "chunk_index": m.get("chunk_index"), "score": s, "content": d}
-        for d, m, did, s in zip(docs, metas, ids, v_scores)
-    ]
+def _search(model, qs, index, top_k, q_embs, cache, store=None):
+    if q_embs is None:
+        if cache: q_embs = cache.embed(model, qs)
+        else:
+            with span("encode"): q_embs = model.encode(qs).tolist()
+
+    # all query embeddings go to the vector index in one call
+    with span("vector"): hits_list = index.nearest(q_embs, top_k) if store else index.query(q_embs, top_k)
+    for hits in hits_list: count("vector", len(hits))
+    if store:
+        with span("hydrate"): rows = store(i for hits in hits_list for i, _ in hits)
+        hits_list = [[(i, *rows[int(i)], s) for i, s in hits if int(i) in rows] for hits in hits_list]
+    return [[
+        {"doc_id": did, "chunk_id": did, "doc_name": m.get("doc_name", ""), "doc_title": m.get("doc_title", ""), "doc_url": m.get("doc_url", ""), "page_num": m.get("page_num"), "chunk_index": m.get("chunk_index"), "score": s, "content": d}
+        for did, d, m, s in hits
+    ] for hits in hits_list]
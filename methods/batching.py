@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+from methods.metrics import span, registry, ENCODE_BATCH
+
+class BatchEncoder:
+    """Coalesces concurrent encode() calls: queries arriving within window_ms of the first one
+    (or until max_batch is reached) go through the model in a single forward pass."""
+
+    def __init__(self, model, max_batch: int = 32, window_ms: float = 5.0):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        # one thread: the model already parallelises a batch internally
+        self._ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+        self._q: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def encode(self, text: str) -> List[float]:
+        if self._task is None or self._task.done():
+            self._q = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        await self._q.put((text, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._q.get()]
+            end = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                left = end - loop.time()
+                if left <= 0: break
+                try: batch.append(await asyncio.wait_for(self._q.get(), left))
+                except asyncio.TimeoutError: break
+            texts = [t for t, _ in batch]
+            if registry.enabled: ENCODE_BATCH.observe(len(texts))
+            try:
+                embs = await loop.run_in_executor(self._ex, self._encode, texts)
+                for (_, f), e in zip(batch, embs):
+                    if not f.done(): f.set_result(e.tolist())
+            except Exception as e:
+                for _, f in batch:
+                    if not f.done(): f.set_exception(e)
+
+    def _encode(self, texts):
+        with span("encode"): return self.model.encode(texts, batch_size=len(texts))
+
+    def close(self):
+        if self._task: self._task.cancel()
+        self._ex.shutdown(wait=False)
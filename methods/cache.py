@@ -0,0 +1,201 @@
+import os, time, pickle, sqlite3, hashlib, threading
+from collections import OrderedDict
+from typing import *
+from methods.resources import get_pool
+from methods.metrics import span
+
+_MISS = object()
+
+def normalize_query(q: str) -> str:
+    # all-MiniLM-L6-v2 is uncased and FTS5 is case-insensitive, so case and spacing don't change results
+    return " ".join(q.lower().split())
+
+class DiskCache:
+    """SQLite-backed tier so cached entries survive restarts. A row can carry a tag (the index version of
+    a result) for drop(); every prune_s, a put also prunes expired rows and keeps at most max_rows."""
+
+    def __init__(self, path: str, max_rows: int = 100000, prune_s: float = 300.0):
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.max_rows, self.prune_s = max_rows, prune_s
+        self._con.execute("PRAGMA journal_mode = WAL")
+        self._con.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL, tag TEXT)")
+        if "tag" not in [r[1] for r in self._con.execute("PRAGMA table_info(cache)")]:
+            self._con.execute("ALTER TABLE cache ADD COLUMN tag TEXT")
+        self._con.commit()
+        self.prune()
+
+    @staticmethod
+    def _k(ns, key):
+        return ns + ":" + hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, ns, key):
+        """(value, seconds it has left), or _MISS."""
+        with self._lock:
+            r = self._con.execute("SELECT value, expires FROM cache WHERE key = ?", (self._k(ns, key),)).fetchone()
+        left = r[1] - time.time() if r is not None else 0
+        if left <= 0: return _MISS
+        return pickle.loads(r[0]), left
+
+    def put(self, ns, key, value, ttl, tag=None):
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO cache (key, value, expires, tag) VALUES (?, ?, ?, ?)",
+                              (self._k(ns, key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time() + ttl, tag))
+            self._con.commit()
+        if time.monotonic() - self._pruned >= self.prune_s: self.prune()
+
+    def prune(self):
+        with self._lock:
+            self._pruned = time.monotonic()
+            self._con.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            # the ttl is the same for every row, so the ones expiring first are the oldest
+            over = self._con.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_rows
+            if over > 0: self._con.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)", (over,))
+            self._con.commit()
+
+    def drop(self, ns, keep):
+        """Delete the rows of ns tagged with anything but keep."""
+        with self._lock:
+            # keys are ns + ":" + digest, and ";" sorts right after ":", so this is a range on the key index
+            self._con.execute("DELETE FROM cache WHERE key > ? AND key < ? AND tag IS NOT NULL AND tag != ?", (ns + ":", ns + ";", keep))
+            self._con.commit()
+
+class LRUCache:
+    """Size-bounded LRU with per-entry TTL, optionally backed by a DiskCache namespace."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, disk: Optional[DiskCache] = None, ns: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk = disk
+        self.ns = ns
+        self._d: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            e = self._d.get(key)
+            if e is not None and e[0] > now:
+                self._d.move_to_end(key); self.hits += 1
+                return e[1]
+            if e is not None: del self._d[key]
+        if self.disk is not None:
+            r = self.disk.get(self.ns, key)
+            if r is not _MISS:
+                with self._lock: self.disk_hits += 1; self.hits += 1
+                self._put_mem(key, r[0], r[1])  # expires with its disk row, not a full ttl later
+                return r[0]
+        with self._lock: self.misses += 1
+        return default
+
+    def _put_mem(self, key, value, ttl=None):
+        with self._lock:
+            self._d[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False); self.evictions += 1
+
+    def put(self, key, value, tag=None):
+        self._put_mem(key, value)
+        if self.disk is not None: self.disk.put(self.ns, key, value, self.ttl, tag)
+
+    def clear(self):
+        with self._lock: self._d.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.hits + self.misses
+            return {"size": len(self._d), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "disk_hits": self.disk_hits, "evictions": self.evictions, "hit_rate": self.hits / n if n else 0.0}
+
+class QueryCache:
+    """Two tiers: normalised query -> embedding, and (query, mode, top_k, index version) -> ranked results.
+    The index version lives in index_meta and is bumped by every ingest step that changes the index;
+    with model_file, that file's mtime and size are part of it too, so a retrained reranker counts as a
+    new version. A new version drops the in-memory result tier and the disk tier's results of other
+    versions. version_fn replaces the index_meta lookup, e.g. with methods.shards.ShardSet.version for a
+    sharded index; pinned() keys results by the version of the index snapshot a request actually runs on."""
+
+    def __init__(self, db_path: Optional[str], emb_size: int = 4096, res_size: int = 1024, ttl: float = 3600.0, disk_path: Optional[str] = None,
+                 version_fn: Optional[Callable[[], str]] = None, model_file: Optional[str] = None, disk_rows: int = 100000):
+        self.version_fn = version_fn
+        self.model_file = model_file
+        self.pool = get_pool(db_path) if version_fn is None else None
+        disk = DiskCache(disk_path, max_rows=disk_rows) if disk_path else None
+        self.emb = LRUCache(emb_size, ttl, disk, "emb")
+        self.res = LRUCache(res_size, ttl, disk, "res")
+        self._ver = None
+        self._lock = threading.Lock()
+        self.index_ver: Optional[str] = None  # index_meta's version as last read, for methods.features.ChunkStats.get
+
+    def version(self) -> str:
+        if self.version_fn is not None: v = self.version_fn()
+        else:
+            try:
+                with self.pool.conn() as con:
+                    r = con.execute("SELECT value FROM index_meta WHERE key = 'version'").fetchone()
+            except sqlite3.OperationalError:
+                r = None
+            v = self.index_ver = r[0] if r else "0"
+        if self.model_file is not None:
+            try: st = os.stat(self.model_file); v += f"+{st.st_mtime_ns:x}.{st.st_size:x}"
+            except FileNotFoundError: pass
+        if v != self._ver:
+            with self._lock:
+                if v != self._ver:
+                    if self._ver is not None: self.res.clear()
+                    self._ver = v
+                    if self.res.disk is not None: self.res.disk.drop("res", v)
+        return v
+
+    def get_embedding(self, q: str) -> Optional[List[float]]:
+        return self.emb.get(normalize_query(q))
+
+    def put_embedding(self, q: str, e: List[float]):
+        self.emb.put(normalize_query(q), e)
+
+    def embed(self, model, qs: List[str]) -> List[List[float]]:
+        out = [self.get_embedding(q) for q in qs]
+        miss = [i for i, e in enumerate(out) if e is None]
+        if miss:
+            with span("encode"): embs = model.encode([qs[i] for i in miss]).tolist()
+            for i, e in zip(miss, embs):
+                out[i] = e; self.put_embedding(qs[i], e)
+        return out
+
+    def results(self, qs: List[str], mode: str, top_k: int, compute: Callable[[List[int]], List[List[Dict]]], version: Optional[str] = None) -> List[List[Dict]]:
+        """Cached results per query; compute(indices) runs the pipeline for the misses only.
+        version pins the key to the index version compute runs on, instead of the current one."""
+        v = self.version() if version is None else version
+        keys = [(normalize_query(q), mode, top_k, v) for q in qs]
+        out = [self.res.get(k) for k in keys]
+        miss = [i for i, r in enumerate(out) if r is None]
+        if miss:
+            for i, r in zip(miss, compute(miss)):
+                out[i] = r; self.res.put(keys[i], r, tag=v)
+        return [[dict(d) for d in r] for r in out]
+
+    def pinned(self, version: str) -> "PinnedCache":
+        return PinnedCache(self, version)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"index_version": self._ver, "embeddings": self.emb.stats(), "results": self.res.stats()}
+
+class PinnedCache:
+    """A QueryCache whose results are keyed by one fixed index version (a served snapshot's), so
+    queries still running on a swapped-out snapshot neither hit nor fill the new version's entries.
+    Embeddings don't depend on the index and are shared."""
+
+    def __init__(self, cache: QueryCache, version: str):
+        self.cache, self.v = cache, version
+
+    def __getattr__(self, a):
+        return getattr(self.cache, a)
+
+    def version(self) -> str:
+        return self.v
+
+    def results(self, qs, mode, top_k, compute, version=None):
+        self.cache.version()  # drops the in-memory result tier once the served version has moved on
+        return self.cache.results(qs, mode, top_k, compute, version=self.v)
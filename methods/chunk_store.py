@@ -0,0 +1,134 @@
+import os, zlib, random, struct, sqlite3, threading
+from collections import Counter
+from typing import *
+from methods.resources import on_release
+
+# Chunk text at rest. A value in chunks.content, chunk_dups.content or chunk_sentences.sents is either plain
+# TEXT or a packed BLOB: TAG, a 2-byte dictionary id and a raw deflate stream primed with that dictionary
+# from chunk_zdict. Chunks are a few hundred words, too short to compress well one by one; a dictionary
+# of the corpus's frequent phrases, shared by every row, takes them to about a third of their size.
+# chunk_content(x[, n]), registered on every connection that reads or writes chunks, returns the text
+# (its first n characters when n is given, inflating no more of the stream than that); the FTS triggers
+# in ingest.pdf_chunker call it too, so writing to chunks needs a connection from connect().
+
+TAG = b"z"
+DICT_BYTES = 32 << 10  # deflate's window: a longer dictionary is never referenced
+TRAIN_ROWS = 4000
+
+DICT_SQL = "CREATE TABLE IF NOT EXISTS chunk_zdict (id INTEGER PRIMARY KEY AUTOINCREMENT, zdict BLOB)"
+
+def train_dict(texts: Iterable[str], size: int = DICT_BYTES) -> bytes:
+    """Frequent 1-3 word phrases, up to size bytes; the ones saving the most sit at the end, where
+    deflate's back-references are shortest."""
+    c = Counter()
+    for t in texts:
+        w = t.split()
+        for n in (1, 2, 3): c.update(" ".join(w[i:i + n]) for i in range(len(w) - n + 1))
+    out, total = [], 0
+    for g, f in sorted(c.items(), key=lambda x: -(x[1] - 1) * len(x[0])):
+        if f < 2 or total >= size: break
+        b = g.encode() + b" "
+        out.append(b); total += len(b)
+    return b"".join(reversed(out))[-size:]
+
+class Codec:
+    """The dictionaries of one chunks.db. Ids are never reused (AUTOINCREMENT), so a dictionary once
+    loaded stays valid; one a row names but that isn't loaded yet is read from the database then."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.dicts: Dict[int, bytes] = {}
+        self._z: Dict[int, Any] = {}  # primed compressors, copied per row
+        self._lock = threading.Lock()
+
+    def _load(self):
+        con = sqlite3.connect("file:" + os.path.abspath(self.db_path).replace("\\", "/") + "?mode=ro", uri=True)
+        try: rows = con.execute("SELECT id, zdict FROM chunk_zdict").fetchall()
+        except sqlite3.OperationalError: rows = []
+        finally: con.close()
+        with self._lock:
+            for i, d in rows: self.dicts.setdefault(i, d)
+
+    def zdict(self, did: int) -> bytes:
+        if did not in self.dicts: self._load()
+        return self.dicts[did]
+
+    def add(self, did: int, d: bytes):
+        with self._lock: self.dicts[did] = d
+
+    def text(self, x, n: Optional[int] = None):
+        if x is None or isinstance(x, str): return x if n is None or x is None else x[:n]
+        x = bytes(x)
+        if x[:1] != TAG: raise ValueError("Not a packed chunk")
+        d = zlib.decompressobj(-15, zdict=self.zdict(struct.unpack_from(">H", x, 1)[0]))
+        if n is None: return (d.decompress(x[3:]) + d.flush()).decode()
+        out, data = b"", x[3:]
+        while True:
+            out += d.decompress(data, max(n, 256))  # at least one byte per character
+            data = d.unconsumed_tail
+            if not data: out += d.flush()
+            s = out.decode("utf-8", "ignore")  # drops a character cut at the end
+            if len(s) >= n or not data: return s[:n]
+
+    def pack(self, text: Optional[str], did: Optional[int]):
+        """text deflated with dictionary did; left plain if there is none or packing doesn't pay."""
+        if text is None or did is None: return text
+        z = self._z.get(did)
+        if z is None: z = self._z[did] = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.zdict(did))
+        c, raw = z.copy(), text.encode()
+        b = TAG + struct.pack(">H", did) + c.compress(raw) + c.flush()
+        return b if len(b) < len(raw) else text
+
+_lock = threading.Lock()
+_codecs: Dict[str, Codec] = {}
+
+def get_codec(db_path: str) -> Codec:
+    key = os.path.abspath(db_path)
+    with _lock:
+        if key not in _codecs: _codecs[key] = Codec(db_path)
+        return _codecs[key]
+
+def register(con: sqlite3.Connection, db_path: str):
+    con.create_function("chunk_content", -1, get_codec(db_path).text, deterministic=True)
+
+def connect(db_path: str, **kw) -> sqlite3.Connection:
+    con = sqlite3.connect(db_path, **kw)
+    register(con, db_path)
+    return con
+
+def latest_dict(con) -> Optional[int]:
+    con.execute(DICT_SQL)
+    return con.execute("SELECT MAX(id) FROM chunk_zdict").fetchone()[0]
+
+def pack_chunks(con, db_path: str, retrain: bool = False) -> Dict[str, int]:
+    """Pack every plain row of chunks and chunk_dups inside the caller's transaction. The dictionary is
+    trained on a sample of them when the database has none yet, or on retrain (a full rebuild); older
+    dictionaries stay, for rows packed with them elsewhere (e.g. chunk_sentences). Rows shrunk in place
+    leave their pages part empty: VACUUM after a run that trained one."""
+    codec = get_codec(db_path)
+    did = latest_dict(con)
+    st = {"rows": 0, "bytes": 0, "packed": 0, "trained": did is None or retrain}
+    if st["trained"]:
+        ids = [r[0] for r in con.execute("SELECT id FROM chunks WHERE typeof(content) = 'text'")]
+        ids = random.Random(0).sample(ids, min(len(ids), TRAIN_ROWS))
+        texts = [con.execute("SELECT content FROM chunks WHERE id = ?", (i,)).fetchone()[0] for i in ids]
+        if texts:
+            d = train_dict(texts)
+            did = con.execute("INSERT INTO chunk_zdict (zdict) VALUES (?)", (d,)).lastrowid
+            codec.add(did, d)
+    if did is None: return st
+    for t in ("chunks", "chunk_dups"):
+        rows = con.execute(f"SELECT id, content FROM {t} WHERE typeof(content) = 'text'").fetchall()
+        out = [(codec.pack(c, did), i) for i, c in rows]
+        con.executemany(f"UPDATE {t} SET content = ? WHERE id = ?", out)
+        done = [(c, b) for (_, c), (b, _) in zip(rows, out) if isinstance(b, bytes)]
+        st["rows"] += len(done)
+        st["bytes"] += sum(len(c.encode()) for c, _ in done)
+        st["packed"] += sum(len(b) for _, b in done)
+    return st
+
+def _forget(under):
+    with _lock:
+        for k in [k for k in _codecs if under(k)]: del _codecs[k]
+
+on_release(_forget)
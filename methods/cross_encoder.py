@@ -0,0 +1,75 @@
+import time, threading, numpy as np
+from typing import *
+from methods.cache import LRUCache, normalize_query
+from methods.metrics import count
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class CrossReranker:
+    """Second-stage reranker: scores (query, chunk) pairs with a small cross-encoder, best first-stage
+    candidates first. Each batch is sized from a running per-pair cost estimate to fit what is left of
+    budget_ms, and scoring stops when nothing more fits. Candidates it never reached keep their
+    first-stage order below the scored ones, with score 0. Pair scores are cached, so a repeated or
+    overlapping query only pays for the pairs it has not seen."""
+
+    def __init__(self, model: str = DEFAULT_MODEL, batch_size: int = 16, budget_ms: float = 200.0, max_length: int = 256,
+                 cache_size: int = 50000, ttl: float = 3600.0):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+        self.scores = LRUCache(cache_size, ttl)
+        self.model = None
+        self.ms_per_pair: Optional[float] = None  # EWMA over predict() calls
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+        return self.model
+
+    def predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        # one forward pass per call; ms-marco models get a sigmoid, so scores are in [0, 1]
+        return np.asarray(self.load().predict(pairs, batch_size=len(pairs), show_progress_bar=False), dtype=np.float32).reshape(-1)
+
+    def rerank_batch(self, qs: List[str], cands_list, k: int, budget_ms: Optional[float] = None):
+        """cands_list holds each query's (id, doc, meta, score) candidates in first-stage order; the
+        budget covers the whole batch. Returns the top k per query as (id, doc, meta, cross score)."""
+        budget = self.budget_ms if budget_ms is None else budget_ms
+        keys = [[(normalize_query(q), str(c[0]), hash(c[1])) for c in cands] for q, cands in zip(qs, cands_list)]
+        sc = [np.array([self.scores.get(kk, np.nan) for kk in ks], np.float32) for ks in keys]
+        # rank-major over queries, so every query gets its best candidates scored first
+        todo = [(qi, r) for r in range(max(map(len, cands_list), default=0)) for qi in range(len(qs))
+                if r < len(cands_list[qi]) and np.isnan(sc[qi][r])]
+
+        t0, done, new = time.perf_counter(), 0, np.zeros(len(qs), int)
+        while done < len(todo):
+            left = budget - (time.perf_counter() - t0) * 1000
+            fit = 0 if self.ms_per_pair is None else int(left // self.ms_per_pair)
+            # the first batch always runs (at least one pair per query) so the top candidates get scored
+            n = min(self.batch_size, max(fit, len(qs) if not done else 0), len(todo) - done)
+            if n <= 0: break
+            b = todo[done:done + n]
+            t = time.perf_counter()
+            out = self.predict([(qs[qi], cands_list[qi][r][1]) for qi, r in b])
+            per = (time.perf_counter() - t) * 1000 / n
+            self.ms_per_pair = per if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per
+            for (qi, r), v in zip(b, out):
+                sc[qi][r] = v; self.scores.put(keys[qi][r], float(v)); new[qi] += 1
+            done += n
+        for qi in range(len(qs)):
+            count("cross", int(new[qi]))
+
+        res = []
+        for cands, s in zip(cands_list, sc):
+            seen = ~np.isnan(s)
+            # scored candidates by cross score, then the unscored ones in their first-stage order
+            o = np.concatenate([np.flatnonzero(seen)[np.argsort(-s[seen], kind="stable")], np.flatnonzero(~seen)])[:k]
+            res.append([(cands[i][0], cands[i][1], cands[i][2], float(s[i]) if seen[i] else 0.0) for i in o])
+        return res
+
+    def stats(self) -> Dict[str, Any]:
+        return {"model": self.model_name, "loaded": self.model is not None, "budget_ms": self.budget_ms,
+                "ms_per_pair": self.ms_per_pair, "pairs": self.scores.stats()}
@@ -0,0 +1,63 @@
+import os
+from typing import *
+
+# Query/ingest encoder backends for all-MiniLM-L6-v2, all returning SentenceTransformer-compatible
+# objects (encode(), get_sentence_embedding_dimension()):
+#   torch       plain PyTorch fp32, what the safety_docs index was built with
+#   torch-int8  torch dynamic int8 quantisation of the Linear layers, no extra dependencies
+#   onnx        ONNX Runtime fp32 (needs optimum[onnxruntime])
+#   onnx-int8   ONNX Runtime with the int8 graph the model repo ships (ENCODER_ONNX_FILE to pick another)
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+def encoder_spec() -> Dict[str, Any]:
+    """Encoder settings from the environment, shared by ingest, the API and the scripts."""
+    return {"model": os.environ.get("ENCODER_MODEL", DEFAULT_MODEL), "backend": os.environ.get("ENCODER_BACKEND", "torch"),
+            "threads": int(os.environ.get("ENCODER_THREADS", 0)), "onnx_file": os.environ.get("ENCODER_ONNX_FILE")}
+
+def load_encoder(model: Optional[str] = None, backend: Optional[str] = None, threads: Optional[int] = None, onnx_file: Optional[str] = None):
+    spec = encoder_spec()
+    model = model or spec["model"]
+    backend = backend or spec["backend"]
+    threads = spec["threads"] if threads is None else threads
+    onnx_file = onnx_file or spec["onnx_file"]
+    if backend not in BACKENDS: raise ValueError(f"Unknown encoder backend: {backend} (choose from {', '.join(BACKENDS)})")
+
+    from sentence_transformers import SentenceTransformer
+    if backend.startswith("torch"):
+        import torch
+        if threads: torch.set_num_threads(threads)
+        enc = SentenceTransformer(model, device="cpu")
+        if backend == "torch-int8":
+            enc = torch.ao.quantization.quantize_dynamic(enc, {torch.nn.Linear}, dtype=torch.qint8)
+        return enc
+
+    kw: Dict[str, Any] = {"provider": "CPUExecutionProvider"}
+    if threads:
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+        kw["session_options"] = so
+    if backend == "onnx-int8": kw["file_name"] = onnx_file or ONNX_INT8_FILE
+    elif onnx_file: kw["file_name"] = onnx_file
+    try:
+        return SentenceTransformer(model, device="cpu", backend="onnx", model_kwargs=kw)
+    except ImportError as e:
+        raise ImportError(f"ENCODER_BACKEND={backend} needs ONNX Runtime support: pip install \"optimum[onnxruntime]\" ({e})") from e
+
+def check_compat(encoder, index, n: int = 32, tol: float = 0.98) -> Dict[str, float]:
+    """Re-encode n stored chunks and compare with the vectors already in the index. Raises if the
+    worst cosine similarity falls below tol, i.e. the encoder would drift from the indexed space."""
+    import numpy as np
+    docs, X = index.sample(n)
+    if not docs: return {"n": 0, "min_cos": 1.0, "mean_cos": 1.0}
+    E = np.asarray(encoder.encode(docs), dtype=np.float32)
+    X = np.asarray(X, dtype=np.float32)
+    cos = (E * X).sum(1) / (np.linalg.norm(E, axis=1) * np.linalg.norm(X, axis=1) + 1e-12)
+    out = {"n": len(docs), "min_cos": float(cos.min()), "mean_cos": float(cos.mean())}
+    if out["min_cos"] < tol:
+        raise ValueError(f"Encoder drifts from the index: min cosine {out['min_cos']:.4f} < {tol} over {len(docs)} chunks. "
+                         f"Re-ingest with this ENCODER_BACKEND or use one that matches the index.")
+    return out
@@ -0,0 +1,125 @@
+import sqlite3, threading, numpy as np
+from typing import *
+from methods.resources import get_pool, on_release
+
+# Learned-reranker features, one column each. vector_score / fts_score are the fused, normalised
+# scores from methods.fusion; the chunk-static ones come from columns written at ingest.
+FEATURES = ("vector_score", "fts_score", "title_hit", "query_len", "content_len", "first_chunk")
+
+# content is only read where n_tokens was never filled in (databases from before the column existed)
+STATS_SQL = "SELECT id, {nt}, chunk_index, doc_title, CASE WHEN {nt} IS NULL THEN chunk_content(content) END FROM chunks ORDER BY id"
+
+class Stats(NamedTuple):
+    ids: np.ndarray  # sorted chunk ids
+    n_tokens: np.ndarray
+    first: np.ndarray
+    titles: np.ndarray  # distinct lower-cased titles
+    title_ix: np.ndarray
+
+    def rows(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions of ids, and a mask of the ones that are present."""
+        if not len(self.ids): return np.zeros(len(ids), np.int64), np.zeros(len(ids), bool)
+        pos = np.searchsorted(self.ids, ids).clip(0, len(self.ids) - 1)
+        return pos, self.ids[pos] == ids
+
+class ChunkStats:
+    """Chunk-static features for every chunk as arrays sorted by id, reloaded when the index
+    version changes. Titles are factorised so title matching runs once per distinct title."""
+
+    def __init__(self, db_path: str):
+        self.pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self._cur: Optional[Tuple[str, Stats]] = None  # (version, snapshot), replaced in one assignment
+
+    @property
+    def cur(self) -> Optional[Stats]:
+        c = self._cur
+        return c[1] if c is not None else None
+
+    def _version(self, con):
+        try: r = con.execute("SELECT value FROM index_meta WHERE key = 'version'").fetchone()
+        except sqlite3.OperationalError: r = None
+        return r[0] if r else "0"
+
+    def get(self, version: Optional[str] = None) -> Stats:
+        """The current snapshot; swapped whole, so concurrent readers never mix two versions. version is
+        the index_meta version when the caller has already read it (QueryCache.index_ver), saving the
+        lookup. The lock is only taken to reload."""
+        c = self._cur
+        if version is None and c is not None:
+            with self.pool.conn() as con: version = self._version(con)
+        if c is not None and c[0] == version: return c[1]
+        with self._lock, self.pool.conn() as con:
+            v = self._version(con)  # a caller's version may already be behind the database
+            if self._cur is None or self._cur[0] != v:
+                cols = {r[1] for r in con.execute("PRAGMA table_info(chunks)")}
+                rows = con.execute(STATS_SQL.format(nt="n_tokens" if "n_tokens" in cols else "NULL")).fetchall()
+                n = len(rows)
+                titles, tix = np.unique(np.array([(r[3] or "").lower() for r in rows] or [""], dtype=object), return_inverse=True)
+                self._cur = (v, Stats(np.fromiter((r[0] for r in rows), np.int64, n),
+                                      np.fromiter((r[1] if r[1] is not None else len((r[4] or "").split()) for r in rows), np.float32, n),
+                                      np.fromiter((r[2] == 0 for r in rows), np.float32, n), titles, tix[:n]))
+            return self._cur[1]
+
+def merge_stats(parts: List[Stats]) -> Stats:
+    """One snapshot from several with disjoint chunk ids (e.g. one per shard)."""
+    if len(parts) == 1: return parts[0]
+    if not parts: return Stats(np.zeros(0, np.int64), np.zeros(0, np.float32), np.zeros(0, np.float32), np.array([""], dtype=object), np.zeros(0, np.int64))
+    ids = np.concatenate([p.ids for p in parts])
+    o = np.argsort(ids, kind="stable")
+    # re-factorise titles: each part's title_ix points into its own titles array
+    titles, inv = np.unique(np.concatenate([p.titles for p in parts]), return_inverse=True)
+    off = np.cumsum([0] + [len(p.titles) for p in parts])
+    tix = np.concatenate([inv.ravel()[off[i] + p.title_ix] for i, p in enumerate(parts)])
+    return Stats(ids[o], np.concatenate([p.n_tokens for p in parts])[o], np.concatenate([p.first for p in parts])[o], titles, tix[o])
+
+_lock = threading.Lock()
+_stats: Dict[str, ChunkStats] = {}
+
+def get_stats(db_path: str) -> ChunkStats:
+    with _lock:
+        if db_path not in _stats: _stats[db_path] = ChunkStats(db_path)
+        return _stats[db_path]
+
+def _forget(under):
+    with _lock:
+        for k in [k for k in _stats if under(k)]: del _stats[k]
+
+on_release(_forget)
+
+def _title_hits(words: List[str], titles) -> np.ndarray:
+    return np.fromiter((any(w in t for w in words) for t in titles), np.float32, len(titles))
+
+def feature_matrix(qs: List[str], cands_list: List[List[Dict[str, Any]]], stats: Optional[ChunkStats] = None, version: Optional[str] = None) -> np.ndarray:
+    """Features for every fused candidate of every query, stacked in order: (sum of lens, len(FEATURES)).
+    Candidates are methods.fusion.fuse() dicts. Chunks missing from stats fall back to their meta, if
+    the candidates carried one. version is passed on to stats.get()."""
+    lens = [len(c) for c in cands_list]
+    N = sum(lens)
+    X = np.zeros((N, len(FEATURES)), np.float32)
+    if not N: return X
+    flat = [c for cands in cands_list for c in cands]
+    X[:, 0] = np.fromiter((c["vector_score"] for c in flat), np.float32, N)
+    X[:, 1] = np.fromiter((c["fts_score"] for c in flat), np.float32, N)
+    words = [[w.lower() for w in q.split()] for q in qs]
+    X[:, 3] = np.repeat(np.fromiter((len(w) for w in words), np.float32, len(qs)), lens)
+
+    ids = np.fromiter((int(c["id"]) for c in flat), np.int64, N)
+    s = stats.get(version) if stats is not None else None
+    pos, ok = s.rows(ids) if s is not None else (np.zeros(N, np.int64), np.zeros(N, bool))
+    qix = np.repeat(np.arange(len(qs)), lens)
+    if ok.any():
+        rows, p = np.flatnonzero(ok), pos[ok]
+        X[rows, 4] = s.n_tokens[p]
+        X[rows, 5] = s.first[p]
+        tix, qk = s.title_ix[p], qix[ok]
+        for qi in np.unique(qk):
+            sel = qk == qi
+            u, inv = np.unique(tix[sel], return_inverse=True)
+            X[rows[sel], 2] = _title_hits(words[qi], s.titles[u])[inv]
+    for i in np.flatnonzero(~ok):
+        m = flat[i]["meta"] or {}
+        X[i, 2] = _title_hits(words[qix[i]], [m.get("doc_title", "").lower()])[0]
+        X[i, 4] = len((flat[i]["doc"] or "").split())
+        X[i, 5] = float(m.get("chunk_index", 0) == 0)
+    return X
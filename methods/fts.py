@@ -0,0 +1,109 @@
+import re, sqlite3, threading
+from typing import *
+from methods.resources import get_pool
+from methods.vector_index import hydrate
+
+# Keyword retrieval over chunks_fts. A question becomes an OR of its content terms (plus NEAR groups
+# for adjacent pairs, which add score when the two words appear close together), ranked by weighted
+# bm25 over (content, doc_name, doc_title). Only rowids and ranks come out of FTS5; chunk rows are
+# hydrated afterwards in one lookup for the whole batch.
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how i if
+in into is it its itself just me more most my no nor not now of off on once only or other our ours out over own same she
+should so some such than that the their theirs them then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your yours
+""".split())
+
+RANK_SQL = "SELECT rowid, rank FROM chunks_fts WHERE chunks_fts MATCH ? AND rank MATCH ? ORDER BY rank LIMIT ?"
+VERSION_SQL = "SELECT value FROM index_meta WHERE key = 'version'"
+DF_SQL = "SELECT doc FROM chunks_vocab WHERE term = ?"
+# fts5vocab serves term =, >= and <= from the index; a < bound would be checked row by row to the end
+PREFIX_DF_SQL = "SELECT coalesce(sum(doc), 0) FROM chunks_vocab WHERE term >= ? AND term <= ?"
+PREFIX_LEN = 6  # matches the prefix='6' index built by ingest.pdf_chunker.init_db
+
+def fts_terms(q: str) -> List[str]:
+    """Lower-cased unicode61-style tokens without stopwords or single characters, deduplicated in order."""
+    out = []
+    for t in re.findall(r"\w+", q.lower()):
+        if len(t) > 1 and t not in STOPWORDS and t not in out: out.append(t)
+    return out
+
+class KeywordSearch:
+    """BM25 candidates from chunks_fts. Terms found in more than max_df of all chunks are dropped
+    (bm25's idf is already ~0 there, but their posting lists are the longest to read), as are terms
+    with no postings; at most max_terms of the rarest remain. prefix_min > 0 turns terms at least that
+    long into PREFIX_LEN-character prefix queries, which the prefix index answers from one doclist."""
+
+    def __init__(self, db_path: str, weights=(1.0, 0.0, 0.5), near: int = 5, max_terms: int = 12, max_df: float = 0.2, prefix_min: int = 0):
+        self.pool = get_pool(db_path)
+        self.rank = "bm25({})".format(", ".join(str(float(w)) for w in weights))  # content, doc_name, doc_title
+        self.near = near
+        self.max_terms = max_terms
+        self.max_df = max_df
+        self.prefix_min = prefix_min
+        self._lock = threading.Lock()
+        self._ver, self._n, self._df = None, 0, {}
+
+    def _refresh(self, con):
+        # document frequencies only change on ingest, which bumps the index version
+        try: v = (con.execute(VERSION_SQL).fetchone() or ["0"])[0]
+        except sqlite3.OperationalError: v = "0"
+        with self._lock:
+            if v == self._ver: return
+        n = con.execute("SELECT count(*) FROM chunks").fetchone()[0]
+        with self._lock: self._ver, self._n, self._df = v, n, {}
+
+    def _df_of(self, con, term: str) -> Optional[int]:
+        with self._lock:
+            if term in self._df: return self._df[term]
+        try:
+            if term.endswith("*"):
+                p = term[:-1]
+                df = con.execute(PREFIX_DF_SQL, (p, p + "\U0010ffff")).fetchone()[0]
+            else:
+                r = con.execute(DF_SQL, (term,)).fetchone(); df = r[0] if r else 0
+        except sqlite3.OperationalError:
+            return None  # no chunks_vocab (index built before it existed): keep every term
+        with self._lock:
+            if len(self._df) > 100000: self._df.clear()  # bounded: query terms need not be in the vocabulary
+            self._df[term] = df
+        return df
+
+    def _terms(self, con, q: str) -> List[str]:
+        ts = [t[:PREFIX_LEN] + "*" if self.prefix_min and len(t) >= self.prefix_min else t for t in fts_terms(q)]
+        ts = list(dict.fromkeys(ts))
+        dfs = [self._df_of(con, t) for t in ts]
+        if any(d is None for d in dfs): return ts[:self.max_terms]
+        keep = [(d, i) for i, d in enumerate(dfs) if d > 0]
+        common = [x for x in keep if x[0] > self.max_df * self._n]
+        keep = [x for x in keep if x not in common] or sorted(common)[:1]
+        keep = sorted(keep)[:self.max_terms]
+        return [ts[i] for _, i in sorted(keep, key=lambda x: x[1])]
+
+    def match_expr(self, con, q: str) -> Optional[str]:
+        ts = self._terms(con, q)
+        if not ts: return None
+        # quoting keeps words like AND/OR/NEAR from being read as FTS5 operators
+        ph = ['"' + t[:-1] + '"*' if t.endswith("*") else '"' + t + '"' for t in ts]
+        expr = " OR ".join(ph)
+        if self.near and len(ph) > 1:
+            expr = " OR ".join(f"NEAR({a} {b}, {self.near})" for a, b in zip(ph, ph[1:])) + " OR " + expr
+        return expr
+
+    def ranked(self, qs: List[str], k: int) -> List[List[Tuple[int, float]]]:
+        """(rowid, score) per query, best first; score = -bm25, so higher is better."""
+        out = []
+        with self.pool.conn() as con:
+            self._refresh(con)
+            for q in qs:
+                m = self.match_expr(con, q)
+                out.append([] if m is None else [(r[0], -r[1]) for r in con.execute(RANK_SQL, (m, self.rank, k))])
+        return out
+
+    def search(self, qs: List[str], k: int):
+        """(id, content, meta, score) candidates per query."""
+        ranked = self.ranked(qs, k)
+        rows = hydrate(self.pool, (i for r in ranked for i, _ in r))
+        return [[(i, *rows[i], s) for i, s in r if i in rows] for r in ranked]
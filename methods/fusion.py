@@ -0,0 +1,77 @@
+import os, numpy as np
+from typing import *
+
+# Candidates are (id, doc, meta, score) tuples, or (id, score) pairs from the id-only candidate stages
+# (doc and meta are None then), with higher-is-better scores.
+# Every strategy gets one row per unique chunk id: raw scores plus masks for which list the chunk came from,
+# and returns per-list and fused scores in [0, 1], so thresholds on them (e.g. methods.answer) hold for any.
+
+def _minmax(x, mask):
+    out = np.zeros_like(x)
+    if not mask.any(): return out
+    lo, hi = x[mask].min(), x[mask].max()
+    if hi > lo: out[mask] = (x[mask] - lo) / (hi - lo)
+    return out
+
+def minmax_fusion(vs, fs, vr, fr, vm, fm, a=0.6, **kw):
+    nv, nf = _minmax(vs, vm), _minmax(fs, fm)
+    return nv, nf, a * nv + (1 - a) * nf
+
+def rrf_fusion(vs, fs, vr, fr, vm, fm, a=0.6, rrf_k=60, **kw):
+    # 1 / (rrf_k + rank) over its best value, 1 / (rrf_k + 1): rank 1 scores 1.0 like the minmax top does
+    nv = np.where(vm, (rrf_k + 1.0) / (rrf_k + vr), 0.0)
+    nf = np.where(fm, (rrf_k + 1.0) / (rrf_k + fr), 0.0)
+    return nv, nf, a * nv + (1 - a) * nf
+
+FUSIONS: Dict[str, Callable] = {"minmax": minmax_fusion, "rrf": rrf_fusion}
+
+def fusion_strategy() -> str:
+    """FUSION from the environment, shared by the API and reranker training so the model is trained on the
+    fused scores it is served with."""
+    s = os.environ.get("FUSION", "minmax")
+    if s not in FUSIONS: raise ValueError(f"Unknown fusion strategy: {s} (choose from {', '.join(FUSIONS)})")
+    return s
+
+def fuse(vc, fc, k=5, strategy="minmax", **kw) -> List[Dict[str, Any]]:
+    """Merge vector and keyword candidates by chunk id and return the top k by fused score."""
+    pos: Dict[str, int] = {}
+    rows = []
+    for c in vc + fc:
+        key = str(c[0])  # Chroma ids are strings, SQLite rowids are ints
+        if key not in pos:
+            pos[key] = len(rows); rows.append((key, *(c[1:3] if len(c) > 2 else (None, None))))
+    n = len(rows)
+    if not n: return []
+
+    vs, fs = np.zeros(n), np.zeros(n)
+    vr, fr = np.zeros(n), np.zeros(n)
+    vm, fm = np.zeros(n, bool), np.zeros(n, bool)
+    for src, sc, rk, mk in ((vc, vs, vr, vm), (fc, fs, fr, fm)):
+        if not src: continue
+        ix = np.fromiter((pos[str(c[0])] for c in src), int, len(src))
+        sc[ix] = [c[-1] for c in src]; rk[ix] = np.arange(1, len(src) + 1); mk[ix] = True
+
+    nv, nf, hs = FUSIONS[strategy](vs, fs, vr, fr, vm, fm, **kw)
+    top = np.argsort(-hs, kind="stable")[:k]
+    return [{"id": rows[i][0], "doc": rows[i][1], "meta": rows[i][2], "vector_score": float(nv[i]), "fts_score": float(nf[i]), "hybrid_score": float(hs[i])} for i in top]
+
+def mmr(rel: np.ndarray, E: np.ndarray, k: int, lam: float = 0.7) -> np.ndarray:
+    """Maximal marginal relevance: up to k positions, picked greedily by lam * relevance - (1 - lam) * the
+    highest cosine similarity to the ones already picked. rel is min-max normalised first; zero rows of E
+    (embeddings not found) count as similar to nothing."""
+    n = len(rel)
+    if n <= 1 or k <= 0: return np.arange(min(n, max(k, 0)))
+    r = _minmax(np.asarray(rel, np.float64), np.ones(n, bool))
+    if E.shape[1]:
+        U = E / np.maximum(np.linalg.norm(E, axis=1, keepdims=True), 1e-12)
+        S = U @ U.T
+    else: S = np.zeros((n, n))
+    picked = [int(np.argmax(r))]
+    near = S[picked[0]].copy()
+    free = np.ones(n, bool); free[picked[0]] = False
+    while len(picked) < min(k, n):
+        sc = np.where(free, lam * r - (1 - lam) * near, -np.inf)
+        j = int(np.argmax(sc))
+        picked.append(j); free[j] = False
+        np.maximum(near, S[j], out=near)
+    return np.array(picked)
@@ -0,0 +1,153 @@
+import os, time, bisect, threading
+from contextvars import ContextVar
+from typing import *
+
+# Prometheus-style metrics for the query path. span(stage) feeds the stage histogram and, when a
+# request opened a trace, that request's timing breakdown. With METRICS_ENABLED=0 and no trace
+# open, span() hands back a shared no-op, so instrumented code pays one flag check per stage.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 30, 50, 100, 200)
+
+def _labels(names, values):
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}" if names else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._v: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, v: float = 1, **labels):
+        k = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock: self._v[k] = self._v.get(k, 0) + v
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            out += [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(self._v.items())]
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, tuple(buckets)
+        self._v: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, v: float, **labels):
+        k = tuple(str(labels[n]) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            e = self._v.get(k)
+            if e is None: e = self._v[k] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets): e[0][i] += 1
+            e[1] += v; e[2] += 1
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for k, (counts, s, n) in sorted(self._v.items()):
+                acc = 0
+                for b, c in zip(self.buckets, counts):
+                    acc += c
+                    out.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), k + (b,))} {acc}")
+                out.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), k + ('+Inf',))} {n}")
+                out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {s}")
+                out.append(f"{self.name}_count{_labels(self.labelnames, k)} {n}")
+        return out
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, *a, **kw) -> Counter:
+        m = Counter(*a, **kw); self._metrics.append(m); return m
+
+    def histogram(self, *a, **kw) -> Histogram:
+        m = Histogram(*a, **kw); self._metrics.append(m); return m
+
+    def collector(self, fn: Callable[[], List[str]]):
+        """fn() returns exposition lines computed at scrape time (e.g. cache stats)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        out = []
+        for m in self._metrics: out += m.render()
+        for fn in self._collectors: out += fn()
+        return "\n".join(out) + "\n"
+
+registry = Registry(enabled=os.environ.get("METRICS_ENABLED", "1") != "0")
+
+STAGE_SECONDS = registry.histogram("minirag_stage_seconds", "Time spent in each query pipeline stage.", ("stage",))
+REQUEST_SECONDS = registry.histogram("minirag_request_seconds", "End-to-end request latency.", ("endpoint", "mode"))
+REQUESTS = registry.counter("minirag_requests_total", "Requests served.", ("endpoint", "mode"))
+CANDIDATES = registry.histogram("minirag_candidates", "Candidates per query at each retrieval step.", ("source",), buckets=COUNT_BUCKETS)
+ENCODE_BATCH = registry.histogram("minirag_encode_batch_size", "Queries per coalesced encoder forward pass.", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("minirag_trace", default=None)
+
+class _Span:
+    __slots__ = ("stage", "t")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        el = time.perf_counter() - self.t
+        if registry.enabled: STAGE_SECONDS.observe(el, stage=self.stage)
+        tr = _trace.get()
+        if tr is not None: tr[self.stage] = tr.get(self.stage, 0.0) + el * 1000
+
+class _NoSpan:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return None
+
+_NOOP = _NoSpan()
+
+def span(stage: str):
+    if not registry.enabled and _trace.get() is None: return _NOOP
+    return _Span(stage)
+
+def count(source: str, n: int):
+    if registry.enabled: CANDIDATES.observe(n, source=source)
+
+class trace:
+    """Collects this context's stage timings (ms) into .stages; nested spans are reported inclusively."""
+
+    def __init__(self, on: bool = True):
+        self.on = on
+        self.stages: Dict[str, float] = {}
+
+    def __enter__(self):
+        if self.on: self._tok = _trace.set(self.stages)
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.total_ms = (time.perf_counter() - self.t) * 1000
+        if self.on: _trace.reset(self._tok)
+
+    def add(self, stage: str, ms: float):
+        """Time measured outside a span, e.g. awaited while another thread did the work."""
+        if self.on: self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def breakdown(self) -> Dict[str, Any]:
+        return {"total_ms": round(self.total_ms, 3), "stages_ms": {k: round(v, 3) for k, v in self.stages.items()}}
+
+def cache_collector(cache) -> Callable[[], List[str]]:
+    """Exposition lines for a QueryCache's LRU tiers."""
+    def fn():
+        st = cache.stats()
+        out = []
+        for name, kind, key in [("minirag_cache_hits_total", "counter", "hits"), ("minirag_cache_misses_total", "counter", "misses"),
+                                ("minirag_cache_evictions_total", "counter", "evictions"), ("minirag_cache_hit_ratio", "gauge", "hit_rate"),
+                                ("minirag_cache_entries", "gauge", "size")]:
+            out += [f"# TYPE {name} {kind}"] + [f'{name}{{tier="{t}"}} {st[t][key]}' for t in ("embeddings", "results")]
+        return out
+    return fn
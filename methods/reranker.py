@@ -1,97 +1,165 @@
-import sqlite3, re, pickle, numpy as np
-from sklearn.preprocessing import MinMaxScaler
-from sentence_transformers import SentenceTransformer
-from sklearn.linear_model import LogisticRegression
-import chromadb
-from chromadb.config import Settings
+import pickle, numpy as np
 from typing import *
-
-def extract_features(q, m, vs, fs):
-    th = int(any(w.lower() in m.get("doc_title", "").lower() for w in q.split()))
-    ql = len(q.split())
-    cl = len(m.get("content", "").split())
-    itc = int(m.get("chunk_index", 0) == 0)
-    return [vs, fs, th, ql, cl, itc]
+from methods.resources import get_pool
+from methods.vector_index import get_vector_index, hydrate
+from methods.fusion import fuse, mmr
+from methods.fts import KeywordSearch
+from methods.features import feature_matrix, get_stats
+from methods.scorers import load_scorer, from_estimator
+from methods.cache import QueryCache
+from methods.metrics import span, count
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from methods.cross_encoder import CrossReranker
+    from methods.shards import ShardSet
 
 class DocSearch:
-    def __init__(self, model:SentenceTransformer, db_path: str, chroma_path: str, model_file: str, a=0.6):
+    def __init__(self, model: "SentenceTransformer", db_path: str, chroma_path: str, model_file: str, a=0.6, fusion="minmax", fts_k=30, cache: Optional[QueryCache] = None, backend="chroma", vec_path=None, rescore=4, cross: Optional["CrossReranker"] = None, pool_k=100, fts_opts: Optional[Dict[str, Any]] = None, shards: Optional["ShardSet"] = None, mmr_pool=3, snippet: Optional[int] = None):
         self.model = model
+        self.cache = cache
         self.db_path = db_path
         self.a = a
+        self.fusion = fusion
+        self.fts_k = fts_k
         self.model_file = model_file
-        self.scl = MinMaxScaler()
-
-        cli = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
-        self.coll = cli.get_collection("safety_docs")
-
-        try:
-            with open(model_file, "rb") as f: self.clf: Optional[LogisticRegression] = pickle.load(f)
-        except FileNotFoundError: self.clf = None
+        self.cross = cross
+        self.pool_k = pool_k  # fused candidates handed to the cross-encoder
+        self.mmr_pool = mmr_pool  # with diversity: top_k * mmr_pool ranked candidates to pick top_k from
+        self.snippet = snippet  # characters of content in results; None: all of it
+        self.shards = shards
+
+        if shards is not None:
+            # sharded index: the ShardSet fans vector and keyword searches out to every shard and merges them
+            self.vindex = self.kw = shards
+            self.stats = shards.stats
+        else:
+            self.vindex = get_vector_index(backend, chroma_path=chroma_path, db_path=db_path, vec_path=vec_path, rescore=rescore)
+            self.pool = get_pool(db_path)
+            self.stats = get_stats(db_path)
+            self.kw = KeywordSearch(db_path, **(fts_opts or {}))
+
+        # a pickled estimator or an exported .npz (methods.scorers); LogisticRegression pickles run as plain arrays
+        try: self.scorer = load_scorer(model_file)
+        except FileNotFoundError: self.scorer = None
 
     def get_vector_candidates(self, qe, k=5):
-        res = self.coll.query(query_embeddings=[qe], n_results=k)
-        docs, metas, ids, dists = res["documents"][0], res["metadatas"][0], res["ids"][0], res["distances"][0]
-        vs = [1 - d for d in dists]
-        return list(zip(ids, docs, metas, vs))
+        return self.vindex.query([qe], k)[0]
 
-    def get_fts_candidates(self, q, k=30):
-        con = sqlite3.connect(self.db_path); cur = con.cursor(); con.row_factory = sqlite3.Row
-        qc = re.sub(r"[^\w\s]", "", q); fts_q = f'"{qc}"'
-        sql = f"""SELECT c.id, c.doc_name, c.doc_title, c.doc_url, c.chunk_index, c.page_num, c.content, bm25(chunks_fts) AS score FROM chunks c JOIN chunks_fts fts ON c.id = fts.rowid WHERE chunks_fts MATCH ? ORDER BY score LIMIT {k}"""
-        cur.execute(sql, (fts_q,)); rows = cur.fetchall(); con.close()
-        return [(r["id"], r["content"], dict(r), r["score"]) for r in rows]
+    def get_vector_candidates_batch(self, qes, k=5):
+        return self.vindex.query(qes, k)
 
-    def hybrid_rerank(self, vc, fc, k=5) -> List[Dict[str, Any]]:
-        cd = {}
-        for cid, doc, meta, score in vc + fc:
-            if cid not in cd: cd[cid] = {"doc": doc, "meta": meta, "vector_score":0, "fts_score":0, "hybrid_score":0}
-            if (cid, doc, meta, score) in vc: cd[cid]["vector_score"] = score
-            if (cid, doc, meta, score) in fc: cd[cid]["fts_score"] = score
+    def get_fts_candidates(self, q, k=30):
+        return self.kw.search([q], k)[0]
 
-        vs = [v["vector_score"] for v in cd.values()]
-        fs = [v["fts_score"] for v in cd.values()]
-        nv = self.scl.fit_transform(np.array(vs).reshape(-1,1)).flatten() if vs else []
-        nf = self.scl.fit_transform(np.array(fs).reshape(-1,1)).flatten() if fs else []
+    def get_fts_candidates_batch(self, qs, k=30):
+        return self.kw.search(list(qs), k)
 
-        for idx, key in enumerate(cd.keys()):
-            cd[key]["vector_score"] = nv[idx] if nv.size else 0
-            cd[key]["fts_score"] = nf[idx] if nf.size else 0
-            cd[key]["hybrid_score"] = self.a*cd[key]["vector_score"] + (1-self.a)*cd[key]["fts_score"]
+    def hydrate(self, ids, full=False) -> Dict[int, Tuple[str, Dict[str, Any]]]:
+        """Chunk id -> (content, meta) in one bulk lookup; content is cut to snippet characters unless full."""
+        n = None if full else self.snippet
+        return self.shards.hydrate(ids, n) if self.shards is not None else hydrate(self.pool, ids, n)
 
-        return sorted(cd.values(), key=lambda x:x["hybrid_score"], reverse=True)[:k]
+    def hybrid_rerank(self, vc, fc, k=5) -> List[Dict[str, Any]]:
+        return fuse(vc, fc, k=k, strategy=self.fusion, a=self.a)
 
-    def learned_rerank(self, cands, q):
-        feats, ids = [], []
-        for cid, doc, meta, score in cands:
-            vs = meta.get("vector_score", 0)
-            fs = meta.get("fts_score", 0)
-            meta['content'] = doc 
-            f = extract_features(q, meta, vs, fs)
-            feats.append(f)
-            ids.append(cid)
-
-        X = np.array(feats)
-        if self.clf is None:
+    def _predict(self, X):
+        if self.scorer is None:
+            from sklearn.linear_model import LogisticRegression
             y = np.array([1 if i<len(X)//2 else 0 for i in range(len(X))])
-            self.clf = LogisticRegression(class_weight="balanced", max_iter=1000)
-            self.clf.fit(X,y)
-            with open(self.model_file,"wb") as f: pickle.dump(self.clf,f)
-
-        probs = self.clf.predict_proba(X)[:,1]
-        reranked = sorted(zip(cands, probs), key=lambda x:x[1], reverse=True)
-        return [(c[0], c[1], c[2], p) for c,p in reranked]
+            clf = LogisticRegression(class_weight="balanced", max_iter=1000)
+            clf.fit(X,y)
+            with open(self.model_file,"wb") as f: pickle.dump(clf,f)
+            self.scorer = from_estimator(clf)
+        return self.scorer.score(X)
 
-    def query_docs(self, q, top_k, ul=True):
-        qe = self.model.encode([q]).tolist()[0]
-        vc = self.get_vector_candidates(qe, k=top_k)
-        fc = self.get_fts_candidates(q, k=30)
-        hc = self.hybrid_rerank(vc, fc, k=top_k)
-
-        if ul:
-            final = self.learned_rerank([(idx,c["doc"],c["meta"],c["hybrid_score"]) for idx,c in enumerate(hc)], q)
-        else: final = [(idx,c["doc"],c["meta"],c["hybrid_score"]) for idx,c in enumerate(hc)]
+    @staticmethod
+    def _sort(cands, probs):
+        o = np.argsort(-probs, kind="stable")
+        return [(cands[i]["id"], cands[i]["doc"], cands[i]["meta"], float(probs[i])) for i in o]
 
+    def learned_rerank(self, cands, q):
+        return self.learned_rerank_batch([cands], [q])[0]
+
+    def learned_rerank_batch(self, cands_list, qs):
+        """Rerank fused candidates (hybrid_rerank dicts): one feature matrix and one scorer call for all queries."""
+        # the result cache has just read the index version; reuse it rather than look it up again
+        X = feature_matrix(qs, cands_list, self.stats, self.cache.index_ver if self.cache is not None and self.shards is None else None)
+        if not len(X): return [[] for _ in cands_list]
+        probs = self._predict(X)
+        out, off = [], 0
+        for cands in cands_list:
+            out.append(self._sort(cands, probs[off:off + len(cands)])); off += len(cands)
+        return out
+
+    def embed(self, qs):
+        if self.cache: return self.cache.embed(self.model, list(qs))
+        with span("encode"): return self.model.encode(list(qs)).tolist()
+
+    def query_docs(self, q, top_k, ul=True, qe=None, ce=False, on_stage=None, diversity=0.0):
+        cb = None if on_stage is None else lambda stage, res: on_stage(stage, res[0])
+        return self.query_docs_batch([q], top_k, ul=ul, qes=None if qe is None else [qe], ce=ce, on_stage=cb, diversity=diversity)[0]
+
+    def query_docs_batch(self, qs, top_k, ul=True, qes=None, ce=False, on_stage=None, diversity=0.0):
+        """on_stage(stage, results) receives the fused top_k per query before a rerank stage runs ("fusion"
+        ahead of "learned" or "cross"), so callers can stream early evidence. Queries answered from the
+        result cache have None there. diversity > 0 re-picks the top_k from a wider ranking by MMR with
+        lambda = 1 - diversity, so near-identical chunks don't fill the result slots."""
+        qs = list(qs)
+        # ce: widen the fused pool to pool_k and rerank it with the cross-encoder. Its results depend on
+        # the latency budget, so they skip the result cache; the cross-encoder caches pair scores instead.
+        if ce: return self._search_batch(qs, top_k, ul, qes, ce=True, on_stage=on_stage, diversity=diversity)
+        if self.cache is None: return self._search_batch(qs, top_k, ul, qes, on_stage=on_stage, diversity=diversity)
+
+        def compute(ix):
+            sub = [qs[i] for i in ix]
+            cb = None if on_stage is None else lambda stage, res: on_stage(stage, [dict(zip(ix, res)).get(i) for i in range(len(qs))])
+            return self._search_batch(sub, top_k, ul, [qes[i] for i in ix] if qes is not None else None, on_stage=cb, diversity=diversity)
+        # the fusion strategy changes both rankings, and the disk tier outlives a restart with another FUSION
+        mode = ("learned" if ul else "hybrid") + "/" + self.fusion + (f"/mmr{diversity:g}" if diversity else "")
+        return self.cache.results(qs, mode, top_k, compute)
+
+    def _diversify(self, finals, k, diversity):
+        """MMR over each query's ranked (id, score) list, on the chunks' stored embeddings."""
+        E = self.vindex.vectors([c[0] for f in finals for c in f])
+        out, off = [], 0
+        for f in finals:
+            o = mmr(np.array([c[1] for c in f], np.float64), E[off:off + len(f)], k, 1 - diversity)
+            out.append([f[i] for i in o]); off += len(f)
+        return out
+
+    def _search_batch(self, qs, top_k, ul, qes, ce=False, on_stage=None, diversity=0.0):
+        if ce and self.cross is None: raise ValueError("No cross-encoder configured (set CROSS_ENCODER)")
+        if qes is None: qes = self.embed(qs)
+        k = max(top_k, self.pool_k) if ce else top_k
+        if diversity: k = max(k, top_k * self.mmr_pool)
+        # candidate stages carry (id, score) only; chunk text is read for the results (and the cross-encoder's pool)
+        with span("vector"): vcs = self.vindex.nearest(qes, k)
+        with span("fts"): fcs = self.kw.ranked(qs, max(self.fts_k, k) if ce else self.fts_k)
+        with span("fusion"): fused = [self.hybrid_rerank(vc, fc, k=k) for vc, fc in zip(vcs, fcs)]
+        for vc, fc, hc in zip(vcs, fcs, fused):
+            count("vector", len(vc)); count("fts", len(fc)); count("fused", len(hc))
+        if on_stage is not None and (ce or ul):
+            on_stage("fusion", self._results([[(c["id"], c["hybrid_score"]) for c in hc[:top_k]] for hc in fused]))
+        if ce:
+            rows = self.hydrate((c["id"] for hc in fused for c in hc), full=True)
+            pools = [[(c["id"], *rows[int(c["id"])], c["hybrid_score"]) for c in hc if int(c["id"]) in rows] for hc in fused]
+            with span("cross"): finals = self.cross.rerank_batch(qs, pools, top_k * self.mmr_pool if diversity else top_k)
+            finals = [[(c[0], c[3]) for c in f] for f in finals]
+        elif ul:
+            with span("learned"): finals = [[(c[0], c[3]) for c in f] for f in self.learned_rerank_batch(fused, qs)]
+        else: finals = [[(c["id"], c["hybrid_score"]) for c in hc] for hc in fused]
+        if diversity:
+            with span("mmr"): finals = self._diversify(finals, top_k, diversity)
+        return self._results(finals)
+
+    def _results(self, finals):
+        with span("hydrate"): rows = self.hydrate(i for f in finals for i, _ in f)
+        return [self._format([(i, *rows[int(i)], s) for i, s in f if int(i) in rows]) for f in finals]
+
+    @staticmethod
+    def _format(final):
         return [
-            {"doc_name": c[2].get("doc_name",""), "doc_title": c[2].get("doc_title",""), "doc_url": c[2].get("doc_url",""), "page_num": c[2].get("page_num"), "chunk_index": c[2].get("chunk_index"), "score": c[3], "content": c[1]}
+            {"chunk_id": c[0], "doc_name": c[2].get("doc_name",""), "doc_title": c[2].get("doc_title",""), "doc_url": c[2].get("doc_url",""), "page_num": c[2].get("page_num"), "chunk_index": c[2].get("chunk_index"), "score": c[3], "content": c[1]}
             for c in final
         ]
@@ -0,0 +1,106 @@
+import os, queue, sqlite3, threading
+from contextlib import contextmanager
+from typing import *
+
+_lock = threading.Lock()
+_clients: Dict[str, Any] = {}
+_colls: Dict[Tuple[str, str], Any] = {}
+_pools: Dict[str, "SQLitePool"] = {}
+
+def get_client(chroma_path: str):
+    key = os.path.abspath(chroma_path)
+    with _lock:
+        if key not in _clients:
+            import chromadb  # deferred: importing chromadb costs ~1s at startup
+            from chromadb.config import Settings
+            _clients[key] = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
+        return _clients[key]
+
+def get_collection(chroma_path: str, name: str = "safety_docs"):
+    key = (os.path.abspath(chroma_path), name)
+    with _lock:
+        coll = _colls.get(key)
+    if coll is None:
+        coll = get_client(chroma_path).get_collection(name)
+        with _lock: coll = _colls.setdefault(key, coll)
+    return coll
+
+class SQLitePool:
+    """Fixed-size pool of read-only connections. Statements are cached per connection by sqlite3,
+    so callers should keep SQL text constant (bind LIMIT etc. as parameters) to reuse the prepared form."""
+
+    def __init__(self, db_path: str, size: int = 4, mmap_size: int = 256 << 20, cache_kb: int = 64 << 10):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_kb = cache_kb
+        self._q: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(size): self._q.put(self._connect())
+
+    def _connect(self):
+        from methods.chunk_store import register
+        uri = "file:" + os.path.abspath(self.db_path).replace("\\", "/") + "?mode=ro"
+        con = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        con.row_factory = sqlite3.Row
+        register(con, self.db_path)  # chunk_content(): reads packed chunk text
+        con.execute("PRAGMA query_only = ON")
+        con.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        con.execute(f"PRAGMA cache_size = -{int(self.cache_kb)}")
+        con.execute("PRAGMA temp_store = MEMORY")
+        return con
+
+    @contextmanager
+    def conn(self):
+        con = self._q.get()
+        try: yield con
+        finally: self._q.put(con)
+
+    def close(self):
+        while not self._q.empty(): self._q.get_nowait().close()
+
+def get_pool(db_path: str, size: int = 4) -> SQLitePool:
+    key = os.path.abspath(db_path)
+    with _lock:
+        if key not in _pools: _pools[key] = SQLitePool(db_path, size=size)
+        return _pools[key]
+
+_on_release: List[Callable[[Callable[[Optional[str]], bool]], None]] = []
+
+def on_release(fn: Callable[[Callable[[Optional[str]], bool]], None]):
+    """Register fn(under) to drop another path-keyed cache's entries on release(); under(p) is True for paths in the released directory."""
+    _on_release.append(fn)
+
+def release(path: str):
+    """Close the pools and drop the Chroma clients, vector indexes and stats opened on files under path
+    (a retired index directory)."""
+    d = os.path.join(os.path.abspath(path), "")
+    under = lambda k: k is not None and os.path.join(os.path.abspath(k), "").startswith(d)
+    with _lock:
+        pools = [_pools.pop(k) for k in [k for k in _pools if under(k)]]
+        for k in [k for k in _colls if under(k[0])]: del _colls[k]
+        for k in [k for k in _clients if under(k)]: del _clients[k]
+    for p in pools: p.close()
+    for fn in _on_release: fn(under)
+
+class RefCounted:
+    """Closed once the last reference is released. The owner holds the first reference; readers
+    acquire() one while the owner still holds its own, so a swapped-out object closes after its
+    in-flight users are done with it, never under them."""
+
+    def __init__(self):
+        self.refs = 1
+        self._rlock = threading.Lock()
+
+    def acquire(self):
+        with self._rlock:
+            if self.refs <= 0: raise RuntimeError(f"{self!r} is closed")
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self._rlock:
+            self.refs -= 1
+            last = self.refs == 0
+        if last: self.close()
+
+    def close(self):
+        pass
@@ -0,0 +1,171 @@
+import os, time, threading
+from contextlib import contextmanager, ExitStack
+from typing import *
+
+class Runtime:
+    """Owns the serving components and builds them on first use, on warmup(), or, for a torch encoder,
+    in a parent process before it forks workers (preload()). State goes cold -> loading -> ready,
+    or failed; status() reports it with per-step load times for the readiness probe. With cfg["snapshots"]
+    the search components come from the published index snapshot and are swapped when a new one is
+    published; requests pin() the components they run on."""
+
+    def __init__(self, cfg: Dict[str, Any]):
+        self.cfg = cfg
+        self.state = "cold"
+        self.warm = False
+        self.error: Optional[str] = None
+        self.compat: Optional[Dict[str, float]] = None
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.model = self.cache = self.enc = self.cross = self.shards = self.snap = self.snaps = None
+        self._on_load: List[Callable[["Runtime"], None]] = []
+        self.inflight = 0  # queries inside serving(); background ingest yields while this is above 0
+        self.last_query = 0.0  # time.monotonic() when the last one finished
+        self._busy = threading.Lock()
+
+    def on_load(self, fn: Callable[["Runtime"], None]):
+        self._on_load.append(fn)
+
+    def _step(self, name, fn):
+        t = time.perf_counter()
+        v = fn()
+        self.timings[name] = round((time.perf_counter() - t) * 1000, 1)
+        return v
+
+    def preload(self):
+        """Load a torch encoder's weights in a parent process that then forks: children share them
+        copy-on-write, and set their own torch thread count. Opens no sockets or SQLite handles. An ONNX
+        Runtime session starts its intra-op thread pool when it is created, and that pool does not survive
+        a fork, so for ONNX backends this only imports the libraries and each worker loads the encoder."""
+        with self._lock:
+            if self.model is None:
+                if self.cfg["encoder"]["backend"].startswith("onnx"): import sentence_transformers
+                else: self._load_encoder()
+        return self
+
+    def _load_encoder(self):
+        with self._lock:
+            if self.model is None:
+                from methods.encoders import load_encoder
+                self.model = self._step("encoder", lambda: load_encoder(**self.cfg["encoder"]))
+
+    @property
+    def srch(self):
+        s = self.snaps.cur if self.snaps is not None else self.snap
+        return s.srch if s is not None else None
+
+    @property
+    def sidx(self):
+        s = self.snaps.cur if self.snaps is not None else self.snap
+        return s.sidx if s is not None else None
+
+    def _open(self, paths: Dict[str, str], version: Optional[str] = None):
+        """DocSearch and sentence lookup over one index layout; version pins the result cache keys to it."""
+        from methods.reranker import DocSearch
+        from methods.sentence_index import SentenceIndex
+        from methods.answer import SNIPPET_CHARS
+        c = self.cfg
+        srch = DocSearch(model=self.model, db_path=paths["db"], chroma_path=paths["chroma"], model_file=paths["model"], fusion=c.get("fusion", "minmax"),
+                         cache=self.cache if version is None else self.cache.pinned(version), backend=c["backend"], vec_path=paths["vectors"],
+                         rescore=c.get("rescore", 4), cross=self.cross, pool_k=c.get("cross_pool", 100), fts_opts=c.get("fts"), shards=self.shards,
+                         snippet=SNIPPET_CHARS)  # answers only ever show this much of a chunk
+        return srch, self.shards if self.shards is not None else SentenceIndex(paths["db"])
+
+    def _check(self, srch):
+        if self.cfg["encoder"]["backend"] != "torch" and self.cfg.get("encoder_check", True):
+            from methods.encoders import check_compat
+            self.compat = self._step("encoder_check", lambda: check_compat(self.model, srch.vindex))
+
+    def _warm(self, s):
+        from methods.baseline import baseline_search_batch
+        from methods.answer import build_answers
+        q = ["machine safety warmup"]
+        qe = self.model.encode(q).tolist()
+        baseline_search_batch(self.model, q, self.cfg["chroma_path"], 5, q_embs=qe, index=s.srch.vindex, store=s.srch.hydrate)
+        res = s.srch._search_batch(q, 5, True, qe)  # bypasses the result cache
+        build_answers(self.model, qe, res, "learned", sidx=s.sidx)
+
+    def _swap_in(self, s):
+        # a new snapshot must match the encoder and be warm before it takes traffic
+        self._check(s.srch)
+        if self.warm: self._warm(s)
+
+    @contextmanager
+    def pin(self):
+        """The components (a methods.snapshots.Snapshot: srch, sidx, name) to serve one request from start to
+        end, even if a new snapshot or new shards are swapped in meanwhile."""
+        self.load()
+        with ExitStack() as st:
+            s = st.enter_context(self.snaps.use()) if self.snaps is not None else self.snap
+            if self.shards is not None: st.enter_context(self.shards.pin())
+            yield s
+
+    @contextmanager
+    def serving(self):
+        """Counts a query in inflight from its encoding to its answer."""
+        with self._busy: self.inflight += 1
+        try: yield
+        finally:
+            with self._busy:
+                self.inflight -= 1
+                self.last_query = time.monotonic()
+
+    def load(self):
+        if self.state == "ready": return self
+        with self._lock:
+            if self.state == "ready": return self
+            self.state = "loading"
+            try:
+                from methods.cache import QueryCache
+                from methods.snapshots import Snapshot, SnapshotManager, snapshot_paths
+                from methods.batching import BatchEncoder
+                c = self.cfg
+                if c.get("shards") and c.get("snapshots"): raise ValueError("Serve either a sharded index or index snapshots, not both.")
+                self._load_encoder()
+                if c.get("shards"):
+                    from methods.shards import ShardSet
+                    self.shards = self._step("shards", lambda: ShardSet(c["shards"]["path"], backend=c["backend"], rescore=c.get("rescore", 4),
+                                                                        fts_opts=c.get("fts"), workers=c["shards"].get("workers")))
+                ver = self.shards.version if self.shards is not None else None
+                if c.get("snapshots"): ver = lambda: self.snaps.version()
+                # a snapshot's reranker never changes after it is published, so its name covers the model too
+                self.cache = self._step("cache", lambda: QueryCache(c["db_path"], ttl=c["cache_ttl"], disk_path=c["cache_db"], version_fn=ver,
+                                                                    model_file=None if c.get("snapshots") else c["model_file"],
+                                                                    disk_rows=c.get("cache_disk_rows", 100000)))
+                if c.get("cross"):
+                    from methods.cross_encoder import CrossReranker
+                    self.cross = CrossReranker(**c["cross"])
+                if c.get("snapshots"):
+                    self.snaps = self._step("search", lambda: SnapshotManager(c["snapshots"]["path"], lambda name, path: self._open(snapshot_paths(path), name),
+                                                                              warm_fn=self._swap_in, check_s=c["snapshots"].get("check_s", 2.0)))
+                else:
+                    paths = {"db": c["db_path"], "chroma": c["chroma_path"], "vectors": c["vec_path"], "model": c["model_file"]}
+                    self.snap = self._step("search", lambda: Snapshot(None, None, *self._open(paths)))
+                    self._check(self.srch)
+                # concurrent /ask calls share forward passes
+                self.enc = BatchEncoder(self.model, max_batch=c["encode_max_batch"], window_ms=c["encode_window_ms"])
+                for fn in self._on_load: fn(self)
+                self.state = "ready"
+            except Exception as e:
+                self.state, self.error = "failed", repr(e)
+                raise
+        return self
+
+    def warmup(self):
+        """Load everything, then push one query through every stage so the first real request
+        doesn't pay for lazy initialisation (torch kernels, SQLite page cache, vector mmap)."""
+        self.load()
+        def run():
+            with self.pin() as s: self._warm(s)
+        self._step("warmup", run)
+        if self.srch.cross is not None: self._step("cross_encoder", lambda: self.srch.cross.predict([("warmup", "machine safety")]))
+        self.warm = True
+        return self
+
+    def close(self):
+        if self.enc is not None: self.enc.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "warm": self.warm, "pid": os.getpid(), "load_ms": dict(self.timings),
+                "encoder": {**self.cfg["encoder"], "compat": self.compat}, "error": self.error,
+                "snapshot": self.snaps.version() if self.snaps is not None else None}
@@ -0,0 +1,115 @@
+import os, pickle, numpy as np
+from typing import *
+
+# A scorer maps a methods.features.feature_matrix() to one relevance score per row, higher is better.
+# LinearScorer and TreeScorer run on plain weight arrays (.npz, no sklearn needed at serve time);
+# SklearnScorer wraps any pickled estimator with predict_proba.
+
+def _sigmoid(z):
+    np.negative(z, out=z); np.exp(z, out=z); z += 1
+    return np.reciprocal(z, out=z)
+
+class LinearScorer:
+    kind = "linear"
+
+    def __init__(self, w, b=0.0):
+        self.w = np.ascontiguousarray(w, dtype=np.float32).ravel()
+        self.b = np.float32(b)
+
+    def score(self, X):
+        z = np.asarray(X, dtype=np.float32) @ self.w
+        z += self.b
+        return _sigmoid(z)
+
+    def arrays(self):
+        return {"w": self.w, "b": np.float32(self.b)}
+
+class TreeScorer:
+    """Sum of binary regression trees in flat node arrays (leaves have left == -1), plus a bias;
+    a logistic link turns the sum into a probability. All rows descend all trees in lock-step."""
+    kind = "trees"
+
+    def __init__(self, feature, threshold, left, right, value, roots, bias=0.0, depth=None):
+        self.feature, self.threshold = np.asarray(feature, np.int64), np.asarray(threshold, np.float64)
+        self.left, self.right = np.asarray(left, np.int64), np.asarray(right, np.int64)
+        self.value, self.roots = np.asarray(value, np.float32), np.asarray(roots, np.int64)
+        self.bias = np.float32(bias)
+        self.depth = int(depth) if depth is not None else self._depth()
+        # leaves loop onto themselves so every row can take the same number of steps
+        leaf = self.left < 0
+        idx = np.arange(len(self.left))
+        self._l, self._r = np.where(leaf, idx, self.left), np.where(leaf, idx, self.right)
+        self._f = np.where(leaf, 0, self.feature)
+
+    def _depth(self):
+        best, stack = 0, [(int(r), 0) for r in self.roots]
+        while stack:
+            n, k = stack.pop(); best = max(best, k)
+            if self.left[n] >= 0: stack += [(int(self.left[n]), k + 1), (int(self.right[n]), k + 1)]
+        return best
+
+    def score(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.depth):
+            go_left = X[rows, self._f[node]] <= self.threshold[node]
+            node = np.where(go_left, self._l[node], self._r[node])
+        z = self.value[node].sum(1)
+        z += self.bias
+        return _sigmoid(z)
+
+    def arrays(self):
+        return {"feature": self.feature, "threshold": self.threshold, "left": self.left, "right": self.right,
+                "value": self.value, "roots": self.roots, "bias": np.float32(self.bias), "depth": np.int64(self.depth)}
+
+class SklearnScorer:
+    kind = "sklearn"
+
+    def __init__(self, est):
+        self.est = est
+
+    def score(self, X):
+        return self.est.predict_proba(X)[:, 1]
+
+def from_estimator(est):
+    """Plain-array scorer for a fitted LogisticRegression or GradientBoostingClassifier (binary),
+    SklearnScorer for anything else."""
+    name = type(est).__name__
+    if name == "LogisticRegression" and est.coef_.shape[0] == 1:
+        return LinearScorer(est.coef_[0], est.intercept_[0])
+    if name == "GradientBoostingClassifier" and est.n_classes_ == 2 and est.loss in ("log_loss", "deviance"):
+        feature, threshold, left, right, value, roots, off = [], [], [], [], [], [], 0
+        for t in est.estimators_[:, 0]:
+            tr = t.tree_
+            roots.append(off)
+            feature.append(tr.feature); threshold.append(tr.threshold)
+            left.append(np.where(tr.children_left >= 0, tr.children_left + off, -1))
+            right.append(np.where(tr.children_right >= 0, tr.children_right + off, -1))
+            value.append(tr.value[:, 0, 0] * est.learning_rate)
+            off += tr.node_count
+        # the initial estimator's log-odds: decision_function minus the trees' contribution at any point
+        z = np.zeros((1, est.n_features_in_))
+        bias = float(est.decision_function(z)[0] - sum(t.predict(z)[0] for t in est.estimators_[:, 0]) * est.learning_rate)
+        return TreeScorer(np.concatenate(feature), np.concatenate(threshold), np.concatenate(left), np.concatenate(right),
+                          np.concatenate(value), roots, bias, depth=max(t.tree_.max_depth for t in est.estimators_[:, 0]))
+    return SklearnScorer(est)
+
+SCORERS = {c.kind: c for c in (LinearScorer, TreeScorer)}
+
+def save_scorer(scorer, path: str):
+    """.npz for array scorers, .pkl (the estimator itself) for SklearnScorer."""
+    if isinstance(scorer, SklearnScorer):
+        with open(path, "wb") as f: pickle.dump(scorer.est, f)
+        return
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, kind=scorer.kind, **scorer.arrays())
+    os.replace(tmp, path)
+
+def load_scorer(path: str):
+    """Load a .npz scorer or a pickled estimator; pickles that export to arrays are converted."""
+    if path.endswith(".npz"):
+        with np.load(path) as z:
+            a = {k: z[k] for k in z.files}
+        return SCORERS[str(a.pop("kind"))](**a)
+    with open(path, "rb") as f: return from_estimator(pickle.load(f))
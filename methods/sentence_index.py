@@ -0,0 +1,37 @@
+import os, json, sqlite3, threading, numpy as np
+from typing import *
+from methods.resources import get_pool
+
+# chunk_sentences maps a chunk id to rows [start, start + n) of a float16 matrix of L2-normalised
+# sentence embeddings; index_meta names the current matrix file so a rebuild can swap it atomically.
+LOOKUP_SQL = """SELECT s.chunk_id, s.start, s.n, chunk_content(s.sents) AS sents, f.value AS file, d.value AS dim FROM chunk_sentences s, index_meta f, index_meta d WHERE f.key = 'sent_file' AND d.key = 'sent_dim' AND s.chunk_id IN ({})"""
+
+class SentenceIndex:
+    def __init__(self, db_path: str):
+        self.dir = os.path.dirname(os.path.abspath(db_path))
+        self.pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self._file, self._mat = None, None
+
+    def _matrix(self, fname, dim):
+        with self._lock:
+            if fname != self._file:
+                self._mat = np.memmap(os.path.join(self.dir, fname), dtype=np.float16, mode="r").reshape(-1, int(dim))
+                self._file = fname
+            return self._mat
+
+    def lookup(self, chunk_ids: List[Any]) -> List[Optional[Tuple[List[str], np.ndarray]]]:
+        """(sentences, embeddings) per chunk id, or None where the chunk is not indexed."""
+        ids = [int(c) for c in chunk_ids]
+        if not ids: return []
+        try:
+            with self.pool.conn() as con:
+                rows = con.execute(LOOKUP_SQL.format(",".join("?" * len(ids))), ids).fetchall()
+        except sqlite3.OperationalError:
+            return [None] * len(ids)  # index not built yet
+        found = {}
+        for r in rows:
+            try: mat = self._matrix(r["file"], r["dim"])
+            except (OSError, ValueError): return [None] * len(ids)  # matrix file missing or empty
+            found[r["chunk_id"]] = (json.loads(r["sents"]), np.asarray(mat[r["start"]:r["start"] + r["n"]], dtype=np.float32))
+        return [found.get(c) for c in ids]
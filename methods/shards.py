@@ -0,0 +1,220 @@
+import os, json, time, heapq, logging, sqlite3, itertools, threading, contextvars, numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+from methods.resources import get_pool, release, RefCounted
+from methods.vector_index import get_vector_index, hydrate
+from methods.fts import KeywordSearch
+from methods.features import Stats, get_stats, merge_stats
+from methods.sentence_index import SentenceIndex
+
+# A sharded index is a root directory with a shards.json manifest and one directory per shard generation,
+# each laid out like the repo root (sql_store/chunks.db, chromadb_store/, vector_store/). Shard i of n only
+# assigns chunk ids with id % n == i, so ids stay unique across shards (ingest.shards builds them).
+
+MANIFEST = "shards.json"
+
+# (ShardSet, shards) pinned by ShardSet.pin() for the request running in this context
+_pinned: contextvars.ContextVar = contextvars.ContextVar("minirag_shards", default=None)
+
+def shard_paths(d: str) -> Dict[str, str]:
+    return {"db": os.path.join(d, "sql_store", "chunks.db"), "chroma": os.path.join(d, "chromadb_store"),
+            "vectors": os.path.join(d, "vector_store")}
+
+def load_manifest(root: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(root, MANIFEST)) as f: return json.load(f)
+    except FileNotFoundError: return None
+
+def save_manifest(root: str, m: Dict[str, Any]):
+    tmp = os.path.join(root, MANIFEST + ".tmp")
+    with open(tmp, "w") as f: json.dump(m, f, indent=1)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+class Shard(RefCounted):
+    """One shard generation's search components. The ShardSet holds a reference while the shard is in
+    its set and every pinned request holds one; the last release closes its handles."""
+
+    def __init__(self, name: str, path: str, backend: str = "chroma", rescore: int = 4, fts_opts: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.name, self.path = name, path
+        p = shard_paths(path)
+        self.vindex = get_vector_index(backend, chroma_path=p["chroma"], db_path=p["db"], vec_path=p["vectors"], rescore=rescore)
+        self.kw = KeywordSearch(p["db"], **(fts_opts or {}))
+        self.stats = get_stats(p["db"])
+        self.sidx = SentenceIndex(p["db"])
+        self.pool = get_pool(p["db"])
+
+    def version(self) -> str:
+        try:
+            with self.pool.conn() as con: r = con.execute("SELECT value FROM index_meta WHERE key = 'version'").fetchone()
+        except sqlite3.OperationalError: r = None
+        return r[0] if r else "0"
+
+    def close(self):
+        release(self.path)
+
+class ShardStats:
+    """ChunkStats over every shard: the shards' snapshots merged into one, rebuilt when any of them changes."""
+
+    def __init__(self, shards: "ShardSet"):
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._cur: Tuple[List[Stats], Optional[Stats]] = ([], None)  # (parts, merged), replaced in one assignment
+
+    @property
+    def cur(self) -> Optional[Stats]:
+        return self._cur[1]
+
+    @staticmethod
+    def _same(a, b):
+        return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+    def get(self, version: Optional[str] = None) -> Stats:
+        # version is the single-index one and means nothing here: every shard checks its own
+        parts = [s.stats.get() for s in self.shards.current()]
+        old, cur = self._cur
+        if cur is not None and self._same(parts, old): return cur
+        with self._lock:
+            if self._cur[1] is None or not self._same(parts, self._cur[0]): self._cur = (parts, merge_stats(parts))
+            return self._cur[1]
+
+class ShardSet:
+    """Fan-out search over the shards in root/shards.json. Every shard is searched at once on a thread
+    pool, and the per-shard top k lists (each sorted best first) are heap-merged into one. A ShardSet
+    stands in for a vector index (query, nearest, sample), a KeywordSearch (search, ranked), ChunkStats (stats),
+    a SentenceIndex (lookup) and chunks.db (hydrate). The manifest is checked at most every check_s seconds: shards whose
+    directory changed are opened and swapped in, the rest are kept. Requests that pin() the set finish
+    on the shards they started with, and a swapped-out shard is closed after the last of them."""
+
+    def __init__(self, root: str, backend: str = "chroma", rescore: int = 4, fts_opts: Optional[Dict[str, Any]] = None,
+                 workers: Optional[int] = None, check_s: float = 2.0):
+        self.root = root
+        self.opts = {"backend": backend, "rescore": rescore, "fts_opts": fts_opts}
+        self.check_s = check_s
+        self.shards: Tuple[Shard, ...] = ()
+        self.gen = None
+        self.error: Optional[str] = None
+        self._mtime, self._checked = None, 0.0
+        self._lock = threading.Lock()
+        self._swap = threading.Lock()  # self.shards vs pin()
+        self.refresh(force=True)
+        if not self.shards: raise FileNotFoundError(f"No built shards in {os.path.join(root, MANIFEST)}")
+        self.ex = ThreadPoolExecutor(max_workers=workers or len(self.shards), thread_name_prefix="shard")
+        self.stats = ShardStats(self)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-read the manifest if it changed; True if the shard set was swapped."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_s: return False
+        # one thread reloads; the others keep searching the current set meanwhile
+        if not self._lock.acquire(blocking=force): return False
+        try:
+            self._checked = now
+            try: mt = os.stat(os.path.join(self.root, MANIFEST)).st_mtime_ns
+            except FileNotFoundError: return False
+            if mt == self._mtime and not force: return False
+            m = load_manifest(self.root)
+            cur = {s.name: s for s in self.shards}
+            out = []
+            for e in m["shards"]:
+                if not e.get("chunks"): continue  # not built yet, or no documents placed on it
+                s, path = cur.get(e["name"]), os.path.join(self.root, e["path"])
+                out.append(s if s is not None and s.path == path else Shard(e["name"], path, **self.opts))
+            changed = [s.path for s in out] != [s.path for s in self.shards]
+            with self._swap: old, self.shards = self.shards, tuple(out)
+            self.gen, self._mtime, self.error = m.get("gen"), mt, None
+            for s in old:
+                if s not in out: s.release()
+            return changed
+        except Exception as e:
+            # a shard that fails to open (e.g. a half-copied directory) keeps the old set serving
+            self.error = repr(e)
+            if force: raise
+            logging.exception("shard reload failed")
+            return False
+        finally:
+            self._lock.release()
+
+    def current(self) -> Tuple[Shard, ...]:
+        p = _pinned.get()
+        if p is not None and p[0] is self: return p[1]
+        self.refresh()
+        return self.shards
+
+    @contextmanager
+    def pin(self):
+        """Serve every search in this block (and in threads running a copy of its context) from one set of shards."""
+        p = _pinned.get()
+        if p is not None and p[0] is self:
+            yield p[1]; return
+        self.refresh()
+        with self._swap: shards = tuple(s.acquire() for s in self.shards)
+        tok = _pinned.set((self, shards))
+        try: yield shards
+        finally:
+            _pinned.reset(tok)
+            for s in shards: s.release()
+
+    def _fan(self, shards, fn):
+        if len(shards) == 1: return [fn(shards[0])]
+        # copied contexts keep request-scoped tracing working inside the pool threads
+        futs = [self.ex.submit(contextvars.copy_context().run, fn, s) for s in shards]
+        return [f.result() for f in futs]
+
+    @staticmethod
+    def _merge(lists, k):
+        """Top k of per-shard (id, doc, meta, score) or (id, score) lists that are each sorted by score, best first."""
+        return list(itertools.islice(heapq.merge(*lists, key=lambda h: -h[-1]), k))
+
+    def query(self, qes, k):
+        per = self._fan(self.current(), lambda s: s.vindex.query(qes, k))
+        return [self._merge([p[i] for p in per], k) for i in range(len(qes))]
+
+    def nearest(self, qes, k):
+        per = self._fan(self.current(), lambda s: s.vindex.nearest(qes, k))
+        return [self._merge([p[i] for p in per], k) for i in range(len(qes))]
+
+    def search(self, qs: List[str], k: int):
+        # bm25 is scored per shard (each shard's own idf and average length), then merged
+        per = self._fan(self.current(), lambda s: s.kw.search(qs, k))
+        return [self._merge([p[i] for p in per], k) for i in range(len(qs))]
+
+    def ranked(self, qs: List[str], k: int):
+        per = self._fan(self.current(), lambda s: s.kw.ranked(qs, k))
+        return [self._merge([p[i] for p in per], k) for i in range(len(qs))]
+
+    def hydrate(self, ids, n=None):
+        ids = list(ids)
+        out = {}
+        for rows in self._fan(self.current(), lambda s: hydrate(s.pool, ids, n)): out.update(rows)
+        return out
+
+    def sample(self, n):
+        shards = self.current()
+        docs, embs = [], []
+        for s in shards:
+            d, e = s.vindex.sample(-(-n // len(shards)))
+            docs += list(d); embs += list(e)
+        return docs[:n], embs[:n]
+
+    def vectors(self, ids):
+        # a chunk lives on one shard; the others return zero rows for it
+        per = [v for v in self._fan(self.current(), lambda s: s.vindex.vectors(ids)) if v.shape[1]]
+        return sum(per[1:], per[0]) if per else np.zeros((len(ids), 0), np.float32)
+
+    def lookup(self, chunk_ids: List[Any]):
+        out = [None] * len(chunk_ids)
+        for s in self.current():
+            todo = [i for i, r in enumerate(out) if r is None]
+            if not todo: break
+            for i, r in zip(todo, s.sidx.lookup([chunk_ids[i] for i in todo])): out[i] = r
+        return out
+
+    def version(self) -> str:
+        """Changes when any shard is swapped or re-ingested; keys the query cache."""
+        return f"{self.gen}:" + ".".join(s.version() for s in self.current())
+
+    def status(self) -> Dict[str, Any]:
+        return {"root": self.root, "gen": self.gen, "error": self.error,
+                "shards": [{"name": s.name, "path": s.path, "version": s.version()} for s in self.current()]}
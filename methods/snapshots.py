@@ -0,0 +1,155 @@
+import os, re, json, time, shutil, logging, threading
+from contextlib import contextmanager
+from typing import *
+from methods.resources import RefCounted, release
+from methods.shards import shard_paths
+
+# A snapshot root holds one directory per index version (v0001, v0002, ...), each laid out like the repo root
+# (sql_store/chunks.db, chromadb_store/, vector_store/, model/learned_reranker.pkl) with a snapshot.json
+# manifest, and a CURRENT file naming the version to serve. ingest.py --snapshot builds the next version
+# beside the served one and then replaces CURRENT; a published snapshot is never written to again.
+
+CURRENT = "CURRENT"
+MANIFEST = "snapshot.json"
+_NAME = re.compile(r"v(\d+)$")
+
+def snapshot_paths(d: str) -> Dict[str, str]:
+    return {**shard_paths(d), "model": os.path.join(d, "model", "learned_reranker.pkl")}
+
+def _read(path):
+    try:
+        with open(path) as f: return json.load(f)
+    except FileNotFoundError: return None
+
+def _write(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+def current_snapshot(root: str) -> Optional[str]:
+    c = _read(os.path.join(root, CURRENT))
+    return c["snapshot"] if c else None
+
+def list_snapshots(root: str) -> List[str]:
+    """Published and unpublished snapshot directories, oldest first."""
+    if not os.path.isdir(root): return []
+    return sorted((d for d in os.listdir(root) if _NAME.match(d)), key=lambda d: int(d[1:]))
+
+def snapshot_info(root: str, name: str) -> Optional[Dict[str, Any]]:
+    return _read(os.path.join(root, name, MANIFEST))
+
+def new_snapshot(root: str, base: Optional[str] = None) -> str:
+    """Create the next snapshot directory, as a copy of snapshot base (for an incremental build) or empty."""
+    have = list_snapshots(root)
+    name = f"v{int(have[-1][1:]) + 1 if have else 1:04d}"
+    d = os.path.join(root, name)
+    if base: shutil.copytree(os.path.join(root, base), d, ignore=shutil.ignore_patterns(MANIFEST))
+    else: os.makedirs(d)
+    return name
+
+def publish(root: str, name: str, **info) -> Dict[str, Any]:
+    """Write the snapshot's manifest, then point CURRENT at it: the one atomic step servers see."""
+    m = {"name": name, "parent": current_snapshot(root), "created": time.time(), **info}
+    _write(os.path.join(root, name, MANIFEST), m)
+    _write(os.path.join(root, CURRENT), {"snapshot": name, "published": m["created"]})
+    return m
+
+def prune(root: str, keep: int = 2) -> List[str]:
+    """Delete all but the newest keep published snapshots (the current one always stays), and unpublished
+    directories older than the current one, e.g. left by an interrupted build. Servers poll CURRENT, so
+    the snapshot just replaced must stay (keep >= 2) until they have switched away from it."""
+    cur = current_snapshot(root)
+    if cur is None: return []
+    names = list_snapshots(root)
+    pub = [n for n in names if os.path.exists(os.path.join(root, n, MANIFEST)) and int(n[1:]) <= int(cur[1:])]
+    stale = [n for n in names if int(n[1:]) < int(cur[1:]) and n not in pub]
+    out = [n for n in pub[:-max(keep, 1)] if n != cur] + stale
+    for n in out: shutil.rmtree(os.path.join(root, n), ignore_errors=True)
+    return out
+
+class Snapshot(RefCounted):
+    """One index version's serving components (srch: DocSearch, sidx: sentence lookup). Requests hold a
+    reference for as long as they run; the last release after it is swapped out closes its SQLite pools
+    and drops its Chroma client, vector index and cached stats."""
+
+    def __init__(self, name: Optional[str], path: Optional[str], srch, sidx, info: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.name, self.path, self.srch, self.sidx = name, path, srch, sidx
+        self.info = info or {}
+
+    def close(self):
+        if self.path is None: return
+        release(self.path)
+        logging.info("snapshot %s closed", self.name)
+
+class SnapshotManager:
+    """Serves the snapshot root/CURRENT names. CURRENT is checked at most every check_s seconds; a new
+    version is opened and warmed (warm_fn) beside the served one, then swapped in under a lock, so every
+    request sees exactly one version from start to end. If opening or warming fails, the old version
+    keeps serving and the error is reported in status()."""
+
+    def __init__(self, root: str, open_fn: Callable[[str, str], Tuple[Any, Any]], warm_fn: Optional[Callable[[Snapshot], Any]] = None,
+                 check_s: float = 2.0):
+        self.root, self.open_fn, self.warm_fn, self.check_s = root, open_fn, warm_fn, check_s
+        self.cur: Optional[Snapshot] = None
+        self.error: Optional[str] = None
+        self.draining: List[Snapshot] = []  # swapped out, still serving requests that started on them
+        self._mtime, self._checked = None, 0.0
+        self._lock = threading.Lock()  # one reload at a time
+        self._swap = threading.Lock()  # cur vs acquire()
+        self.refresh(force=True)
+        if self.cur is None: raise FileNotFoundError(f"No published snapshot in {os.path.join(root, CURRENT)}")
+
+    def refresh(self, force: bool = False) -> bool:
+        """Switch to the snapshot CURRENT names if it changed; True if a new one was swapped in."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_s: return False
+        if not self._lock.acquire(blocking=force): return False
+        try:
+            self._checked = now
+            try: mt = os.stat(os.path.join(self.root, CURRENT)).st_mtime_ns
+            except FileNotFoundError: return False
+            if mt == self._mtime and not force: return False
+            name = current_snapshot(self.root)
+            if self.cur is not None and name == self.cur.name:
+                self._mtime, self.error = mt, None
+                return False
+            path = os.path.join(self.root, name)
+            s = Snapshot(name, path, *self.open_fn(name, path), info=snapshot_info(self.root, name))
+            try:
+                if self.warm_fn is not None: self.warm_fn(s)
+            except Exception:
+                s.release()
+                raise
+            with self._swap: old, self.cur = self.cur, s
+            self._mtime, self.error = mt, None
+            if old is not None:
+                self.draining = [d for d in self.draining if d.refs > 0] + [old]
+                old.release()
+            return True
+        except Exception as e:
+            self.error = repr(e)
+            if force: raise
+            logging.exception("snapshot reload failed")
+            return False
+        finally:
+            self._lock.release()
+
+    def acquire(self) -> Snapshot:
+        self.refresh()
+        with self._swap: return self.cur.acquire()
+
+    @contextmanager
+    def use(self):
+        s = self.acquire()
+        try: yield s
+        finally: s.release()
+
+    def version(self) -> str:
+        return self.cur.name
+
+    def status(self) -> Dict[str, Any]:
+        cur = self.cur
+        return {"root": self.root, "current": cur.name, "info": cur.info, "error": self.error,
+                "in_flight": cur.refs - 1, "draining": {d.name: d.refs for d in self.draining if d.refs > 0},
+                "snapshots": list_snapshots(self.root)}
@@ -0,0 +1,303 @@
+import os, logging, threading, numpy as np
+from typing import *
+from methods.resources import get_collection, get_pool, on_release
+
+# Every backend returns, per query, a list of (id, doc, meta, score) from query(), or of (id, score) from
+# nearest(), with Chroma's scoring: score = 1 - squared L2 distance (the collection uses the default "l2" space).
+
+HYDRATE_SQL = "SELECT id, doc_name, doc_title, doc_url, chunk_index, chunk_content(content, ?) AS content, is_title, page_num FROM chunks WHERE id IN ({})"
+
+def hydrate(pool, ids, n: Optional[int] = None) -> Dict[int, Tuple[str, Dict[str, Any]]]:
+    """Chunk id -> (content, meta) in one bulk lookup; content is cut to its first n characters
+    while it is unpacked (methods.chunk_store), if n is given."""
+    ids = sorted({int(i) for i in ids})
+    if not ids: return {}
+    with pool.conn() as con:
+        rows = con.execute(HYDRATE_SQL.format(",".join("?" * len(ids))), [n, *ids]).fetchall()
+    return {r["id"]: (r["content"], {"doc_name": r["doc_name"], "doc_title": r["doc_title"], "doc_url": r["doc_url"], "page_num": r["page_num"], "chunk_index": r["chunk_index"], "is_title": r["is_title"]}) for r in rows}
+
+class ChromaIndex:
+    def __init__(self, chroma_path: str):
+        self.coll = get_collection(chroma_path)
+
+    def query(self, qes, k):
+        res = self.coll.query(query_embeddings=qes, n_results=k)
+        return [list(zip(ids, docs, metas, [1 - d for d in dists]))
+                for docs, metas, ids, dists in zip(res["documents"], res["metadatas"], res["ids"], res["distances"])]
+
+    def nearest(self, qes, k):
+        res = self.coll.query(query_embeddings=qes, n_results=k, include=["distances"])
+        return [[(i, 1 - d) for i, d in zip(ids, dists)] for ids, dists in zip(res["ids"], res["distances"])]
+
+    def sample(self, n):
+        """(documents, stored embeddings) for up to n chunks, e.g. to check encoder compatibility."""
+        res = self.coll.get(limit=n, include=["documents", "embeddings"])
+        return res["documents"], res["embeddings"]
+
+    def vectors(self, ids) -> np.ndarray:
+        """Stored embeddings of ids, one row each; zeros for ids not in the collection."""
+        ids = [str(i) for i in ids]
+        res = self.coll.get(ids=list(dict.fromkeys(ids)), include=["embeddings"]) if ids else {"ids": [], "embeddings": []}
+        got = dict(zip(res["ids"], res["embeddings"]))
+        if not got: return np.zeros((len(ids), 0), np.float32)
+        out = np.zeros((len(ids), len(next(iter(got.values())))), np.float32)
+        for r, i in enumerate(ids):
+            if i in got: out[r] = got[i]
+        return out
+
+class NumpyIndex:
+    """Exact search over a memory-mapped matrix of chunk embeddings, hydrated from chunks.db."""
+
+    def __init__(self, vec_path: str, db_path: str, block: int = 1 << 16):
+        self.vec_path = vec_path
+        self.pool = get_pool(db_path)
+        self.block = block
+        self.load()
+
+    def load(self):
+        self.X = np.load(os.path.join(self.vec_path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(self.vec_path, "ids.npy"))
+        self.sq = np.load(os.path.join(self.vec_path, "norms.npy"))
+        self._order = None  # argsort of ids, built on the first vectors() call
+
+    def _scores(self, Q, qsq, s, e):
+        Xb = np.asarray(self.X[s:e], dtype=np.float32)
+        return 1 - (qsq + self.sq[s:e][None, :] - 2 * (Q @ Xb.T))
+
+    def _topk(self, Q, k):
+        """Unordered top-k (rows, scores) per query via blocked _scores + argpartition."""
+        qsq = (Q * Q).sum(1, keepdims=True)
+        n = len(self.ids); k = min(k, n)
+        best_s = np.full((len(Q), 0), -np.inf, np.float32); best_i = np.zeros((len(Q), 0), np.int64)
+        for s in range(0, n, self.block):
+            e = min(s + self.block, n)
+            sc = self._scores(Q, qsq, s, e)
+            kk = min(k, sc.shape[1])
+            part = np.argpartition(-sc, kk - 1, axis=1)[:, :kk]
+            best_s = np.concatenate([best_s, np.take_along_axis(sc, part, 1)], 1)
+            best_i = np.concatenate([best_i, part + s], 1)
+            if best_s.shape[1] > k:
+                keep = np.argpartition(-best_s, k - 1, axis=1)[:, :k]
+                best_s = np.take_along_axis(best_s, keep, 1); best_i = np.take_along_axis(best_i, keep, 1)
+        return best_i, best_s
+
+    def _ordered(self, rows, sc):
+        ids = self.ids[rows]
+        o = np.lexsort((ids, -sc))  # ties (duplicate chunks) fall back to id order
+        return ids[o], sc[o]
+
+    def search(self, qes, k):
+        """Top-k (ids, scores) per query."""
+        rows, sc = self._topk(np.asarray(qes, dtype=np.float32), k)
+        return [self._ordered(rows[r], sc[r]) for r in range(len(rows))]
+
+    def memory(self) -> Dict[str, int]:
+        """Bytes the index keeps resident: a full scan pages in the whole float32 matrix."""
+        return {"vectors": int(self.X.nbytes), "ids+norms": int(self.ids.nbytes + self.sq.nbytes)}
+
+    def nearest(self, qes, k):
+        return [[(str(i), float(s)) for i, s in zip(ids, sc)] for ids, sc in self.search(qes, k)]
+
+    def hydrate(self, ids, n=None):
+        return hydrate(self.pool, ids, n)
+
+    def vectors(self, ids) -> np.ndarray:
+        """Stored float32 embeddings of ids, one row each; zeros for unknown ids. Only those rows are paged in."""
+        if self._order is None: self._order = np.argsort(self.ids, kind="stable")
+        ids = np.fromiter((int(i) for i in ids), np.int64)
+        out = np.zeros((len(ids), self.X.shape[1]), np.float32)
+        if not len(ids) or not len(self.ids): return out
+        rows = self._order[np.searchsorted(self.ids, ids, sorter=self._order).clip(0, len(self.ids) - 1)]
+        ok = self.ids[rows] == ids
+        out[ok] = self.X[rows[ok]]
+        return out
+
+    def sample(self, n):
+        rows = np.linspace(0, len(self.ids) - 1, min(n, len(self.ids))).astype(int)
+        got = self.hydrate(self.ids[rows])
+        keep = [r for r in rows if int(self.ids[r]) in got]
+        return [got[int(self.ids[r])][0] for r in keep], np.asarray(self.X[keep], dtype=np.float32)
+
+    def query(self, qes, k):
+        hits = self.search(qes, k)
+        rows = self.hydrate(i for ids, _ in hits for i in ids)
+        return [[(str(i), *rows[int(i)], float(s)) for i, s in zip(ids, sc) if int(i) in rows] for ids, sc in hits]
+
+class CompressedIndex(NumpyIndex):
+    """Approximate search over a compressed copy of vectors.npy held in RAM ("f16", "int8" or "pq"),
+    then exact rescoring of the best k * rescore candidates from the memory-mapped float32 file,
+    of which only the candidate rows get paged in. rescore=0 returns the approximate scores.
+    Blocks are smaller than NumpyIndex's so each block's float32 upcast stays in cache."""
+
+    def __init__(self, vec_path: str, db_path: str, kind: str = "int8", rescore: int = 4, block: int = 1 << 13):
+        self.kind = kind
+        self.rescore = rescore
+        super().__init__(vec_path, db_path, block)
+
+    def load(self):
+        super().load()
+        p = lambda f: os.path.join(self.vec_path, f)
+        if self.kind == "f16":
+            self.C = np.load(p("vectors.f16.npy"))
+        elif self.kind == "int8":
+            self.C = np.load(p("vectors.i8.npy")); self.lo = np.load(p("i8_lo.npy")); self.step = np.load(p("i8_step.npy"))
+        elif self.kind == "pq":
+            self.C = np.ascontiguousarray(np.load(p("pq_codes.npy")).T)  # (m, n): one contiguous code row per sub-space
+            self.cents = np.load(p("pq_centroids.npy"))
+            self.csq = (self.cents * self.cents).sum(2)  # (m, 256)
+        else: raise ValueError(f"Unknown compressed index kind: {self.kind}")
+
+    def _scores(self, Q, qsq, s, e):
+        if self.kind == "f16":
+            ip = Q @ self.C[s:e].astype(np.float32).T
+        elif self.kind == "int8":
+            # x ~= lo + step * (q + 128), so q.x = q.lo + (q * step).(q + 128)
+            ip = (Q @ self.lo)[:, None] + (Q * self.step) @ (self.C[s:e].astype(np.float32) + 128).T
+        else:
+            # asymmetric distance: per-query table of squared distances to every sub-centroid
+            m, _, ds = self.cents.shape
+            Qs = Q.reshape(len(Q), m, ds)
+            lut = (Qs * Qs).sum(2)[:, :, None] - 2 * np.einsum("qmd,mcd->qmc", Qs, self.cents) + self.csq[None]
+            d = np.zeros((len(Q), e - s), np.float32)
+            for j in range(m): d += lut[:, j, :][:, self.C[j, s:e]]
+            return 1 - d
+        return 1 - (qsq + self.sq[s:e][None, :] - 2 * ip)
+
+    def search(self, qes, k):
+        Q = np.asarray(qes, dtype=np.float32)
+        if not self.rescore:
+            return super().search(Q, k)
+        rows, _ = self._topk(Q, k * self.rescore)
+        out = []
+        for r in range(len(Q)):
+            cand = np.unique(rows[r])  # sorted, so the mmap reads are in file order
+            Xc = np.asarray(self.X[cand], dtype=np.float32)
+            sc = 1 - ((Q[r] * Q[r]).sum() + self.sq[cand] - 2 * (Xc @ Q[r]))
+            top = np.argpartition(-sc, min(k, len(sc)) - 1)[:k]
+            out.append(self._ordered(cand[top], sc[top]))
+        return out
+
+    def memory(self) -> Dict[str, int]:
+        m = {"codes": int(self.C.nbytes), "ids+norms": int(self.ids.nbytes + self.sq.nbytes)}
+        if self.kind == "int8": m["codes"] += int(self.lo.nbytes + self.step.nbytes)
+        if self.kind == "pq": m["codes"] += int(self.cents.nbytes)
+        return m
+
+def _kmeans(X, k, iters, rng):
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iters):
+        a = ((X * X).sum(1)[:, None] - 2 * X @ C.T + (C * C).sum(1)[None]).argmin(1)
+        for j in range(k):
+            pts = X[a == j]
+            C[j] = pts.mean(0) if len(pts) else X[rng.integers(len(X))]
+    return C
+
+def _save(out_dir, name, arr):
+    tmp = os.path.join(out_dir, name + ".tmp.npy")
+    np.save(tmp, arr)
+    os.replace(tmp, os.path.join(out_dir, name))
+
+KIND_FILES = {"f16": ("vectors.f16.npy",), "int8": ("vectors.i8.npy", "i8_lo.npy", "i8_step.npy"), "pq": ("pq_codes.npy", "pq_centroids.npy")}
+
+def compress_vector_index(vec_path: str, kinds=("f16", "int8", "pq"), pq_m: int = 48, sample: int = 50000, iters: int = 15, block: int = 1 << 16, seed: int = 0):
+    """Write compressed copies of vectors.npy next to it: float16, per-dimension scalar int8, and
+    product-quantised codes (pq_m sub-spaces x 256 centroids, trained on a sample); the copies of
+    kinds not written are deleted, since they describe an older vectors.npy."""
+    for k, fs in KIND_FILES.items():
+        if k in kinds: continue
+        for f in fs:
+            try: os.remove(os.path.join(vec_path, f))
+            except FileNotFoundError: pass
+    if not kinds: return
+    X = np.load(os.path.join(vec_path, "vectors.npy"), mmap_mode="r")
+    n, d = X.shape
+    rng = np.random.default_rng(seed)
+    if "f16" in kinds:
+        out = np.empty((n, d), np.float16)
+        for s in range(0, n, block): out[s:s+block] = X[s:s+block]
+        _save(vec_path, "vectors.f16.npy", out)
+    if "int8" in kinds:
+        lo = np.full(d, np.inf, np.float32); hi = np.full(d, -np.inf, np.float32)
+        for s in range(0, n, block):
+            lo = np.minimum(lo, X[s:s+block].min(0)); hi = np.maximum(hi, X[s:s+block].max(0))
+        step = np.maximum(hi - lo, 1e-12) / 255
+        out = np.empty((n, d), np.int8)
+        for s in range(0, n, block):
+            out[s:s+block] = np.clip(np.rint((X[s:s+block] - lo) / step), 0, 255) - 128
+        _save(vec_path, "vectors.i8.npy", out); _save(vec_path, "i8_lo.npy", lo.astype(np.float32)); _save(vec_path, "i8_step.npy", step.astype(np.float32))
+    if "pq" in kinds:
+        if d % pq_m:
+            # the sub-spaces must split the dimension evenly: take the most of them that do
+            m = max(j for j in range(1, min(pq_m, d) + 1) if d % j == 0)
+            logging.warning("pq_m=%d does not divide the dimension %d; using %d sub-spaces", pq_m, d, m)
+            pq_m = m
+        ds, kc = d // pq_m, min(256, n)
+        S = np.asarray(X[np.sort(rng.choice(n, min(sample, n), replace=False))], dtype=np.float32)
+        cents = np.zeros((pq_m, 256, ds), np.float32)
+        for j in range(pq_m): cents[j, :kc] = _kmeans(S[:, j*ds:(j+1)*ds], kc, iters, rng)
+        cents[:, kc:] = np.inf  # unused slots (tiny corpora) can never be the nearest centroid
+        codes = np.empty((n, pq_m), np.uint8)
+        for s in range(0, n, block):
+            Xb = np.asarray(X[s:s+block], dtype=np.float32)
+            for j in range(pq_m):
+                sub = Xb[:, j*ds:(j+1)*ds]; C = cents[j, :kc]
+                codes[s:s+block, j] = ((sub * sub).sum(1)[:, None] - 2 * sub @ C.T + (C * C).sum(1)[None]).argmin(1)
+        _save(vec_path, "pq_codes.npy", codes); _save(vec_path, "pq_centroids.npy", np.where(np.isfinite(cents), cents, 0).astype(np.float32))
+
+def export_vector_index(coll, out_dir: str, dtype: str = "float32", page: int = 5000):
+    """Dump a Chroma collection's embeddings to vectors.npy / ids.npy / norms.npy, swapped in atomically."""
+    n = coll.count()
+    os.makedirs(out_dir, exist_ok=True)
+    X, ids, sq, off = None, np.zeros(n, np.int64), np.zeros(n, np.float32), 0
+    tmp = os.path.join(out_dir, "vectors.npy.tmp")
+    while off < n:
+        res = coll.get(include=["embeddings"], limit=page, offset=off)
+        E = np.asarray(res["embeddings"], dtype=np.float32)
+        if not len(E): break
+        if X is None: X = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=(n, E.shape[1]))
+        X[off:off+len(E)] = E
+        ids[off:off+len(E)] = [int(i) for i in res["ids"]]
+        sq[off:off+len(E)] = (E * E).sum(1)
+        off += len(E)
+    if X is None: return 0
+    X.flush(); del X
+    np.save(os.path.join(out_dir, "ids.npy.tmp.npy"), ids[:off]); np.save(os.path.join(out_dir, "norms.npy.tmp.npy"), sq[:off])
+    os.replace(tmp, os.path.join(out_dir, "vectors.npy"))
+    os.replace(os.path.join(out_dir, "ids.npy.tmp.npy"), os.path.join(out_dir, "ids.npy"))
+    os.replace(os.path.join(out_dir, "norms.npy.tmp.npy"), os.path.join(out_dir, "norms.npy"))
+    return off
+
+COMPRESSED = ("f16", "int8", "pq")
+
+def compress_kinds() -> Tuple[str, ...]:
+    """The compressed copies ingest writes: VECTOR_COMPRESS ("f16,int8,pq", "all" or "none") or, unset, the
+    copy the VECTOR_BACKEND being served needs, if any."""
+    v = os.environ.get("VECTOR_COMPRESS")
+    if v is None:
+        b = os.environ.get("VECTOR_BACKEND", "chroma")
+        return (b,) if b in COMPRESSED else ()
+    ks = [k.strip() for k in v.split(",") if k.strip()]
+    if ks == ["all"]: return COMPRESSED
+    if ks == ["none"]: return ()
+    bad = [k for k in ks if k not in COMPRESSED]
+    if bad: raise ValueError(f"Unknown VECTOR_COMPRESS kind: {', '.join(bad)} (choose from {', '.join(COMPRESSED)}, all or none)")
+    return tuple(ks)
+
+_lock = threading.Lock()
+_indexes: Dict[Tuple, Any] = {}
+
+def get_vector_index(backend: str = "chroma", chroma_path: Optional[str] = None, db_path: Optional[str] = None, vec_path: Optional[str] = None, rescore: int = 4):
+    key = (backend, chroma_path, db_path, vec_path, rescore if backend in COMPRESSED else None)
+    with _lock:
+        if key not in _indexes:
+            if backend == "chroma": _indexes[key] = ChromaIndex(chroma_path)
+            elif backend == "numpy": _indexes[key] = NumpyIndex(vec_path, db_path)
+            elif backend in COMPRESSED: _indexes[key] = CompressedIndex(vec_path, db_path, kind=backend, rescore=rescore)
+            else: raise ValueError(f"Unknown vector backend: {backend}")
+        return _indexes[key]
+
+def _forget(under):
+    with _lock:
+        for k in [k for k in _indexes if under(k[1]) or under(k[2]) or under(k[3])]: del _indexes[k]
+
+on_release(_forget)
@@ -0,0 +1,85 @@
+"""
+Pre-fork server: load the encoder once in this process, then fork --workers uvicorn workers that
+share the listening socket and the model weights (copy-on-write). Each worker builds its own
+Chroma client and SQLite connections after the fork and warms up before /ready reports 200.
+ONNX encoders (ENCODER_BACKEND=onnx*) are loaded in each worker instead, since an ONNX Runtime
+session's thread pool does not survive a fork.
+
+    python serve.py --workers 4 --port 8000
+
+Where os.fork is unavailable (Windows) it falls back to a single uvicorn process.
+"""
+import os, gc, sys, time, socket, signal, argparse, logging
+
+def _worker(sock, args, threads):
+    import uvicorn, app
+    enc = app.rt.cfg["encoder"]
+    if enc["backend"].startswith("onnx"): enc["threads"] = threads  # the session is created in this worker, with this many intra-op threads
+    else:
+        import torch
+        torch.set_num_threads(threads)
+    cfg = uvicorn.Config(app.app, log_level=args.log_level, timeout_keep_alive=5)
+    uvicorn.Server(cfg).run(sockets=[sock])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--threads", type=int, default=0, help="encoder threads per worker (default: ENCODER_THREADS, else cpus / workers)")
+    ap.add_argument("--log-level", default="warning")
+    args = ap.parse_args()
+
+    import app
+    if not hasattr(os, "fork"):
+        import uvicorn
+        print("os.fork is not available here; serving with a single process.")
+        uvicorn.run(app.app, host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    t = time.perf_counter()
+    app.rt.preload()  # torch encoder weights only (ONNX ones load per worker); no sockets or SQLite handles cross the fork
+    what = "encoder libraries" if app.rt.model is None else "encoder"
+    print(f"Preloaded {what} in {time.perf_counter() - t:.1f}s; forking {args.workers} workers.")
+    gc.freeze()  # keep the collector from touching (and so copying) the preloaded objects' pages
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    threads = args.threads or app.rt.cfg["encoder"]["threads"] or max(1, (os.cpu_count() or 1) // args.workers)
+
+    children, stopping = {}, False
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL); signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try: _worker(sock, args, threads)
+            except Exception: logging.exception("worker crashed")
+            finally: os._exit(0)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+    signal.signal(signal.SIGINT, stop); signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers): spawn()
+    print(f"Serving on http://{args.host}:{args.port} with workers {sorted(children)}")
+    while children:
+        try: pid, status = os.wait()
+        except ChildProcessError: break
+        except InterruptedError: continue
+        started = children.pop(pid, None)
+        if not stopping and started is not None:
+            # restart crashed workers, but don't spin if they die straight after starting
+            if time.monotonic() - started < 1: time.sleep(1)
+            print(f"Worker {pid} exited ({status}); restarting.", file=sys.stderr)
+            spawn()
+
+if __name__ == "__main__":
+    main()
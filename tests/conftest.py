@@ -0,0 +1,5 @@
+import os, sys
+
+# the repo root has an __init__.py, so pytest would import it as a package from its parent: put the root
+# itself on the path, as running app.py or ingest.py from it does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+from methods.chunk_store import TAG, connect, get_codec, latest_dict, train_dict
+
+TEXTS = [f"Guards shall prevent access to the danger zone of machine {i} during operation. "
+         "The employer shall ensure that lockout procedures are applied before maintenance." for i in range(50)]
+
+def test_chunk_content_round_trip(tmp_path):
+    db = str(tmp_path / "chunks.db")
+    con = connect(db)
+    assert latest_dict(con) is None
+    d = train_dict(TEXTS)
+    did = con.execute("INSERT INTO chunk_zdict (zdict) VALUES (?)", (d,)).lastrowid
+    con.commit()
+    codec = get_codec(db)
+    text = TEXTS[7] + " Schutzeinrichtungen, Gefährdungsbeurteilung – §5."
+    packed = codec.pack(text, did)
+    assert isinstance(packed, bytes) and packed[:1] == TAG and len(packed) < len(text.encode())
+    assert con.execute("SELECT chunk_content(?)", (packed,)).fetchone()[0] == text
+    for n in (1, 10, len(text) - 3, len(text) + 10):
+        assert con.execute("SELECT chunk_content(?, ?)", (packed, n)).fetchone()[0] == text[:n]
+    # plain rows (not worth packing, or written before packing) pass through
+    assert con.execute("SELECT chunk_content(?), chunk_content(?, 3)", ("plain", "plain")).fetchone() == ("plain", "pla")
+    con.close()
+
+def test_dictionary_loaded_from_another_connection(tmp_path):
+    db = str(tmp_path / "chunks.db")
+    con = connect(db)
+    latest_dict(con)
+    did = con.execute("INSERT INTO chunk_zdict (zdict) VALUES (?)", (train_dict(TEXTS),)).lastrowid
+    con.commit()
+    packed = get_codec(db).pack(TEXTS[0], did)
+    get_codec(db).dicts.clear()  # as in a process that has not read chunk_zdict yet
+    assert connect(db).execute("SELECT chunk_content(?)", (packed,)).fetchone()[0] == TEXTS[0]
@@ -0,0 +1,20 @@
+import sqlite3
+from methods.fts import KeywordSearch, fts_terms
+
+Q = "What is the purpose of a lockout and tagout procedure for the machine?"
+
+def test_fts_terms_drop_stopwords():
+    assert fts_terms(Q) == ["purpose", "lockout", "tagout", "procedure", "machine"]
+    assert fts_terms("What is it and why are they there?") == []
+
+def test_match_expr(tmp_path):
+    db = tmp_path / "chunks.db"
+    sqlite3.connect(db).close()
+    ks = KeywordSearch(str(db))
+    con = sqlite3.connect(":memory:")  # no chunks_vocab: every term is kept
+    ph = ['"purpose"', '"lockout"', '"tagout"', '"procedure"', '"machine"']
+    near = [f"NEAR({a} {b}, 5)" for a, b in zip(ph, ph[1:])]
+    assert ks.match_expr(con, Q) == " OR ".join(near + ph)
+    assert ks.match_expr(con, "What is it and why are they there?") is None
+    # operator words are quoted as plain terms
+    assert ks.match_expr(con, "NEAR") == '"near"'
@@ -0,0 +1,27 @@
+from methods.fusion import fuse
+
+VC = [("1", 0.9), ("2", 0.5), ("3", 0.2)]  # vector candidates: Chroma ids are strings
+FC = [(2, 7.0), (4, 1.0)]  # keyword candidates: SQLite rowids are ints
+
+def test_fuse_merges_by_id_across_str_and_int():
+    for s in ("minmax", "rrf"):
+        out = fuse(VC, FC, k=10, strategy=s)
+        assert sorted(r["id"] for r in out) == ["1", "2", "3", "4"]
+        both = next(r for r in out if r["id"] == "2")
+        assert both["vector_score"] > 0 and both["fts_score"] > 0
+
+def test_scores_stay_in_unit_range():
+    for s in ("minmax", "rrf"):
+        for r in fuse(VC, FC, k=10, strategy=s):
+            for f in ("vector_score", "fts_score", "hybrid_score"): assert 0.0 <= r[f] <= 1.0
+
+def test_rrf_top_score_is_one():
+    out = fuse([("1", 0.9), ("2", 0.5)], [(1, 3.0), (2, 1.0)], k=2, strategy="rrf")
+    assert out[0]["id"] == "1"
+    assert out[0]["hybrid_score"] == 1.0
+    assert out[0]["vector_score"] == out[0]["fts_score"] == 1.0
+
+def test_rrf_clears_the_answer_threshold_like_minmax():
+    # methods.answer abstains below 0.5: a rank-1 vector hit alone must clear it under either strategy
+    for s in ("minmax", "rrf"):
+        assert fuse(VC, [], k=1, strategy=s)[0]["hybrid_score"] >= 0.5
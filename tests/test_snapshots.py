@@ -0,0 +1,24 @@
+import os
+import methods.snapshots as snapshots
+from methods.snapshots import SnapshotManager, new_snapshot, publish
+
+def test_old_snapshot_released_after_last_pin(tmp_path, monkeypatch):
+    closed = []
+    monkeypatch.setattr(snapshots, "release", closed.append)
+    root = str(tmp_path)
+    publish(root, new_snapshot(root))
+    m = SnapshotManager(root, lambda name, path: (None, None), check_s=0)
+    assert m.version() == "v0001"
+
+    a, b = m.acquire(), m.acquire()  # two requests pinned to v0001
+    publish(root, new_snapshot(root, "v0001"))
+    assert m.refresh(force=True)
+    assert m.version() == "v0002" and a.name == b.name == "v0001"
+    assert closed == []
+
+    a.release()
+    assert closed == []
+    b.release()
+    assert closed == [os.path.join(root, "v0001")]
+    with m.use() as s: assert s.name == "v0002"
+    assert closed == [os.path.join(root, "v0001")]
@@ -0,0 +1,150 @@
+"""
+Ranking quality of the vector, hybrid and learned rankings on labeled queries, with a sweep over the fusion
+weight a (hybrid) and the logistic-regression C (learned) run on a process pool. Queries are encoded in
+batches and retrieved once; every configuration then works on the same columnar feature matrix. A candidate
+is relevant when it contains one of its query's keywords, as in training. The learned ranking is scored
+out of fold (queries split into --folds groups), so it is never scored on queries it was trained on.
+Reports MRR, nDCG@k and recall@k per mode and setting; --save retrains with the best C on every query.
+
+    python -m train_model.evaluate [--data queries.jsonl] [--backend numpy] [--shards shards] [--k 10] [--save model/learned_reranker.pkl]
+"""
+import os, time, pickle, argparse, numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from methods.encoders import load_encoder
+from methods.vector_index import get_vector_index
+from methods.fts import KeywordSearch
+from methods.fusion import fuse, fusion_strategy
+from methods.features import feature_matrix, get_stats
+from methods.scorers import load_scorer
+from train_model.train_learned_reranker import load_training_data, encode_queries, retrieve, labels, fit_reranker
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+A_GRID = (0.0, 0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 1.0)
+C_GRID = (0.01, 0.1, 1.0, 10.0, 100.0)
+
+class Pool(NamedTuple):
+    X: np.ndarray  # feature_matrix rows of every query's fused candidates
+    y: np.ndarray
+    off: np.ndarray  # query i's rows are off[i]:off[i + 1]
+
+def rank_metrics(rels: List[np.ndarray], n_rel: Sequence[int], k: int) -> Dict[str, float]:
+    """Mean MRR, nDCG@k and recall@k over the queries with at least one relevant candidate. rels[i] is the
+    0/1 relevance of query i's ranking, best first; n_rel[i] its number of relevant candidates."""
+    disc = 1 / np.log2(np.arange(2, k + 2))
+    mrr, ndcg, rec = [], [], []
+    for r, n in zip(rels, n_rel):
+        if not n: continue
+        r = np.asarray(r, np.float64)
+        hit = np.flatnonzero(r)
+        mrr.append(1 / (hit[0] + 1) if len(hit) else 0.0)
+        top = r[:k]
+        ndcg.append(float(top @ disc[:len(top)] / disc[:min(n, k)].sum()))
+        rec.append(top.sum() / n)
+    f = lambda x: float(np.mean(x)) if x else 0.0
+    return {"queries": len(mrr), "mrr": f(mrr), f"ndcg@{k}": f(ndcg), f"recall@{k}": f(rec)}
+
+def _ranked(p: Pool, scores: np.ndarray) -> List[np.ndarray]:
+    return [p.y[a:b][np.argsort(-scores[a:b], kind="stable")] for a, b in zip(p.off[:-1], p.off[1:])]
+
+def n_relevant(p: Pool) -> np.ndarray:
+    return np.add.reduceat(p.y, p.off[:-1]) if len(p.y) else np.zeros(len(p.off) - 1, np.int64)
+
+def hybrid_scores(p: Pool, a: float) -> np.ndarray:
+    # columns 0 and 1 are the fused, normalised vector and keyword scores (methods.features.FEATURES)
+    return a * p.X[:, 0] + (1 - a) * p.X[:, 1]
+
+def out_of_fold(p: Pool, C: float, folds: int) -> np.ndarray:
+    """Learned scores for every row from a model trained on the other folds' queries."""
+    nq = len(p.off) - 1
+    qfold = np.arange(nq) % folds
+    rfold = np.repeat(qfold, np.diff(p.off))
+    out = np.zeros(len(p.y))
+    for f in range(folds):
+        test, train = rfold == f, rfold != f
+        if not test.any(): continue
+        if len(np.unique(p.y[train])) < 2: continue  # nothing to learn from: every candidate scores 0
+        out[test] = fit_reranker(p.X[train], p.y[train], C).predict_proba(p.X[test])[:, 1]
+    return out
+
+_pool: Optional[Pool] = None
+
+def _init(p):
+    global _pool
+    _pool = p
+
+def _job(job):
+    mode, v, k, folds = job
+    s = hybrid_scores(_pool, v) if mode == "hybrid" else out_of_fold(_pool, v, folds)
+    return job, rank_metrics(_ranked(_pool, s), n_relevant(_pool), k)
+
+def sweep(p: Pool, k: int = 10, folds: int = 5, a_grid=A_GRID, c_grid=C_GRID, workers: Optional[int] = None):
+    """Metrics of every hybrid a and learned C, as ((mode, value, k, folds), metrics) pairs in grid order."""
+    folds = max(2, min(folds, len(p.off) - 1))
+    jobs = [("hybrid", a, k, folds) for a in a_grid] + [("learned", c, k, folds) for c in c_grid]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init(p)
+        return [_job(j) for j in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(p,)) as ex: return list(ex.map(_job, jobs))
+
+def _row(name, m, k):
+    return f"{name:<22} {m['queries']:>7} {m['mrr']:>7.4f} {m[f'ndcg@{k}']:>8.4f} {m[f'recall@{k}']:>9.4f}"
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", help="labeled queries, JSON list or JSON lines of {query, keywords}; default: train_model/questions.py")
+    ap.add_argument("--db", default=os.path.join(ROOT_DIR, "sql_store", "chunks.db"))
+    ap.add_argument("--chroma", default=os.path.join(ROOT_DIR, "chromadb_store"))
+    ap.add_argument("--vec-path", default=os.path.join(ROOT_DIR, "vector_store"))
+    ap.add_argument("--backend", default="chroma")
+    ap.add_argument("--shards", help="a sharded index root (ingest.py --shards) instead of --db/--chroma")
+    ap.add_argument("--model", default=os.path.join(ROOT_DIR, "model", "learned_reranker.pkl"), help="also score this trained reranker, if it exists")
+    ap.add_argument("--fusion", default=fusion_strategy(), help="fusion strategy the features are built with, as DocSearch(fusion=...); default: FUSION or minmax")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--cand-k", type=int, default=20, help="vector candidates per query")
+    ap.add_argument("--fts-k", type=int, default=30, help="keyword candidates per query")
+    ap.add_argument("--folds", type=int, default=5)
+    ap.add_argument("--workers", type=int, help="sweep processes (default: one per core)")
+    ap.add_argument("--threads", type=int, default=4, help="candidate retrieval threads")
+    ap.add_argument("--save", help="train on every query with the best C and pickle the reranker here")
+    a = ap.parse_args()
+
+    if a.shards:
+        from methods.shards import ShardSet
+        index = kw = ShardSet(a.shards, backend=a.backend); stats = index.stats
+    else:
+        index, kw, stats = get_vector_index(a.backend, chroma_path=a.chroma, db_path=a.db, vec_path=a.vec_path), KeywordSearch(a.db), get_stats(a.db)
+    data = load_training_data(a.data)
+    qs = [d["query"] for d in data]
+    model = load_encoder()
+
+    t = [time.perf_counter()]
+    lap = lambda: (t.append(time.perf_counter()), f"{t[-1] - t[-2]:.2f}s")[1]
+    qes = encode_queries(model, qs); te = lap()
+    vcs, fcs = retrieve(qs, qes, index, kw, a.cand_k, a.fts_k, workers=a.threads); tr = lap()
+    cands = [fuse(vc, fc, k=len(vc) + len(fc), strategy=a.fusion) for vc, fc in zip(vcs, fcs)]
+    p = Pool(feature_matrix(qs, cands, stats), labels(cands, data), np.cumsum([0] + [len(c) for c in cands]))
+    tf = lap()
+    print(f"{len(qs)} queries, {len(p.y)} candidates ({int(p.y.sum())} relevant): encode {te}, retrieve {tr}, features {tf}")
+
+    res = sweep(p, a.k, a.folds, workers=a.workers); ts = lap()
+    print(f"sweep of {len(res)} settings: {ts}\n")
+    print(f"{'mode':<22} {'queries':>7} {'mrr':>7} {f'ndcg@{a.k}':>8} {f'recall@{a.k}':>9}")
+    vrel = labels([[{"doc": c[1]} for c in vc] for vc in vcs], data)
+    voff = np.cumsum([0] + [len(vc) for vc in vcs])
+    print(_row("vector", rank_metrics([vrel[i:j] for i, j in zip(voff[:-1], voff[1:])], n_relevant(p), a.k), a.k))
+    for (mode, v, _, folds), m in res: print(_row(f"{mode} ({'a' if mode == 'hybrid' else 'C'}={v:g})", m, a.k))
+    if os.path.exists(a.model):
+        print(_row("learned (saved model)", rank_metrics(_ranked(p, load_scorer(a.model).score(p.X)), n_relevant(p), a.k), a.k))
+
+    best = max((r for r in res if r[0][0] == "learned"), key=lambda r: r[1][f"ndcg@{a.k}"])
+    print(f"\nbest learned C={best[0][1]:g} (out of fold over {best[0][3]} folds)")
+    if a.save:
+        os.makedirs(os.path.dirname(os.path.abspath(a.save)), exist_ok=True)
+        with open(a.save, "wb") as f: pickle.dump(fit_reranker(p.X, p.y, best[0][1]), f)
+        print(f"saved to {a.save}")
+
+if __name__ == "__main__":
+    main()
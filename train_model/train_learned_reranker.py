@@ -1,61 +1,68 @@
-import sqlite3, re, pickle, numpy as np
-import chromadb
-from chromadb.config import Settings
+import json, pickle, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
 from sentence_transformers import SentenceTransformer
 from sklearn.linear_model import LogisticRegression
+from methods.vector_index import get_vector_index
+from methods.fts import KeywordSearch
+from methods.fusion import fuse, fusion_strategy
+from methods.features import feature_matrix, get_stats
 from .questions import training_data
 
-def extract_features(q, m, vs, fs):
-    th = int(any(w.lower() in m.get("doc_title", "").lower() for w in q.split()))
-    ql = len(q.split())
-    cl = len(m.get("content", "").split())
-    itc = int(m.get("chunk_index", 0) == 0)
-    return [vs, fs, th, ql, cl, itc]
+def load_training_data(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Labeled queries ({"query", "keywords"}) from a JSON list or a JSON-lines file; the bundled questions by default."""
+    if path is None: return training_data
+    with open(path, encoding="utf-8") as f:
+        txt = f.read()
+    return json.loads(txt) if txt.lstrip().startswith("[") else [json.loads(l) for l in txt.splitlines() if l.strip()]
 
+def encode_queries(model, qs, batch_size=64):
+    return model.encode(list(qs), batch_size=batch_size, show_progress_bar=False).tolist()
 
-def get_candidates(q, qe, mod, coll, dp="chunks.db", k=20):
-    v_res = coll.query(query_embeddings=[qe], n_results=k)
+def retrieve(qs, qes, index, kw, k=20, fts_k=30, batch=256, workers=4):
+    """Vector and keyword candidates for every query, batch queries at a time on a thread pool
+    (numpy, Chroma and SQLite release the GIL while they search)."""
+    spans = [slice(i, i + batch) for i in range(0, len(qs), batch)]
+    run = lambda s: (index.query(qes[s], k), kw.search(qs[s], fts_k))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(spans)))) as ex: parts = list(ex.map(run, spans))
+    return [v for p in parts for v in p[0]], [f for p in parts for f in p[1]]
 
-    con = sqlite3.connect(dp); con.row_factory = sqlite3.Row; cur = con.cursor()
-    qc = re.sub(r"[^\w\s]", "", q); qe_ = qc.replace('"', '""'); fts_q = f'"{qe_}"'
-    cur.execute(f"""SELECT c.id, c.doc_name, c.doc_title, c.chunk_index, c.page_num, c.content, bm25(chunks_fts) AS score FROM chunks c JOIN chunks_fts fts ON c.id = fts.rowid WHERE chunks_fts MATCH {fts_q} ORDER BY score LIMIT 30""")
-    fts_rows = cur.fetchall(); con.close()
+def get_candidates(qs, qes, index, kw, k=20, fts_k=30, strategy="minmax", a=0.6, **kw_retrieve):
+    """Fused candidates per query, built the way DocSearch builds them at query time (same strategy,
+    a=0.6), but keeping every candidate so the model sees a wider score range."""
+    vcs, fcs = retrieve(qs, qes, index, kw, k, fts_k, **kw_retrieve)
+    return [fuse(vc, fc, k=len(vc) + len(fc), strategy=strategy, a=a) for vc, fc in zip(vcs, fcs)]
 
-    cands = []
-    for i, cid in enumerate(v_res["ids"][0]):
-        meta = v_res["metadatas"][0][i]; doc = v_res["documents"][0][i]; vs = 1 - v_res["distances"][0][i]
-        fs = next((r["score"] for r in fts_rows if r["id"] == cid), 0)
-        meta = dict(meta); meta["content"] = doc
-        cands.append((meta, vs, fs))
+def labels(cands, data) -> np.ndarray:
+    """1 for every candidate whose text contains one of its query's keywords (case-insensitive), else 0, for
+    every candidate of every query, stacked like feature_matrix rows."""
+    out = []
+    for cs, item in zip(cands, data):
+        kws = [k.lower() for k in item["keywords"]]
+        out += [any(k in (c["doc"] or "").lower() for k in kws) for c in cs]
+    return np.array(out, dtype=np.int64)
 
-    return cands
+def fit_reranker(X, y, C=1.0) -> LogisticRegression:
+    clf = LogisticRegression(class_weight="balanced", max_iter=1000, C=C)
+    return clf.fit(X, y)
 
-def label_candidate(c, kw):
-    txt = c["content"].lower()
-    return int(any(k.lower() in txt for k in kw))
+def train_model(model, chroma_path, db_path, model_save_path, shards=None, data=None, strategy=None, C=1.0, workers=4):
+    # the fused scores are features: train on the strategy the API serves (FUSION) unless told otherwise
+    strategy = strategy or fusion_strategy()
+    # a methods.shards.ShardSet searches every shard, like DocSearch does when serving a sharded index
+    if shards is not None: index, kw, stats = shards, shards, shards.stats
+    else: index, kw, stats = get_vector_index("chroma", chroma_path=chroma_path), KeywordSearch(db_path), get_stats(db_path)
 
-def train_model(model, chroma_path, db_path, model_save_path):
-    
-    cli = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
-    coll = cli.get_collection("safety_docs")
-    
+    data = data if data is not None else training_data
+    qs = [item["query"] for item in data]
+    print(f"Processing {len(qs)} training queries")
+    cands = get_candidates(qs, encode_queries(model, qs), index, kw, strategy=strategy, workers=workers)
 
-    X, y = [], []
+    # same feature pipeline as serving (methods.features)
+    X = feature_matrix(qs, cands, stats)
+    y = labels(cands, data)
 
-    for item in training_data:
-        q = item["query"]; kw = item["keywords"]
-        print(f"Processing query: {q}")
-
-        qe = model.encode([q]).tolist()[0]
-        cands = get_candidates(q, qe, model, coll, dp=db_path)
-
-        for meta, vs, fs in cands:
-            feats = extract_features(q, meta, vs, fs)
-            lbl = label_candidate(meta, kw)
-            X.append(feats); y.append(lbl)
-
-    clf = LogisticRegression(class_weight="balanced", max_iter=1000)
-    clf.fit(X, y)
+    clf = fit_reranker(X, y, C)
 
     with open(model_save_path, "wb") as f: pickle.dump(clf, f)
 